@@ -0,0 +1,202 @@
+"""
+Vectorized aggregation engine behind the averaging functions in music_feature.
+Rather than rescanning the whole song dataframe once for every year and every
+feature, each song is mapped to the offset of its year within the requested
+time period once, and the counts and sums of all the requested features are
+then accumulated for all of the years together in a single grouped pass.
+"""
+
+# Import the required libraries.
+import datetime
+import numpy as np
+import pandas as pd
+
+
+def year_offsets(dates, start_date, end_date):
+    """
+    Return the offset of each chart date's year from the start of the time
+    period, or -1 for dates that are not counted in the time period.
+
+    Only the June 1st Billboard snapshots are counted, which matches the dates
+    the songs in the dataset were scraped on. Each distinct date is parsed
+    once (the dates repeat for every song on a chart), so strings, date
+    objects and numpy datetimes are all handled quickly.
+
+    Args:
+        dates: A Pandas series or array-like containing the date each song
+        featured on the Billboard Hot 100, either as strings such as
+        '2020-06-01', date objects, or datetimes.
+
+        start_date: An integer containing the first year of the time period.
+
+        end_date: An integer that must be greater than or equal to start_date
+        containing the last year of the time period.
+
+    Returns:
+        offsets: A numpy integer array with one entry per song containing the
+        number of years between start_date and the year the song featured, or
+        -1 if the song is outside the time period or not on a June 1st chart.
+    """
+    # Parse each distinct date only once and map the result back to the songs.
+    codes, uniques = pd.factorize(pd.Series(dates))
+    unique_dates = pd.DatetimeIndex(pd.to_datetime(uniques))
+
+    # Work out the offset of each distinct date and mark the ones to skip.
+    unique_offsets = np.asarray(unique_dates.year - start_date)
+    counted = (np.asarray(unique_dates.month) == 6) & \
+    (np.asarray(unique_dates.day) == 1) & (unique_offsets >= 0) & \
+    (unique_offsets <= end_date - start_date)
+    unique_offsets = np.where(counted, unique_offsets, -1)
+
+    # Songs with a missing date are given a code of -1 by factorize.
+    return np.where(codes >= 0, unique_offsets[codes], -1).astype(np.int64)
+
+
+def feature_sums(offsets, values, year_count):
+    """
+    Return the number of songs and the sum of each feature for every year.
+
+    The year offset of every song is combined with the column number of every
+    feature into a single cell number, so one call to numpy's bincount counts
+    and sums every feature for every year at once. Missing (NaN) feature
+    values are skipped.
+
+    Args:
+        offsets: A numpy integer array containing the year offset of each song,
+        as returned by year_offsets. Songs with an offset of -1 are skipped.
+
+        values: A two dimensional numpy array with one row per song and one
+        column per feature containing the feature values.
+
+        year_count: An integer containing the number of years in the time
+        period.
+
+    Returns:
+        counts: A numpy array with one row per year and one column per feature
+        containing the number of songs counted.
+
+        sums: A numpy array with one row per year and one column per feature
+        containing the sum of the feature values.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    feature_count = values.shape[1]
+
+    # Keep only the songs within the time period.
+    selected = offsets >= 0
+    block = values[selected]
+
+    # Number every (year, feature) cell and drop the missing values.
+    cells = offsets[selected][:, np.newaxis] * feature_count + \
+    np.arange(feature_count)
+    present = ~np.isnan(block)
+
+    # Count and sum all the cells in one pass each.
+    cell_count = year_count * feature_count
+    counts = np.bincount(cells[present], minlength=cell_count)
+    sums = np.bincount(cells[present], weights=block[present], \
+    minlength=cell_count)
+    return counts.reshape(year_count, feature_count), \
+    sums.reshape(year_count, feature_count)
+
+
+def key_counts(offsets, keys, year_count, modes=None):
+    """
+    Return the number of songs in each key (and optionally each mode) for
+    every year.
+
+    Like feature_sums, the year offset and key of every song are combined
+    into a single cell number so that one call to numpy's bincount fills the
+    whole count matrix.
+
+    Args:
+        offsets: A numpy integer array containing the year offset of each song,
+        as returned by year_offsets. Songs with an offset of -1 are skipped.
+
+        keys: A numpy integer array containing the key index of each song,
+        from 0 (C) to 11 (B). Songs without a detected key (-1) are skipped.
+
+        year_count: An integer containing the number of years in the time
+        period.
+
+        modes: A numpy integer array containing the mode of each song (0 for
+        minor and 1 for major), or None to count the keys only. Songs with
+        a missing mode are skipped.
+
+    Returns:
+        A numpy integer array with one row per year and one column per key,
+        with a third axis of length two for the modes if modes is given.
+    """
+    keys = np.asarray(keys, dtype=np.float64)
+    selected = (offsets >= 0) & (keys >= 0) & (keys < 12)
+    shape = (year_count, 12)
+    if modes is not None:
+        modes = np.asarray(modes, dtype=np.float64)
+        selected &= (modes == 0) | (modes == 1)
+        shape = (year_count, 12, 2)
+
+    # Number every (year, key, mode) cell and count them all in one pass.
+    cells = offsets[selected] * 12 + keys[selected].astype(np.int64)
+    if modes is not None:
+        cells = cells * 2 + modes[selected].astype(np.int64)
+    return np.bincount(cells, minlength=int(np.prod(shape))).reshape(shape)
+
+
+def frame_feature_sums(start_date, end_date, features, song_dataframe):
+    """
+    Return the yearly song counts and feature sums of a song dataframe.
+
+    Args:
+        start_date: An integer containing the first year of the time period.
+
+        end_date: An integer containing the last year of the time period.
+
+        features: A list of strings containing the names of the features to be
+        summed, such as ['duration_ms', 'instrumentalness'].
+
+        song_dataframe: A Pandas dataframe containing a Date column and a
+        column for each of the features.
+
+    Returns:
+        A tuple of the counts and sums arrays described in feature_sums.
+    """
+    offsets = year_offsets(song_dataframe["Date"], start_date, end_date)
+    values = song_dataframe[list(features)].to_numpy(dtype=np.float64, \
+    na_value=np.nan)
+    return feature_sums(offsets, values, end_date - start_date + 1)
+
+
+def average_frame(start_date, end_date, features, counts, sums):
+    """
+    Return the long format dataframe of yearly averages used for plotting.
+
+    Args:
+        start_date: An integer containing the first year of the time period.
+
+        end_date: An integer containing the last year of the time period.
+
+        features: A list of strings containing the names of the features.
+
+        counts: A numpy array with one row per year and one column per feature
+        containing the number of songs counted.
+
+        sums: A numpy array with one row per year and one column per feature
+        containing the sum of the feature values.
+
+    Returns:
+        A Pandas dataframe with the columns Date, Feature and Average, with
+        the years of the first feature followed by the years of the next. The
+        average of a year without any songs is NaN.
+    """
+    # Divide the sums by the counts, leaving NaN where no songs were counted.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        averages = np.where(counts > 0, sums / counts, np.nan)
+
+    years = [datetime.date(year, 6, 1) for year in range(start_date, \
+    end_date + 1)]
+
+    # Lay out the averages feature by feature, as the plots expect.
+    return pd.DataFrame({
+        "Date": years * len(features),
+        "Feature": [feature for feature in features for _ in years],
+        "Average": averages.T.reshape(-1),
+    })
@@ -0,0 +1,219 @@
+"""
+The storage shared by ChartStore and TrackStore. Both keep the songs of the
+charts once, in a table of items, and every chart appearance as a row of
+small integers: the chart date and the item. The averaging and key functions
+in music_feature accept either store in place of the song dataframe, and
+only read the feature columns they need from the items table, without
+joining the two tables.
+"""
+
+# Import the required libraries.
+import abc
+import os
+import numpy as np
+import pandas as pd
+
+import aggregation
+import parallel_analytics
+import song_storage
+
+
+class AppearanceStore(abc.ABC):
+    """
+    A table of unique items and a table of their chart appearances.
+
+    Subclasses set ITEMS_FILE and ITEM_COLUMN, and choose which years the
+    appearances are counted in with appearance_offsets.
+
+    Attributes:
+        dates: A numpy datetime64[D] array containing every chart date, in
+        order.
+        items: A Pandas dataframe with one row per unique item, whose row
+        number is the item's number.
+        date_ids: A numpy int16 array containing the position in dates of the
+        chart of each appearance.
+        item_ids: A numpy int32 array containing the number of the item of
+        each appearance.
+    """
+
+    # The name of the file the items table is saved as, and the column of the
+    # appearances file holding the number of each appearance's item.
+    ITEMS_FILE = "items.parquet"
+    ITEM_COLUMN = "Item"
+
+    def __init__(self, dates, items, date_ids, item_ids):
+        self.dates = np.asarray(dates, dtype="datetime64[D]")
+        self.items = items.reset_index(drop=True)
+        self.date_ids = np.asarray(date_ids, dtype=np.int16)
+        self.item_ids = np.asarray(item_ids, dtype=np.int32)
+
+    @staticmethod
+    def split_frame(dataframe, item_ids, dropped=("Date",)):
+        """
+        Return the chart dates, items table, and date numbers of a dataframe
+        with one row per chart appearance.
+
+        Args:
+            dataframe: A Pandas dataframe with a Date column.
+            item_ids: A numpy integer array containing the number of the item
+            of each row, numbered in the order the items first appear.
+            dropped: The columns left out of the items table, besides the
+            redundant columns listed in song_storage.
+
+        Returns:
+            A tuple of the dates, the items table (the columns of the first
+            row of each item), and the date numbers of the rows.
+        """
+        date_ids, dates = pd.factorize(pd.to_datetime(dataframe["Date"]), \
+        sort=True)
+        first_rows = np.unique(item_ids, return_index=True)[1]
+        items = dataframe.drop(columns=[column for column in list(dropped) \
+        + song_storage.REDUNDANT_COLUMNS if column in dataframe.columns])\
+        .iloc[first_rows]
+        return dates.values.astype("datetime64[D]"), items, date_ids
+
+    def __len__(self):
+        """
+        Return the number of chart appearances.
+        """
+        return len(self.item_ids)
+
+    def to_frame(self, columns=None):
+        """
+        Return the store as one row per chart appearance, in the format of
+        the song dataset.
+
+        Args:
+            columns: A list of strings containing the item columns to
+            include, or None to include every column of the items table.
+
+        Returns:
+            A Pandas dataframe with the Date of every appearance followed by
+            the columns of its item.
+        """
+        items = self.items if columns is None else self.items[columns]
+        frame = items.iloc[self.item_ids].reset_index(drop=True)
+        frame.insert(0, "Date", pd.to_datetime(self.dates[self.date_ids]))
+        return frame
+
+    @abc.abstractmethod
+    def appearance_offsets(self, start_date, end_date):
+        """
+        Return the offset of each appearance's year from the start of the time
+        period, or -1 for appearances not counted.
+
+        Args:
+            start_date: An integer containing the first year of the period.
+            end_date: An integer containing the last year of the period.
+
+        Returns:
+            A numpy integer array with one entry per appearance.
+        """
+
+    def feature_sums(self, start_date, end_date, features, processes=None):
+        """
+        Return the yearly appearance counts and feature sums of a time period,
+        in the format returned by aggregation.frame_feature_sums. An item is
+        counted once for every chart appearance counted.
+
+        Args:
+            start_date: An integer containing the first year of the period.
+            end_date: An integer containing the last year of the period.
+            features: A list of strings containing the names of the features.
+            processes: An integer containing the largest number of processes
+            the appearances are counted in (see parallel_analytics), or None
+            to count them in this process.
+
+        Returns:
+            A tuple of the counts and sums arrays, with one row per year and
+            one column per feature.
+        """
+        values = self.items[list(features)].to_numpy(dtype=np.float64, \
+        na_value=np.nan)[self.item_ids]
+        offsets = self.appearance_offsets(start_date, end_date)
+        if processes is None:
+            return aggregation.feature_sums(offsets, values, end_date - \
+            start_date + 1)
+        return parallel_analytics.feature_sums(offsets, values, end_date - \
+        start_date + 1, processes)
+
+    def key_counts(self, start_date, end_date, by_mode=False, \
+    processes=None):
+        """
+        Return the number of appearances in each key for every year of a time
+        period, in the format returned by aggregation.key_counts.
+
+        Args:
+            start_date: An integer containing the first year of the period.
+            end_date: An integer containing the last year of the period.
+            by_mode: A boolean that is True to keep the modes apart.
+            processes: An integer containing the largest number of processes
+            the appearances are counted in (see parallel_analytics), or None
+            to count them in this process.
+
+        Returns:
+            A numpy integer array with one row per year and one column per
+            key, with a third axis for the modes if by_mode is True.
+        """
+        keys = self.items["key"].to_numpy(dtype=np.float64, \
+        na_value=np.nan)[self.item_ids]
+        modes = self.items["mode"].to_numpy(dtype=np.float64, \
+        na_value=np.nan)[self.item_ids] if by_mode else None
+        offsets = self.appearance_offsets(start_date, end_date)
+        if processes is None:
+            return aggregation.key_counts(offsets, keys, end_date - \
+            start_date + 1, modes)
+        return parallel_analytics.key_counts(offsets, keys, end_date - \
+        start_date + 1, modes, processes)
+
+    def appearances(self):
+        """
+        Return the appearances table saved by save, with the Date and the
+        item number of every appearance.
+        """
+        return pd.DataFrame({"Date": self.dates[self.date_ids], \
+        self.ITEM_COLUMN: self.item_ids})
+
+    def save(self, directory):
+        """
+        Save the store as two Parquet files in a folder, with the item
+        columns stored as the types in song_storage.SCHEMA.
+
+        Args:
+            directory: A string containing the path of the folder.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.items.astype(song_storage.stored_types(self.items.columns))\
+        .to_parquet(os.path.join(directory, self.ITEMS_FILE), index=False)
+        self.appearances().to_parquet(os.path.join(directory, \
+        "appearances.parquet"), index=False)
+
+    @classmethod
+    def load(cls, directory, columns=None):
+        """
+        Return the store saved in a folder by save.
+
+        Args:
+            directory: A string containing the path of the folder.
+            columns: A list of strings containing the item columns to read,
+            or None to read every column.
+
+        Returns:
+            A store of the class load is called on.
+        """
+        items = pd.read_parquet(os.path.join(directory, cls.ITEMS_FILE), \
+        columns=columns)
+        items = items.astype(song_storage.stored_types(items.columns, \
+        categories_only=True))
+        appearances = pd.read_parquet(os.path.join(directory, \
+        "appearances.parquet"))
+        date_ids, dates = pd.factorize(appearances["Date"], sort=True)
+        return cls.from_appearances(dates.values.astype("datetime64[D]"), \
+        items, date_ids, appearances)
+
+    @classmethod
+    def from_appearances(cls, dates, items, date_ids, appearances):
+        """
+        Return the store of an items table and a loaded appearances table.
+        """
+        return cls(dates, items, date_ids, appearances[cls.ITEM_COLUMN])
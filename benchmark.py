@@ -0,0 +1,899 @@
+"""
+Time every stage of building and analyzing the song dataset: downloading the
+charts from a made up Billboard provider, searching and requesting audio
+features from a local stub Spotify server that can be made slow or
+unreliable, and the analysis functions on synthetic song dataframes of
+increasing size. Run this file directly to print the results, save them as
+JSON, and compare them with the results of an earlier commit, for example:
+
+    python benchmark.py --output results.json
+    python benchmark.py --stages search features --latency 0.02 \\
+        --error-rate 0.05 --compare results.json
+"""
+
+# Import the required libraries.
+import argparse
+import contextlib
+import datetime
+import functools
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+import requests
+
+import billboard_scraper
+import feature_matrix
+import get_audio_features
+import music_feature
+import normalization
+import parallel_analytics
+import replay
+import song_query
+import song_storage
+import spotify_id_query
+from instrumentation import METRICS
+from resilient_request import RetryPolicy
+from spotify_client import SpotifyClient, TokenProvider
+from stub_spotify import StubSpotifyServer, stub_track_id
+from track_index import MIN_CONFIDENCE, TrackIndex
+
+# The song dataset provided with the repository.
+DATASET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+"track_features_by_date.csv")
+
+# The audio features averaged in the Jupyter notebook.
+BENCHMARK_FEATURES = ["acousticness", "danceability", "instrumentalness", \
+"duration_ms"]
+
+# The numbers of songs in the synthetic dataframes. The shipped dataset
+# contains roughly 5,500 songs.
+ROW_COUNTS = [5_000, 50_000, 500_000, 5_000_000]
+
+# The retry policy used against the stub server, with short delays so that
+# the injected errors cost retries rather than long waits.
+BENCHMARK_POLICY = RetryPolicy(max_attempts=6, base_delay=0.01, max_delay=0.1)
+
+# The columns of the results that are measurements rather than descriptions
+# of what was measured, used to line up results when comparing them.
+MEASUREMENT_COLUMNS = {"Seconds", "Microseconds Per Row", "Megabytes", \
+"Mean ms", "p95 ms", "Connections", "Speedup", "Per Second", "Requests"}
+
+
+class SyntheticChartData:
+    """
+    A stand-in for billboard.ChartData that makes up a Hot 100 chart for any
+    date after waiting as long as a download would take.
+
+    Attributes:
+        latency: A float containing the number of seconds each chart takes.
+    """
+    latency = 0.0
+
+    def __init__(self, name, date):
+        time.sleep(self.latency)
+        self.entries = [_SyntheticEntry(f"Song {rank} of {date}", \
+        f"Artist {rank % 40} featuring Guest") for rank in range(1, 101)]
+
+
+class _SyntheticEntry:
+    """
+    One entry of a SyntheticChartData chart.
+    """
+
+    def __init__(self, title, artist):
+        self.title = title
+        self.artist = artist
+
+
+@contextlib.contextmanager
+def stub_spotify(latency=0.0, error_rate=0.0):
+    """
+    Run a stub Spotify server and send the requests of spotify_id_query and
+    get_audio_features to it until the with block ends.
+
+    Args:
+        latency: A float containing the number of seconds the server waits
+        before answering each request.
+        error_rate: A float containing the fraction of requests answered
+        with a server error.
+
+    Yields:
+        The running StubSpotifyServer.
+    """
+    saved = (spotify_id_query.BASE_URL, spotify_id_query.token_provider, \
+    get_audio_features.BASE_URL)
+    with StubSpotifyServer(latency=latency, error_rate=error_rate) as server:
+        spotify_id_query.BASE_URL = server.base_url
+        get_audio_features.BASE_URL = server.base_url
+        spotify_id_query.token_provider = TokenProvider(server.auth_url, \
+        lambda: ("benchmark-client", "benchmark-secret"))
+        try:
+            yield server
+        finally:
+            spotify_id_query.BASE_URL, spotify_id_query.token_provider, \
+            get_audio_features.BASE_URL = saved
+
+
+def synthetic_songs(row_count, year_start=1961, year_end=2020, seed=0):
+    """
+    Return a randomly generated song dataframe in the same format as the
+    dataset stored in track_features_by_date.csv.
+
+    Args:
+        row_count: An integer containing the number of songs to generate.
+
+        year_start: An integer containing the first year of the songs' dates.
+
+        year_end: An integer containing the last year of the songs' dates.
+
+        seed: An integer used to seed the random number generator so that the
+        same dataframe is generated every time.
+
+    Returns:
+        A Pandas dataframe with a Date column of June 1st date strings and a
+        column for each audio feature used by the notebook, as well as key and
+        mode columns.
+    """
+    generator = np.random.default_rng(seed)
+    date_strings = np.array([str(datetime.date(year, 6, 1)) for year in \
+    range(year_start, year_end + 1)], dtype=object)
+
+    return pd.DataFrame({
+        "Date": date_strings[generator.integers(0, len(date_strings), \
+        row_count)],
+        "acousticness": generator.random(row_count),
+        "danceability": generator.random(row_count),
+        "instrumentalness": generator.random(row_count),
+        "duration_ms": generator.integers(90_000, 400_000, row_count),
+        "key": generator.integers(0, 12, row_count),
+        "mode": generator.integers(0, 2, row_count),
+    })
+
+
+def time_call(function, *args, repeats=3):
+    """
+    Return the fastest running time of a function over several calls.
+
+    Args:
+        function: The function to be timed.
+        *args: The arguments the function is called with.
+        repeats: An integer containing the number of times to call function.
+
+    Returns:
+        A float containing the shortest running time in seconds.
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def benchmark_analytics(row_counts=None):
+    """
+    Time music_feature.average_all and key_proportion on increasingly large
+    synthetic dataframes.
+
+    If the aggregation scales linearly with the number of songs, the time per
+    song stays roughly constant as the dataframes grow.
+
+    Args:
+        row_counts: A list of integers containing the sizes of the synthetic
+        dataframes. Defaults to ROW_COUNTS.
+
+    Returns:
+        A Pandas dataframe with the columns Function, Rows, Seconds, and
+        Microseconds Per Row.
+    """
+    results = []
+    for row_count in row_counts or ROW_COUNTS:
+        songs = synthetic_songs(row_count)
+        for name, function, args in [("average_all", \
+        music_feature.average_all, (1961, 2020, BENCHMARK_FEATURES, songs)), \
+        ("key_proportion", music_feature.key_proportion, (1961, 2020, \
+        songs))]:
+            seconds = time_call(function, *args)
+            results.append({"Function": name, "Rows": row_count, "Seconds": \
+            seconds, "Microseconds Per Row": seconds / row_count * 1e6})
+    return pd.DataFrame(results)
+
+
+def benchmark_scrape(year_count=20, latency=0.05, worker_counts=(1, \
+billboard_scraper.MAX_WORKERS)):
+    """
+    Time billboard_scraper.hot_100_data downloading charts from
+    SyntheticChartData with different numbers of threads.
+
+    Args:
+        year_count: An integer containing the number of June 1st charts.
+        latency: A float containing the number of seconds each chart takes to
+        download.
+        worker_counts: A tuple of integers containing the numbers of charts
+        downloaded at the same time.
+
+    Returns:
+        A Pandas dataframe with the columns Workers, Charts, Seconds, and
+        Per Second (charts downloaded per second).
+    """
+    SyntheticChartData.latency = latency
+    results = []
+    for workers in worker_counts:
+        seconds = time_call(billboard_scraper.hot_100_data, 2000, 2000 + \
+        year_count - 1, workers, None, SyntheticChartData, repeats=1)
+        results.append({"Workers": workers, "Charts": year_count, \
+        "Seconds": seconds, "Per Second": year_count / seconds})
+    return pd.DataFrame(results)
+
+
+def benchmark_search(song_count=500, latency=0.01, error_rate=0.0):
+    """
+    Time spotify_id_query.query_all_tracks searching a stub Spotify server
+    without a cache.
+
+    Args:
+        song_count: An integer containing the number of distinct songs.
+        latency: A float containing the number of seconds the server takes to
+        answer each request.
+        error_rate: A float containing the fraction of requests answered with
+        a server error, which are retried.
+
+    Returns:
+        A Pandas dataframe with the columns Songs, Latency, Error Rate,
+        Seconds, Per Second (songs searched per second), and Requests.
+    """
+    songs = pd.DataFrame({"Date": ["2020-06-01"] * song_count, "Song": \
+    [f"song {number}" for number in range(song_count)], "Artist": \
+    [f"artist {number % 50}" for number in range(song_count)]})
+    with stub_spotify(latency, error_rate) as server:
+        start = time.perf_counter()
+        spotify_id_query.query_all_tracks(songs, requests_per_second=1e6, \
+        cache=None, policy=BENCHMARK_POLICY)
+        seconds = time.perf_counter() - start
+        requests_sent = server.request_counts.get("/v1/search", 0)
+    return pd.DataFrame([{"Songs": song_count, "Latency": latency, \
+    "Error Rate": error_rate, "Seconds": seconds, "Per Second": song_count \
+    / seconds, "Requests": requests_sent}])
+
+
+def benchmark_track_index(csv_path=DATASET_PATH):
+    """
+    Time looking up the songs of the dataset in a TrackIndex built from it,
+    written as in the dataset and with the last letter of every title missing,
+    so that the songs can only be matched approximately.
+
+    Args:
+        csv_path: A string containing the path of the CSV dataset.
+
+    Returns:
+        A Pandas dataframe with the columns Lookup, Songs, Seconds,
+        Microseconds Per Song, and Matched (the fraction of songs matched with
+        at least track_index.MIN_CONFIDENCE to their own Track ID).
+    """
+    songs = pd.read_csv(csv_path, usecols=["Song", "Artist", "Track ID"])\
+    .drop_duplicates(["Song", "Artist"])
+    start = time.perf_counter()
+    index = TrackIndex.from_frame(songs)
+    results = [{"Lookup": "build", "Songs": len(songs), "Seconds": \
+    time.perf_counter() - start}]
+    for name, titles in [("exact", songs["Song"]), ("fuzzy", \
+    songs["Song"].str[:-1])]:
+        start = time.perf_counter()
+        matches = index.lookup_many(titles, songs["Artist"])
+        seconds = time.perf_counter() - start
+        matched = (matches["Track ID"].to_numpy() == songs["Track ID"]\
+        .to_numpy()) & (matches["Confidence"] >= MIN_CONFIDENCE).to_numpy()
+        results.append({"Lookup": name, "Songs": len(songs), "Seconds": \
+        seconds, "Matched": matched.mean()})
+    results = pd.DataFrame(results)
+    results["Microseconds Per Song"] = results["Seconds"] / \
+    results["Songs"] * 1e6
+    return results
+
+
+def benchmark_replay(year_count=5, latency=0.01):
+    """
+    Time a full run of the pipeline (charts, searches, and audio features)
+    against the stub servers while recording it, and then replayed from the
+    archive with no latency and with the same latency.
+
+    Args:
+        year_count: An integer containing the number of June 1st charts.
+        latency: A float containing the number of seconds the stub servers
+        take to answer each request while recording.
+
+    Returns:
+        A Pandas dataframe with the columns Mode, Latency, Songs, and Seconds.
+    """
+    SyntheticChartData.latency = latency
+
+    def run(session):
+        charts = billboard_scraper.hot_100_data(2000, 2000 + year_count - 1, \
+        chart_data=session.chart_data)
+        ids = spotify_id_query.query_all_tracks(charts, \
+        requests_per_second=1e6, cache=None, policy=BENCHMARK_POLICY)
+        return get_audio_features.find_audio_features(ids, cache=None, \
+        policy=BENCHMARK_POLICY)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "archive.sqlite")
+        with stub_spotify(latency) as server, replay.offline(path, \
+        mode="record", chart_data=SyntheticChartData) as session:
+            start = time.perf_counter()
+            songs = run(session)
+            results.append({"Mode": "record", "Latency": latency, "Songs": \
+            len(songs), "Seconds": time.perf_counter() - start})
+        for replay_latency in [0.0, latency]:
+            with replay.offline(path, latency=replay_latency) as session:
+                start = time.perf_counter()
+                songs = run(session)
+                results.append({"Mode": "replay", "Latency": replay_latency, \
+                "Songs": len(songs), "Seconds": time.perf_counter() - start})
+    return pd.DataFrame(results)
+
+
+def sequential_audio_features(id_dataframe, cache, policy):
+    """
+    Return the song dataframe with audio features requested the way
+    get_audio_features.find_audio_features did before it requested batches
+    from a pool of threads: the first Track ID alone, then one batch of 100 at
+    a time, growing the dataframe after each batch. Kept only to compare
+    against.
+    """
+    track_ids = id_dataframe["Track ID"].tolist()
+    track_id_master = list(dict.fromkeys(track_ids))
+    audio_dataframe = get_audio_features.id_to_audio_feature(\
+    [track_id_master[0]], cache, policy)
+    for start in range(1, len(track_id_master), 100):
+        audio_dataframe = pd.concat([audio_dataframe, \
+        get_audio_features.id_to_audio_feature(track_id_master[start:start \
+        + 100], cache, policy)], ignore_index=True)
+    audio_dataframe = audio_dataframe.iloc[pd.Index(track_id_master)\
+    .get_indexer(track_ids)].set_axis(id_dataframe.index)
+    return pd.concat([id_dataframe, audio_dataframe], axis=1)
+
+
+def benchmark_features(song_count=2_000, latency=0.01, error_rate=0.0):
+    """
+    Time get_audio_features.find_audio_features requesting the audio
+    features of made up Track IDs from a stub Spotify server without a cache,
+    and the sequential loop it replaced.
+
+    Args:
+        song_count: An integer containing the number of songs.
+        latency: A float containing the number of seconds the server takes to
+        answer each request.
+        error_rate: A float containing the fraction of requests answered with
+        a server error, which are retried.
+
+    Returns:
+        A Pandas dataframe with the columns Songs, Latency, Error Rate,
+        Implementation, Seconds, Per Second (songs per second), and Requests.
+    """
+    id_dataframe = pd.DataFrame({"Date": ["2020-06-01"] * song_count, \
+    "Song": [f"song {number}" for number in range(song_count)], "Artist": \
+    "artist", "Track ID": [stub_track_id(f"song {number}") for number in \
+    range(song_count)]})
+    results = []
+    for name, function in [("sequential", sequential_audio_features), \
+    ("thread pool", functools.partial(get_audio_features.find_audio_features, \
+    requests_per_second=1e6))]:
+        with stub_spotify(latency, error_rate) as server:
+            start = time.perf_counter()
+            function(id_dataframe, cache=None, policy=BENCHMARK_POLICY)
+            seconds = time.perf_counter() - start
+            requests_sent = server.request_counts.get("/v1/audio-features/", \
+            0)
+        results.append({"Songs": song_count, "Latency": latency, \
+        "Error Rate": error_rate, "Implementation": name, "Seconds": seconds, \
+        "Per Second": song_count / seconds, "Requests": requests_sent})
+    return pd.DataFrame(results)
+
+
+def groupby_key_proportion(start_date, end_date, song_dataframe):
+    """
+    Return the key proportions computed the way music_feature.key_proportion
+    did before it used a count matrix: a grouped count followed by a Python
+    call per year. Kept only to compare against.
+
+    Args:
+        start_date: An integer containing the first year of the time period.
+        end_date: An integer containing the last year of the time period.
+        song_dataframe: A Pandas dataframe containing the song dataset.
+
+    Returns:
+        A Pandas dataframe with the columns Date, Key, Count, and Proportion.
+    """
+    year_list = [str(datetime.date(year, 6, 1)) for year in range(start_date, \
+    end_date + 1)]
+    dates = song_dataframe["Date"].astype(str)
+    time_span_dataframe = song_dataframe[dates.isin(year_list)].assign(\
+    Date=dates, key=lambda frame: frame["key"].astype(int))
+    key_dataframe = time_span_dataframe.groupby(by=["Date", "key"]).count()
+    key_dataframe = key_dataframe.drop(\
+    key_dataframe.columns[range(1, len(key_dataframe.columns))], axis=1)
+    key_proportions = key_dataframe.groupby(level=0, group_keys=False).apply(\
+    lambda x: x / float(x.sum()))
+    key_dataframe_final = pd.concat([key_dataframe, key_proportions], \
+    axis=1).reset_index()
+    key_dataframe_final.columns = ["Date", "Key", "Count", "Proportion"]
+    key_dataframe_final["Key"] = key_dataframe_final["Key"].replace(\
+    range(12), music_feature.KEY_NAME_LIST)
+    return key_dataframe_final
+
+
+def benchmark_key_proportion(csv_path=DATASET_PATH, scales=(1, 100)):
+    """
+    Compare music_feature.key_proportion with the grouped implementation it
+    replaced on the shipped dataset repeated several times over.
+
+    Args:
+        csv_path: A string containing the path of the CSV dataset.
+        scales: A tuple of integers containing how many copies of the dataset
+        are stacked for each measurement.
+
+    Returns:
+        A Pandas dataframe with the columns Rows, Implementation, and Seconds.
+    """
+    songs = pd.read_csv(csv_path)
+    results = []
+    for scale in scales:
+        scaled_songs = pd.concat([songs] * scale, ignore_index=True)
+        for name, function in [("groupby", groupby_key_proportion), \
+        ("count matrix", music_feature.key_proportion)]:
+            results.append({"Rows": len(scaled_songs), "Implementation": \
+            name, "Seconds": time_call(function, 1961, 2020, scaled_songs)})
+    return pd.DataFrame(results)
+
+
+def replace_clean_artist(artist):
+    """
+    Return the artist name cleaned the way billboard_scraper.clean_artist did
+    before it used one regular expression: one replace pass per clutterer.
+    Kept only to compare against.
+    """
+    cleaned_artist = artist.lower()
+    for item in normalization.CLUTTERERS:
+        cleaned_artist = cleaned_artist.replace(item, " ")
+    return cleaned_artist
+
+
+def synthetic_artists(artist_count, distinct_count=20_000, seed=0):
+    """
+    Return randomly generated artist names, with solo artists and
+    collaborations written in the ways found on the charts.
+
+    Args:
+        artist_count: An integer containing the number of names to generate.
+        distinct_count: An integer containing the number of different names,
+        which are repeated as artists chart week after week.
+        seed: An integer used to seed the random number generator.
+
+    Returns:
+        A list of artist name strings.
+    """
+    generator = np.random.default_rng(seed)
+    words = ["Lil", "Nas", "Taylor", "Swift", "The", "Weeknd", "Beyonce", \
+    "Jay-Z", "Rolland", "Featherstone", "Ariana", "Grande", "Dr.", "Dre", \
+    "Brandy", "Monica", "Mary", "J.", "Blige", "Xscape"]
+    joiners = [" Featuring ", " & ", " x ", " And ", " Feat. ", " + "]
+    names = []
+    for _ in range(distinct_count):
+        name = " ".join(generator.choice(words, generator.integers(1, 4)))
+        if generator.random() < 0.4:
+            name += generator.choice(joiners) + " ".join(generator.choice(\
+            words, 2))
+        names.append(name)
+    return [names[index] for index in generator.integers(0, distinct_count, \
+    artist_count)]
+
+
+def benchmark_normalization(artist_count=2_000_000):
+    """
+    Compare cleaning artist names with one replace pass per clutterer, with
+    normalization.clean_artist on each name, and with
+    normalization.clean_artists on the whole column, and time the match keys
+    of a column.
+
+    Args:
+        artist_count: An integer containing the number of artist names.
+
+    Returns:
+        A Pandas dataframe with the columns Implementation, Rows, Seconds, and
+        Microseconds Per Row.
+    """
+    artists = synthetic_artists(artist_count)
+    titles = [artist[::-1] for artist in artists]
+    results = []
+    for name, function, args in [("replace passes", lambda names: \
+    [replace_clean_artist(artist) for artist in names], (artists,)), \
+    ("regex per name", lambda names: [normalization.clean_artist(artist) \
+    for artist in names], (artists,)), ("regex per column", \
+    normalization.clean_artists, (artists,)), ("match keys", \
+    normalization.match_keys, (titles, artists))]:
+        seconds = time_call(function, *args, repeats=1)
+        results.append({"Implementation": name, "Rows": artist_count, \
+        "Seconds": seconds, "Microseconds Per Row": seconds / artist_count * \
+        1e6})
+    return pd.DataFrame(results)
+
+
+def scan_songs(song_dataframe, start_date, end_date, artist, \
+minimum_energy):
+    """
+    Return the songs of an artist between two dates with at least some
+    energy by comparing every row of a song dataframe, dates as strings, as
+    the analysis code did before song_query. Kept only to compare against.
+    """
+    dates = song_dataframe["Date"].astype(str)
+    return song_dataframe[(dates >= start_date) & (dates <= end_date) & \
+    (song_dataframe["Artist"] == artist) & (song_dataframe["energy"] >= \
+    minimum_energy)]
+
+
+def benchmark_song_query(csv_path=DATASET_PATH, scales=(1, 100)):
+    """
+    Compare a song_query.SongQuery with scanning the rows of the song
+    dataframe for a decade of one artist's energetic songs, on the shipped
+    dataset repeated several times over. The table and its indexes are made
+    before the timing, as they would be once per notebook session.
+
+    Args:
+        csv_path: A string containing the path of the CSV dataset.
+        scales: A tuple of integers containing how many copies of the dataset
+        are stacked for each measurement.
+
+    Returns:
+        A Pandas dataframe with the columns Rows, Implementation, Seconds,
+        and Songs (the number of songs found).
+    """
+    songs = pd.read_csv(csv_path, index_col=0)
+    artist = songs["Artist"][songs["Date"].str.startswith("198")]\
+    .value_counts().index[0]
+    results = []
+    for scale in scales:
+        scaled_songs = pd.concat([songs] * scale, ignore_index=True)
+        table = song_query.SongTable.from_frame(scaled_songs)
+        query = table.query().years(1980, 1989).artist(artist).where(\
+        "energy", minimum=0.5).select("Date", "Song", "energy")
+        query.count()
+        for name, function in [("row scan", lambda: scan_songs(scaled_songs, \
+        "1980-01-01", "1989-12-31", artist, 0.5)), ("song query", \
+        query.to_frame)]:
+            results.append({"Rows": len(scaled_songs), "Implementation": \
+            name, "Seconds": time_call(function), "Songs": len(function())})
+    return pd.DataFrame(results)
+
+
+def benchmark_processes(row_count=2_000_000, process_counts=None):
+    """
+    Time music_feature.average_all and key_proportion on a large synthetic
+    dataframe in one process and spread over increasing numbers of processes.
+
+    Args:
+        row_count: An integer containing the number of songs.
+        process_counts: A list of integers containing the numbers of processes
+        to try. Defaults to the powers of two up to the number of CPU cores.
+
+    Returns:
+        A Pandas dataframe with the columns Processes, Seconds, and Speedup,
+        where Processes is 'serial' for the single process run and Speedup is
+        relative to it.
+    """
+    if process_counts is None:
+        cores = parallel_analytics.default_processes()
+        process_counts = [2 ** power for power in range(cores.bit_length()) \
+        if 2 ** power <= cores]
+    songs = synthetic_songs(row_count).sort_values("Date", ignore_index=True)
+
+    def analyze(processes):
+        music_feature.average_all(1961, 2020, BENCHMARK_FEATURES, songs, \
+        processes)
+        music_feature.key_proportion(1961, 2020, songs, processes=processes)
+
+    serial = time_call(analyze, None)
+    results = [{"Processes": "serial", "Seconds": serial, "Speedup": 1.0}]
+    for processes in process_counts:
+        seconds = time_call(analyze, processes)
+        results.append({"Processes": processes, "Seconds": seconds, \
+        "Speedup": serial / seconds})
+    return pd.DataFrame(results)
+
+
+def benchmark_storage(csv_path=DATASET_PATH):
+    """
+    Compare how long the song dataset takes to load, and how much memory it
+    takes up once loaded, when stored as a CSV file and as typed columnar
+    files.
+
+    Args:
+        csv_path: A string containing the path of the CSV dataset.
+
+    Returns:
+        A Pandas dataframe with the columns Format, Columns, Seconds, and
+        Megabytes, where Megabytes is the memory used by the loaded dataframe.
+    """
+    # The columns used by the averaging and key plots in the notebook.
+    notebook_columns = ["Date", "key"] + BENCHMARK_FEATURES
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        loaders = {"CSV": lambda columns: pd.read_csv(csv_path, \
+        usecols=columns)}
+        for extension in ["parquet", "feather"]:
+            path = os.path.join(directory, f"songs.{extension}")
+            song_storage.convert_csv(csv_path, path)
+            loaders[extension.title()] = lambda columns, path=path: \
+            song_storage.load_songs(path, columns)
+
+        for name, load in loaders.items():
+            for label, columns in [("all", None), ("notebook", \
+            notebook_columns)]:
+                results.append({"Format": name, "Columns": label, \
+                "Seconds": time_call(load, columns), "Megabytes": \
+                song_storage.typed_memory(load(columns)) / 1e6})
+    return pd.DataFrame(results)
+
+
+def benchmark_feature_matrix(row_count=5_000_000):
+    """
+    Compare music_feature.average_all and key_proportion on a synthetic song
+    dataframe held in memory with the same songs exported to a memory-mapped
+    FeatureMatrix, including the time taken to open the matrix.
+
+    Args:
+        row_count: An integer containing the number of songs.
+
+    Returns:
+        A Pandas dataframe with the columns Source, Step, Rows, Seconds, and
+        Megabytes, where Megabytes is the memory taken by the dataframe or
+        the size of the matrix files.
+    """
+    songs = synthetic_songs(row_count).assign(energy=0.5, loudness=-6.0, \
+    speechiness=0.1, liveness=0.2, valence=0.5, tempo=120.0, \
+    time_signature=4)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        feature_matrix.export_features(songs, directory)
+        results.append({"Source": "memmap", "Step": "export", "Rows": \
+        row_count, "Seconds": time.perf_counter() - start, "Megabytes": \
+        sum(os.path.getsize(os.path.join(directory, name)) for name in \
+        os.listdir(directory)) / 1e6})
+        results.append({"Source": "memmap", "Step": "open", "Rows": \
+        row_count, "Seconds": time_call(feature_matrix.FeatureMatrix.open, \
+        directory)})
+        matrix = feature_matrix.FeatureMatrix.open(directory)
+        for source, data in [("dataframe", songs), ("memmap", matrix)]:
+            for step, function, args in [("average_all", \
+            music_feature.average_all, (1961, 2020, BENCHMARK_FEATURES, \
+            data)), ("key_proportion", music_feature.key_proportion, \
+            (1961, 2020, data))]:
+                results.append({"Source": source, "Step": step, "Rows": \
+                row_count, "Seconds": time_call(function, *args)})
+        del matrix
+    results.append({"Source": "dataframe", "Step": "in memory", "Rows": \
+    row_count, "Megabytes": songs.memory_usage(deep=True).sum() / 1e6})
+    return pd.DataFrame(results)
+
+
+def benchmark_connection_reuse(request_count=500):
+    """
+    Compare sending search requests to a local stub Spotify server with a new
+    connection each time (requests.get) and through the pooled SpotifyClient.
+
+    The stub server is reached over plain HTTP on the same machine, so this
+    only measures the TCP set up and teardown saved; against Spotify the TLS
+    handshake and network round trips make the difference larger.
+
+    Args:
+        request_count: An integer containing the number of requests sent each
+        way.
+
+    Returns:
+        A Pandas dataframe with the columns Client, Seconds, Connections, and
+        the mean and 95th percentile request times in milliseconds.
+    """
+    results = []
+    with StubSpotifyServer() as server:
+        url = server.base_url + "search?q=halo"
+        client = SpotifyClient()
+        for name, get in [("requests.get", requests.get), \
+        ("SpotifyClient", client.get)]:
+            server.client_addresses.clear()
+            latencies = []
+            start = time.perf_counter()
+            for _ in range(request_count):
+                request_start = time.perf_counter()
+                get(url)
+                latencies.append(time.perf_counter() - request_start)
+            results.append({"Client": name, "Seconds": time.perf_counter() \
+            - start, "Connections": len(server.client_addresses), \
+            "Mean ms": np.mean(latencies) * 1e3, "p95 ms": \
+            np.percentile(latencies, 95) * 1e3})
+    return pd.DataFrame(results)
+
+
+def run_suite(stages, latency=0.01, error_rate=0.0, quick=False):
+    """
+    Run the chosen benchmark stages.
+
+    Args:
+        stages: A list of strings naming the stages, taken from STAGES.
+        latency: A float containing the number of seconds the stub servers
+        take to answer each request.
+        error_rate: A float containing the fraction of stub Spotify requests
+        answered with a server error.
+        quick: A boolean that is True to use small inputs, for a quick check
+        that every stage runs.
+
+    Returns:
+        A dictionary mapping each stage name to its Pandas dataframe of
+        results.
+    """
+    row_counts = ROW_COUNTS[:2] if quick else ROW_COUNTS
+    song_count = 100 if quick else 500
+    runs = {
+        "scrape": lambda: benchmark_scrape(5 if quick else 20, latency * 5),
+        "search": lambda: benchmark_search(song_count, latency, error_rate),
+        "track_index": benchmark_track_index,
+        "replay": lambda: benchmark_replay(2 if quick else 5, latency),
+        "features": lambda: benchmark_features(song_count * 4, latency, \
+        error_rate),
+        "analytics": lambda: benchmark_analytics(row_counts),
+        "key_proportion": lambda: benchmark_key_proportion(scales=(1, 10) if \
+        quick else (1, 100)),
+        "processes": lambda: benchmark_processes(row_counts[-1]),
+        "storage": benchmark_storage,
+        "feature_matrix": lambda: benchmark_feature_matrix(row_counts[-1]),
+        "normalization": lambda: benchmark_normalization(200_000 if quick \
+        else 2_000_000),
+        "song_query": lambda: benchmark_song_query(scales=(1, 10) if quick \
+        else (1, 100)),
+        "connections": lambda: benchmark_connection_reuse(100 if quick else \
+        500),
+    }
+    return {stage: runs[stage]() for stage in stages}
+
+
+# The stages run by run_suite, in the order they are run by default.
+STAGES = ["scrape", "search", "track_index", "features", "replay", \
+"analytics", "key_proportion", "processes", "storage", "feature_matrix", \
+"normalization", "song_query", "connections"]
+
+
+def save_results(results, path, settings=None):
+    """
+    Save benchmark results as a JSON file together with the commit and
+    machine they were measured on.
+
+    Args:
+        results: A dictionary mapping stage names to dataframes, as returned
+        by run_suite.
+        path: A string containing the path of the JSON file.
+        settings: A dictionary of the settings the benchmark was run with.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], \
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(\
+        os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    with open(path, "w") as f:
+        json.dump({
+            "commit": commit,
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.platform(),
+            "cpus": os.cpu_count(),
+            "settings": settings or {},
+            "results": {stage: frame.to_dict("records") for stage, frame in \
+            results.items()},
+            "metrics": METRICS.snapshot()["stages"],
+        }, f, indent=2, default=str)
+
+
+def compare_results(baseline_path, results, threshold=0.1):
+    """
+    Return the change in running time of every measurement from the results
+    saved in a JSON file by save_results.
+
+    Measurements are matched by stage and by the columns that describe what
+    was measured (every column not in MEASUREMENT_COLUMNS).
+
+    Args:
+        baseline_path: A string containing the path of the earlier results.
+        results: A dictionary mapping stage names to dataframes, as returned
+        by run_suite.
+        threshold: A float containing the fraction by which a measurement
+        must be slower to be marked as a regression.
+
+    Returns:
+        A Pandas dataframe with the columns Stage, Measurement, Baseline
+        Seconds, Seconds, Change, and Regression.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    rows = []
+    for stage, frame in results.items():
+        if stage not in baseline or "Seconds" not in frame.columns:
+            continue
+        labels = [column for column in frame.columns if column not in \
+        MEASUREMENT_COLUMNS]
+        earlier = {_label(row, labels): row["Seconds"] for row in \
+        baseline[stage]}
+        for row in frame.to_dict("records"):
+            label = _label(row, labels)
+            if label in earlier:
+                change = row["Seconds"] / earlier[label] - 1
+                rows.append({"Stage": stage, "Measurement": label, \
+                "Baseline Seconds": earlier[label], "Seconds": \
+                row["Seconds"], "Change": change, "Regression": change > \
+                threshold})
+    return pd.DataFrame(rows, columns=["Stage", "Measurement", \
+    "Baseline Seconds", "Seconds", "Change", "Regression"])
+
+
+def _label(row, labels):
+    """
+    Return a description of a measurement made from its descriptive columns.
+    """
+    return ", ".join(f"{label}={row.get(label)}" for label in labels)
+
+
+def main(arguments=None):
+    """
+    Run the benchmark suite from the command line.
+
+    Args:
+        arguments: A list of strings containing the command line arguments,
+        or None to read them from sys.argv.
+
+    Returns:
+        An integer containing the exit status, which is 1 if a comparison
+        found a regression.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark each stage of "
+    "building and analyzing the song dataset.")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, \
+    default=STAGES, help="the stages to run (default: all)")
+    parser.add_argument("--latency", type=float, default=0.01, \
+    help="seconds the stub servers take to answer each request")
+    parser.add_argument("--error-rate", type=float, default=0.0, \
+    help="fraction of stub Spotify requests answered with an error")
+    parser.add_argument("--quick", action="store_true", \
+    help="use small inputs to check that every stage runs")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="compare with the results saved in "
+    "this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.1, \
+    help="slowdown marked as a regression when comparing (default: 0.1)")
+    options = parser.parse_args(arguments)
+
+    results = run_suite(options.stages, options.latency, \
+    options.error_rate, options.quick)
+    for stage, frame in results.items():
+        print(stage)
+        print(frame.to_string(index=False))
+        print()
+
+    if options.output:
+        save_results(results, options.output, {"latency": options.latency, \
+        "error_rate": options.error_rate, "quick": options.quick})
+    if options.compare:
+        comparison = compare_results(options.compare, results, \
+        options.threshold)
+        print(comparison.to_string(index=False))
+        return int(comparison["Regression"].any())
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
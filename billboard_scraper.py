@@ -7,18 +7,41 @@ API.
 
 # Import the required libraries.
 import datetime
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import billboard
 from tqdm import tqdm
 
-def hot_100_data(year_start, year_end):
+from instrumentation import METRICS
+# clean_artist and CLUTTERERS moved to normalization, and are imported here so
+# that code using them from this module keeps working.
+from normalization import CLUTTERERS, clean_artist, clean_artists
+
+# The default number of charts downloaded at the same time.
+MAX_WORKERS = 8
+
+# The date of the first Billboard Hot 100 chart.
+FIRST_CHART_DATE = datetime.date(1958, 8, 4)
+
+# The weekday the weekly charts are dated on (Saturday).
+CHART_WEEKDAY = 5
+
+# The class used to download a chart when no other one is given, called like
+# billboard.ChartData. replay.offline replaces it while a run is recorded or
+# replayed.
+CHART_DATA = billboard.ChartData
+
+def hot_100_data(year_start, year_end, max_workers=MAX_WORKERS, \
+checkpoint_dir=None, chart_data=None, weekly=False):
     """
     Return the Billboard Hot Hundred playlists for each year within the
     specified start and end years.
 
-    Loop through the first day of June for each year of the specified time
-    period, and extract the list of Billboard Hot Hundred songs on that date.
-    This list is extracted by using the python library 'billboard'. All the
+    Download the list of Billboard Hot Hundred songs on the first day of June
+    for each year of the specified time period. These lists are extracted by
+    using the python library 'billboard', several charts at a time. All the
     various list of Hot Hundred songs for each year are then returned as one
     big dataframe.
 
@@ -31,62 +54,165 @@ def hot_100_data(year_start, year_end):
         equal to year_start that contains the ending year of the time period
         for which the Billboard Hot 100 charts are queried.
 
+        max_workers: An integer containing the number of charts downloaded at
+        the same time.
+
+        checkpoint_dir: A string containing the path of a folder where each
+        downloaded chart is saved, so that an interrupted download can resume
+        where it stopped, or None to not save the charts.
+
+        chart_data: The class used to download a chart, called like
+        billboard.ChartData, or None to use CHART_DATA. Replace it to read
+        charts from elsewhere.
+
+        weekly: A boolean that is True to download every weekly chart of the
+        years rather than only the June 1st charts (see chart_dates).
+
     Returns:
         A pandas dataframe containing columns with the Date, Song, and Artist
         for every Billboard Hot 100 Song on June 1st of the years specified.
 
     """
+    return fetch_charts(chart_dates(year_start, year_end, weekly), \
+    max_workers, checkpoint_dir, chart_data)
 
-    # Create an empty dataframe to store all the Billboard Hot 100 songs. The
-    # datapoints stored for each song is the date it featured on the Billboard
-    # Hot 100, the song's name, and the artist's name(s).
-    all_hot_100 = pd.DataFrame(columns=["Date", "Song", "Artist"])
+def chart_dates(year_start, year_end, weekly=False):
+    """
+    Return the dates of the Billboard Hot 100 charts within the specified
+    start and end years.
 
-    # Loop over each year in the specified time period.
-    for year in tqdm(range(year_start, year_end + 1, 1)):
+    Args:
+        year_start: An integer containing the first year of the time period.
+        year_end: An integer containing the last year of the time period.
+        weekly: A boolean that is True to return the date of every weekly
+        chart rather than June 1st of each year.
 
-        # Isolates the Billboard Hot 100 list on June 1st of that year.
-        current_date = datetime.date(year, 6, 1)
-        current_chart = \
-        billboard.ChartData("hot-100", date=current_date).entries
+    Returns:
+        A list of the date objects of June 1st of each year, or of every
+        Saturday from the first Hot 100 chart onwards if weekly is True.
+        Billboard returns the chart of the week containing each date.
+    """
+    if not weekly:
+        return [datetime.date(year, 6, 1) for year in range(year_start, \
+        year_end + 1)]
+    first_date = max(datetime.date(year_start, 1, 1), FIRST_CHART_DATE)
+    first_date += datetime.timedelta(days=(CHART_WEEKDAY - \
+    first_date.weekday()) % 7)
+    last_date = datetime.date(year_end, 12, 31)
+    return [first_date + datetime.timedelta(weeks=week) for week in \
+    range((last_date - first_date).days // 7 + 1)]
+
+@METRICS.stage("billboard")
+def fetch_charts(dates, max_workers=MAX_WORKERS, checkpoint_dir=None, \
+chart_data=None):
+    """
+    Return the songs on the Billboard Hot 100 charts of the specified dates.
 
-        # Loops through each song and 'cleans' the artist name of unnecessary
-        # symbols.
-        for song in current_chart:
-            artist = clean_artist(song.artist)
-            all_hot_100 = all_hot_100.append({"Date": current_date, \
-            "Song": song.title, "Artist": artist}, ignore_index=True)
+    The charts are downloaded by a pool of threads (see fetch_chart), and the
+    songs are collected into one list per column so that the dataframe is
+    only built once.
 
-    return all_hot_100
+    Args:
+        dates: A list of date objects containing the dates of the charts.
+        max_workers: An integer containing the number of charts downloaded at
+        the same time.
+        checkpoint_dir: A string containing the path of a folder the charts are
+        saved in, or None to not save the charts.
+        chart_data: The class used to download a chart, called like
+        billboard.ChartData, or None to use CHART_DATA.
 
-# Define the substrings that must be cleaned from the artists' name.
-CLUTTERERS = [".", "&", "featuring ", "and ", "+", "?", " x ", "feat"]
+    Returns:
+        A pandas dataframe containing columns with the Date, Song, and Artist
+        for every song on the charts, in the order of the dates given.
+    """
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    # Download the charts several at a time, keeping them in date order.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        charts = list(tqdm(executor.map(lambda chart_date: fetch_chart(\
+        chart_date, checkpoint_dir, chart_data), dates), total=len(dates)))
+
+    # Collect the songs into columns, and then 'clean' the whole column of
+    # artist names of unnecessary symbols at once.
+    columns = {"Date": [], "Song": [], "Artist": []}
+    for chart_date, chart in zip(dates, charts):
+        for title, artist in chart:
+            columns["Date"].append(chart_date)
+            columns["Song"].append(title)
+            columns["Artist"].append(artist)
+    columns["Artist"] = clean_artists(columns["Artist"]).to_numpy()
+
+    METRICS.count("billboard", "rows", len(columns["Date"]))
+    return pd.DataFrame(columns)
+
+def iter_chart_songs(dates, checkpoint_dir=None, \
+chart_data=None):
+    """
+    Yield the songs on the Billboard Hot 100 charts of the specified dates one
+    at a time, downloading each chart only when the songs before it have been
+    used.
 
-def clean_artist(artist):
+    Args:
+        dates: A list of date objects containing the dates of the charts.
+        checkpoint_dir: A string containing the path of a folder the charts are
+        saved in, or None to not save the charts.
+        chart_data: The class used to download a chart, called like
+        billboard.ChartData, or None to use CHART_DATA.
+
+    Yields:
+        A (date, song, artist) tuple for each song, with the artist name
+        cleaned by clean_artist.
+    """
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+    for chart_date in dates:
+        # Clean the artist names of the whole chart at once, as hot_100_data
+        # does, rather than one name at a time.
+        chart = fetch_chart(chart_date, checkpoint_dir, chart_data)
+        artists = clean_artists([artist for _, artist in chart]).tolist()
+        for (title, _), artist in zip(chart, artists):
+            yield chart_date, title, artist
+
+def fetch_chart(chart_date, checkpoint_dir=None, \
+chart_data=None):
     """
-    Return the artist name in a reformatted form that is consistent across all
-    songs that feature multiple artists.
+    Return the songs on the Billboard Hot 100 chart of one date.
 
-    Convert the artists' names to lowercase, and remove strings such as ".",
-    "&", "featuring ", "and ", "+", "?", " x ", and "feat", replacing them with
-    whitespace. This makes it easier to keyword search the tracks in the
-    Spotify API later on.
+    If the chart has already been saved in the checkpoint folder it is read
+    from there; otherwise it is downloaded and then saved.
 
     Args:
-        artist: A string containing the name(s) of the artist(s) who perform or
-        are featured in any track.
+        chart_date: A date object containing the date of the chart.
+        checkpoint_dir: A string containing the path of a folder the chart is
+        saved in, or None to not save the chart.
+        chart_data: The class used to download a chart, called like
+        billboard.ChartData, or None to use CHART_DATA.
 
     Returns:
-        A string containing the reformatted name(s) of the artist(s) in
-        lowercase without the unnecessary and confusing symbols used when there
-        are multiple artists.
-
+        A list containing a [title, artist] list for each song on the chart,
+        with the artist names as they appear on the chart.
     """
-
-    # Converts artist(s) name string to lowercase.
-    cleaned_artist = artist.lower()
-
-    # Cleans out the artist's name by removing the substrings specified above.
-    for item in CLUTTERERS:
-        cleaned_artist = cleaned_artist.replace(item, " ")
-    return cleaned_artist
+    if checkpoint_dir is not None:
+        checkpoint_path = os.path.join(checkpoint_dir, \
+        f"hot-100-{chart_date}.json")
+        if os.path.exists(checkpoint_path):
+            METRICS.count("billboard", "checkpoint_hits")
+            with open(checkpoint_path) as f:
+                return json.load(f)
+
+    # Isolates the Billboard Hot 100 list on that date.
+    METRICS.count("billboard", "requests")
+    with METRICS.stage("billboard_download"):
+        current_chart = (chart_data or CHART_DATA)("hot-100", \
+        date=chart_date).entries
+    chart = [[song.title, song.artist] for song in current_chart]
+
+    # Save the chart under a temporary name first so that an interruption
+    # never leaves a partly written checkpoint behind.
+    if checkpoint_dir is not None:
+        with open(checkpoint_path + ".tmp", "w") as f:
+            json.dump(chart, f)
+        os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+    return chart
@@ -0,0 +1,171 @@
+"""
+Store the weekly Billboard Hot 100 charts compactly. A song charting for
+twenty weeks appears twenty times in the charts, so rather than repeating its
+title, artist, Track ID, and audio features on every row, each song is kept
+once in a table of songs and every chart appearance is a row of three small
+integers: the chart, the song, and its rank. The storage and the averaging
+and key counting are shared with TrackStore (see appearance_store).
+"""
+
+# Import the required libraries.
+import numpy as np
+import pandas as pd
+
+import billboard_scraper
+from appearance_store import AppearanceStore
+from trend_statistics import chart_positions
+
+
+class ChartStore(AppearanceStore):
+    """
+    The Billboard Hot 100 charts as a table of unique songs and a table of
+    chart appearances, keyed by song and artist.
+
+    Attributes:
+        dates: A numpy datetime64[D] array containing the date of every
+        chart, in order.
+        items: A Pandas dataframe with one row per unique song, whose row
+        number is the song's ID, also available as songs. It has the Song and
+        Artist columns, and any Track ID and audio feature columns that have
+        been added.
+        date_ids: A numpy int16 array containing the position in dates of
+        the chart of each appearance.
+        item_ids: A numpy int32 array containing the ID of the song of each
+        appearance.
+        ranks: A numpy int8 array containing the rank of each appearance.
+    """
+
+    ITEMS_FILE = "songs.parquet"
+    ITEM_COLUMN = "Song ID"
+
+    def __init__(self, dates, songs, chart_ids, song_ids, ranks):
+        super().__init__(dates, songs, chart_ids, song_ids)
+        self.ranks = np.asarray(ranks, dtype=np.int8)
+
+    @property
+    def songs(self):
+        """
+        The table of unique songs.
+        """
+        return self.items
+
+    @classmethod
+    def from_frame(cls, chart_dataframe):
+        """
+        Return the store of charts given as one row per chart appearance.
+
+        Args:
+            chart_dataframe: A Pandas dataframe with Date, Song, and Artist
+            columns, such as the one returned by billboard_scraper.hot_100_data
+            or the song dataset. Any other columns (such as Track ID and the
+            audio features) are kept from the first appearance of each song,
+            apart from the redundant columns listed in song_storage. The ranks
+            are taken from a Rank column if there is one, and otherwise from
+            the order of the songs on each chart.
+
+        Returns:
+            A ChartStore.
+        """
+        song_ids, _ = pd.factorize(pd.MultiIndex.from_arrays([\
+        chart_dataframe["Song"], chart_dataframe["Artist"]]))
+        dates, songs, chart_ids = cls.split_frame(chart_dataframe, song_ids, \
+        ("Date", "Rank"))
+        return cls(dates, songs, chart_ids, song_ids, \
+        chart_positions(chart_dataframe))
+
+    def to_frame(self, columns=None):
+        """
+        Return the charts as one row per chart appearance, in the format of
+        the song dataset.
+
+        Args:
+            columns: A list of strings containing the song columns to include,
+            or None to include every column of the songs table.
+
+        Returns:
+            A Pandas dataframe with the Date and Rank of every appearance
+            followed by the columns of its song.
+        """
+        frame = super().to_frame(columns)
+        frame.insert(1, "Rank", self.ranks.astype(np.int64))
+        return frame
+
+    def add_songs_data(self, song_data):
+        """
+        Add columns, such as the Track ID and audio features, to the songs
+        table.
+
+        Args:
+            song_data: A Pandas dataframe with Song and Artist columns and the
+            columns to add, such as the one returned by
+            get_audio_features.find_audio_features. Songs that are not in the
+            store are ignored, and songs missing from song_data are given
+            missing values.
+        """
+        song_data = song_data.drop(columns=[column for column in ["Date", \
+        "Rank"] if column in song_data.columns]).drop_duplicates(["Song", \
+        "Artist"])
+        new_columns = [column for column in song_data.columns if column not \
+        in self.items.columns]
+        self.items = self.items.merge(song_data[["Song", "Artist"] + \
+        new_columns], on=["Song", "Artist"], how="left")
+
+    def appearance_offsets(self, start_date, end_date):
+        """
+        Return the offset of each appearance's year from the start of the time
+        period, or -1 for appearances outside the time period.
+
+        Every weekly chart of a year is counted, unlike aggregation.year_offsets
+        which only counts the June 1st charts.
+
+        Args:
+            start_date: An integer containing the first year of the period.
+            end_date: An integer containing the last year of the period.
+
+        Returns:
+            A numpy integer array with one entry per appearance.
+        """
+        chart_offsets = self.dates.astype("datetime64[Y]").astype(np.int64) \
+        + 1970 - start_date
+        chart_offsets[(chart_offsets < 0) | (chart_offsets > end_date - \
+        start_date)] = -1
+        return chart_offsets[self.date_ids]
+
+    def appearances(self):
+        """
+        Return the appearances table saved by save, with the Date, Song ID,
+        and Rank of every appearance.
+        """
+        return super().appearances().assign(Rank=self.ranks)
+
+    @classmethod
+    def from_appearances(cls, dates, items, date_ids, appearances):
+        """
+        Return the store of a songs table and a loaded appearances table.
+        """
+        return cls(dates, items, date_ids, appearances[cls.ITEM_COLUMN], \
+        appearances["Rank"])
+
+
+def weekly_chart_store(year_start, year_end, \
+max_workers=billboard_scraper.MAX_WORKERS, checkpoint_dir=None, \
+chart_data=None):
+    """
+    Return a ChartStore of every weekly Billboard Hot 100 chart of the
+    specified years.
+
+    Args:
+        year_start: An integer containing the first year of the charts.
+        year_end: An integer containing the last year of the charts.
+        max_workers: An integer containing the number of charts downloaded at
+        the same time.
+        checkpoint_dir: A string containing the path of a folder the charts are
+        saved in, or None to not save the charts.
+        chart_data: The class used to download a chart, called like
+        billboard.ChartData, or None to use billboard_scraper.CHART_DATA.
+
+    Returns:
+        A ChartStore whose songs table has the Song and Artist columns.
+    """
+    return ChartStore.from_frame(billboard_scraper.hot_100_data(year_start, \
+    year_end, max_workers, checkpoint_dir, chart_data, weekly=True))
@@ -0,0 +1,298 @@
+"""
+Store the numeric audio features of the song dataset as fixed width binary
+matrices that are memory-mapped rather than loaded. The float features are
+kept in one contiguous float32 matrix and the key, mode, and time signature
+in one int8 matrix, with the songs sorted by date, and a small index records
+the first row of every chart date. Opening the matrices reads nothing but the
+index; the rows of the years being analyzed are read from disk only when they
+are summed, a block at a time, so the averaging and key functions in
+music_feature can run over datasets larger than memory. A FeatureMatrix is
+accepted by those functions in place of the song dataframe.
+"""
+
+# Import the required libraries.
+import os
+import numpy as np
+import pandas as pd
+
+import aggregation
+
+# The features stored as 32 bit floats, in the order of the matrix columns.
+FLOAT_FEATURES = ["danceability", "energy", "loudness", "speechiness", \
+"acousticness", "instrumentalness", "liveness", "valence", "tempo", \
+"duration_ms"]
+
+# The columns stored as 8 bit integers, with -1 for a missing value.
+CATEGORY_COLUMNS = ["key", "mode", "time_signature"]
+
+# The largest number of rows read from disk at once.
+CHUNK_ROWS = 1_000_000
+
+
+class FeatureMatrix:
+    """
+    The audio features of the song dataset as memory-mapped matrices.
+
+    Attributes:
+        features: A numpy float32 array (memory-mapped when opened from disk)
+        with one row per song and one column per name in FLOAT_FEATURES.
+        categories: A numpy int8 array with one row per song and one column
+        per name in CATEGORY_COLUMNS.
+        dates: A numpy datetime64[D] array containing every chart date, in
+        order.
+        starts: A numpy integer array containing the first row of each chart
+        date, followed by the number of rows.
+    """
+
+    def __init__(self, features, categories, dates, starts):
+        self.features = features
+        self.categories = categories
+        self.dates = np.asarray(dates, dtype="datetime64[D]")
+        self.starts = np.asarray(starts, dtype=np.int64)
+
+    @classmethod
+    def open(cls, directory):
+        """
+        Return the matrices saved in a folder by export_features or
+        export_csv, memory-mapped without reading them.
+
+        Args:
+            directory: A string containing the path of the folder.
+
+        Returns:
+            A FeatureMatrix.
+        """
+        with np.load(os.path.join(directory, "index.npz")) as index:
+            dates, starts = index["dates"], index["starts"]
+        return cls(np.load(os.path.join(directory, "features.npy"), \
+        mmap_mode="r"), np.load(os.path.join(directory, "categories.npy"), \
+        mmap_mode="r"), dates, starts)
+
+    def __len__(self):
+        """
+        Return the number of songs.
+        """
+        return len(self.features)
+
+    def column(self, name):
+        """
+        Return one column of the matrices without copying it.
+
+        Args:
+            name: A string containing the name of a column in FLOAT_FEATURES
+            or CATEGORY_COLUMNS.
+
+        Returns:
+            A one dimensional numpy array view of the column.
+
+        Raises:
+            KeyError: If the column is not stored.
+        """
+        if name in FLOAT_FEATURES:
+            return self.features[:, FLOAT_FEATURES.index(name)]
+        if name in CATEGORY_COLUMNS:
+            return self.categories[:, CATEGORY_COLUMNS.index(name)]
+        raise KeyError(f"{name} is not stored in the feature matrix")
+
+    def float_column(self, name, start=0, stop=None):
+        """
+        Return rows of one column as floats, with NaN for a missing value.
+
+        Args:
+            name: A string containing the name of a column in FLOAT_FEATURES
+            or CATEGORY_COLUMNS.
+            start: An integer containing the first row.
+            stop: An integer containing the row after the last, or None for
+            the last row of the matrix.
+
+        Returns:
+            A numpy float64 array. The -1 of a missing key, mode, or time
+            signature is returned as NaN.
+
+        Raises:
+            KeyError: If the column is not stored.
+        """
+        column = self.column(name)[start:stop]
+        if name in CATEGORY_COLUMNS:
+            return np.where(column < 0, np.nan, column)
+        return column.astype(np.float64)
+
+    def year_rows(self, start_date, end_date):
+        """
+        Return the rows of the June 1st chart of every year in a time period,
+        found by binary search in the chart dates.
+
+        Args:
+            start_date: An integer containing the first year of the period.
+            end_date: An integer containing the last year of the period.
+
+        Returns:
+            A list of (offset, start, stop) tuples, one for each year with a
+            chart, containing the year's offset from start_date and the range
+            of its rows.
+        """
+        june_dates = np.array([f"{year}-06-01" for year in range(start_date, \
+        end_date + 1)], dtype="datetime64[D]")
+        positions = np.searchsorted(self.dates, june_dates)
+        return [(offset, int(self.starts[position]), \
+        int(self.starts[position + 1])) for offset, (position, june_date) in \
+        enumerate(zip(positions, june_dates)) if position < len(self.dates) \
+        and self.dates[position] == june_date]
+
+    def feature_sums(self, start_date, end_date, features, processes=None):
+        """
+        Return the yearly song counts and feature sums of a time period, in
+        the format returned by aggregation.frame_feature_sums. The key, mode,
+        and time signature can be summed too, without counting the songs
+        missing them.
+
+        Args:
+            start_date: An integer containing the first year of the period.
+            end_date: An integer containing the last year of the period.
+            features: A list of strings containing the names of the features.
+            processes: Ignored, since the rows of each year are next to each
+            other and only they are read. Accepted so that music_feature can
+            pass it on.
+
+        Returns:
+            A tuple of the counts and sums arrays, with one row per year and
+            one column per feature.
+
+        Raises:
+            KeyError: If a feature is not stored.
+        """
+        # Check that every feature is stored, even if no year has songs.
+        for feature in features:
+            self.column(feature)
+        counts = np.zeros((end_date - start_date + 1, len(features)), \
+        dtype=np.int64)
+        sums = np.zeros(counts.shape)
+        for offset, start, stop in self.year_rows(start_date, end_date):
+            for block_start in range(start, stop, CHUNK_ROWS):
+                block_stop = min(block_start + CHUNK_ROWS, stop)
+                block = np.column_stack([self.float_column(feature, \
+                block_start, block_stop) for feature in features])
+                present = ~np.isnan(block)
+                counts[offset] += present.sum(axis=0)
+                sums[offset] += np.where(present, block, 0).sum(axis=0)
+        return counts, sums
+
+    def key_counts(self, start_date, end_date, by_mode=False, \
+    processes=None):
+        """
+        Return the number of songs in each key for every year of a time
+        period, in the format returned by aggregation.key_counts.
+
+        Args:
+            start_date: An integer containing the first year of the period.
+            end_date: An integer containing the last year of the period.
+            by_mode: A boolean that is True to keep the modes apart.
+            processes: Ignored, as in feature_sums.
+
+        Returns:
+            A numpy integer array with one row per year and one column per
+            key, with a third axis for the modes if by_mode is True.
+        """
+        counts = np.zeros((end_date - start_date + 1, 12) + ((2,) if by_mode \
+        else ()), dtype=np.int64)
+        for offset, start, stop in self.year_rows(start_date, end_date):
+            for block_start in range(start, stop, CHUNK_ROWS):
+                block = self.categories[block_start:min(block_start + \
+                CHUNK_ROWS, stop)]
+                counts[offset] += aggregation.key_counts(np.zeros(len(block), \
+                dtype=np.int64), block[:, 0], 1, block[:, 1] if by_mode else \
+                None)[0]
+        return counts
+
+
+def export_features(song_dataframe, directory):
+    """
+    Save the audio features of a song dataframe as memory-mappable matrices.
+
+    Args:
+        song_dataframe: A Pandas dataframe containing the song dataset, with
+        a Date column and the columns in FLOAT_FEATURES and CATEGORY_COLUMNS.
+        The songs are sorted by date, keeping the chart order of each date.
+        directory: A string containing the path of the folder the matrices
+        are saved in.
+    """
+    order = np.argsort(pd.to_datetime(song_dataframe["Date"]).to_numpy(), \
+    kind="stable")
+    songs = song_dataframe.iloc[order]
+    writer = _MatrixWriter(directory, len(songs))
+    writer.write(songs)
+    writer.close()
+
+
+def export_csv(csv_path, directory, chunk_rows=CHUNK_ROWS):
+    """
+    Save the audio features of a CSV song dataset as memory-mappable
+    matrices, reading chunk_rows songs at a time so that the dataset never
+    has to fit in memory.
+
+    Args:
+        csv_path: A string containing the path of the CSV file, whose songs
+        must be sorted by date as update_dataset keeps them.
+        directory: A string containing the path of the folder the matrices
+        are saved in.
+        chunk_rows: An integer containing the number of songs read at once.
+
+    Raises:
+        ValueError: If the songs are not sorted by date.
+    """
+    row_count = sum(len(chunk) for chunk in pd.read_csv(csv_path, \
+    usecols=["Date"], chunksize=chunk_rows))
+    writer = _MatrixWriter(directory, row_count)
+    for chunk in pd.read_csv(csv_path, usecols=["Date"] + FLOAT_FEATURES + \
+    CATEGORY_COLUMNS, chunksize=chunk_rows):
+        writer.write(chunk)
+    writer.close()
+
+
+class _MatrixWriter:
+    """
+    Write songs sorted by date into the matrices of a folder, one block at a
+    time, recording where each chart date starts.
+    """
+
+    def __init__(self, directory, row_count):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.features = np.lib.format.open_memmap(os.path.join(directory, \
+        "features.npy"), mode="w+", dtype=np.float32, shape=(row_count, \
+        len(FLOAT_FEATURES)))
+        self.categories = np.lib.format.open_memmap(os.path.join(directory, \
+        "categories.npy"), mode="w+", dtype=np.int8, shape=(row_count, \
+        len(CATEGORY_COLUMNS)))
+        self.rows = 0
+        self.dates = []
+        self.starts = []
+
+    def write(self, songs):
+        dates = pd.to_datetime(songs["Date"]).to_numpy().astype(\
+        "datetime64[D]")
+        if len(dates) == 0:
+            return
+        if np.any(dates[1:] < dates[:-1]) or (self.dates and dates[0] < \
+        self.dates[-1]):
+            raise ValueError("The songs must be sorted by date")
+
+        # Record the first row of every date not seen in an earlier block.
+        changes = np.flatnonzero(np.concatenate([[not self.dates or \
+        dates[0] != self.dates[-1]], dates[1:] != dates[:-1]]))
+        self.dates.extend(dates[changes])
+        self.starts.extend(self.rows + changes)
+
+        stop = self.rows + len(songs)
+        self.features[self.rows:stop] = songs[FLOAT_FEATURES].to_numpy(\
+        dtype=np.float32, na_value=np.nan)
+        self.categories[self.rows:stop] = songs[CATEGORY_COLUMNS].fillna(\
+        -1).to_numpy(dtype=np.int8)
+        self.rows = stop
+
+    def close(self):
+        self.features.flush()
+        self.categories.flush()
+        np.savez(os.path.join(self.directory, "index.npz"), dates=np.array(\
+        self.dates, dtype="datetime64[D]"), starts=np.array(self.starts + \
+        [self.rows], dtype=np.int64))
@@ -6,15 +6,32 @@ analyzed.
 """
 
 # Import the required libraries.
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 import pandas as pd
-import requests
 from tqdm import tqdm
 
+from instrumentation import METRICS
+from rate_limiter import TokenBucket
+from resilient_request import DEFAULT_POLICY, RequestFailed, send_with_retry
+from response_cache import DEFAULT_CACHE, ResponseCache
+import spotify_client
+
 # Import the authentication details from spotify_id_query in order to avoid
 # repeating the authentication process.
-from spotify_id_query import BASE_URL, headers
+from spotify_id_query import BASE_URL, REQUESTS_PER_SECOND, auth_headers, \
+refresh_token
+
+# The largest number of Track IDs whose audio features Spotify returns at once.
+BATCH_SIZE = 100
 
-def find_audio_features(id_dataframe):
+# The default number of batches requested at the same time.
+MAX_WORKERS = 4
+
+@METRICS.stage("audio_features")
+def find_audio_features(id_dataframe, cache=DEFAULT_CACHE, \
+policy=DEFAULT_POLICY, max_workers=MAX_WORKERS, \
+requests_per_second=REQUESTS_PER_SECOND, store=None):
     """
     Return a dataframe containing the Date, Song, Artist and Spotify Track ID,
     and various audio features for every searchable song on Billboard Hot 100
@@ -22,9 +39,19 @@ def find_audio_features(id_dataframe):
 
     Use the Spotify Track IDs to find the corresponding audio features for that
     track. A maximum of 100 IDs can be queried in one request, and this enables
-    us to speed up the feature querying significantly. The resulting data is
+    us to speed up the feature querying significantly. The batches of 100 are
+    requested by a pool of threads, so that several requests are waiting for
+    Spotify at once, and the audio features are matched to the songs by Track
+    ID before the dataframe is built in one step. The resulting data is
     arranged into a pandas dataframe containing the input dataframe plus
-    columns for each of the audio features provided by Spotify.
+    columns for each of the audio features provided by Spotify. Each distinct
+    Track ID is only requested once, however many charts it is on. The audio
+    features of Track IDs in the store or the cache are not requested again,
+    and
+    each batch is stored in the cache as soon as it arrives. A batch whose
+    request keeps failing does not stop the others: its songs are given
+    missing audio features and their Track IDs are recorded, so running this
+    function again with the same cache only requests those Track IDs.
 
     Args:
         id_dataframe: A Pandas dataframe, imported from spotify_id_query, that
@@ -33,69 +60,189 @@ def find_audio_features(id_dataframe):
         dataframe has four columns: Date, Song, Artist, and Track ID. Each row
         represents one song.
 
+        cache: A ResponseCache storing earlier audio features, or None to
+        request the audio features of every Track ID.
+
+        policy: A RetryPolicy containing the number of attempts and the
+        pauses between them for each batch.
+
+        max_workers: An integer containing the number of batches requested
+        at the same time.
+
+        requests_per_second: A float containing the most requests sent to the
+        Spotify API per second, shared by all threads.
+
+        store: A TrackStore of the songs whose audio features are already
+        known (see TrackStore.audio_features), or None.
+
     Returns:
         song_audio_dataframe: A Pandas dataframe that contains the Billboard
         Hot 100 songs on the June 1st of every year from 1961 to 2020 with
         their corresponding Spotify Track IDs and Spotify-generated audio
         features. The dataframe has twenty four columns: Date, Song, Artist,
         Track ID, and the remaining columns represent various audio features.
-        Each row represents one song.
+        Each row represents one song. Its attrs["failed_ids"] is a list of the
+        Track IDs whose audio features could not be requested.
     """
-    # Convert the Track ID column in the dataframe to a list.
-    track_id_master = id_dataframe["Track ID"].tolist()
+    # Convert the Track ID column in the dataframe to a list of the distinct
+    # Track IDs, so that a song on several charts is only requested once.
+    track_ids = id_dataframe["Track ID"].tolist()
+    track_id_master = list(dict.fromkeys(track_ids))
+    METRICS.count("audio_features", "rows", len(track_ids))
+    METRICS.count("audio_features", "duplicate_ids", len(track_ids) - \
+    len(track_id_master))
+    limiter = TokenBucket(requests_per_second)
+
+    # Take the audio features of the tracks already in the store, and only
+    # request the others.
+    audio_features = {} if store is None else \
+    store.audio_features(track_id_master)
+    METRICS.count("audio_features", "store_hits", len(audio_features))
+    requested_ids = [track_id for track_id in track_id_master if track_id \
+    not in audio_features]
+
+    # Break up the list of track IDs into batches of 100 IDs each, and request
+    # them from a pool of threads. The executor returns the audio features of
+    # each batch in the same order as the batches.
+    batches = [requested_ids[i:i + BATCH_SIZE] for i in range(0, \
+    len(requested_ids), BATCH_SIZE)]
+    failed_ids = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch, batch_features in zip(batches, tqdm(executor.map(\
+        batch_audio_features, batches, repeat(cache), repeat(policy), \
+        repeat(limiter)), total=len(batches))):
+            if batch_features is None:
+                failed_ids.extend(batch)
+            else:
+                audio_features.update(batch_features)
+
+    # Give every song the audio features of its Track ID, and concatenate the
+    # dataframe containing the date, song, artist, and track ID with the
+    # dataframe containing the corresponding audio features.
+    audio_dataframe = pd.DataFrame([audio_features.get(track_id, {}) for \
+    track_id in track_ids], index=id_dataframe.index)
+    song_audio_dataframe = pd.concat([id_dataframe, audio_dataframe], axis=1)
+    song_audio_dataframe.attrs["failed_ids"] = failed_ids
+    return song_audio_dataframe
 
-    # Initialise the dataframe that stores the audio features by finding the
-    # audio features for the first track ID.
-    audio_dataframe = id_to_audio_feature([track_id_master[0]])
+def batch_audio_features(track_id_list, cache, policy, limiter=None):
+    """
+    Return the audio features for a batch of Track IDs, or None if the batch
+    request failed.
 
-    # Break up the list of track IDs into a list containing sbulists with 100
-    # IDs each.
-    track_id_master_split = [track_id_master[i:i+100] for i in range(1, \
-    len(track_id_master), 100)]
+    Args:
+        track_id_list: A list containing at most 100 Spotify IDs as strings.
+        cache: A ResponseCache storing earlier audio features, or None.
+        policy: A RetryPolicy containing the number of attempts and the
+        pauses between them.
+        limiter: A TokenBucket shared by all threads sending requests, or None
+        to send requests as quickly as possible.
 
-    # Loop through each sublist.
-    for list_section in tqdm(track_id_master_split):
+    Returns:
+        A dictionary mapping Track IDs to their audio features, as returned by
+        audio_feature_records, or None.
+    """
+    try:
+        return audio_feature_records(track_id_list, cache, policy, limiter)
+    except RequestFailed:
+        METRICS.count("audio_features", "failed_batches")
+        return None
+
+def audio_feature_records(track_id_list, cache=DEFAULT_CACHE, \
+policy=DEFAULT_POLICY, limiter=None):
+    """
+    Return the audio features for each of the input Spotify Track IDs that
+    has them, keyed by Track ID.
 
-        # Extract the audio features for the 100 (or less) songs in the sublist
-        # as a dataframe, and append to the main audio feature dataframe.
-        dataframe_section = id_to_audio_feature(list_section)
-        audio_dataframe = audio_dataframe.append(dataframe_section, \
-        ignore_index=True)
+    Look up the track IDs in the cache first, then query the remaining IDs in
+    one big GET request to the Spotify API, sent through the shared client,
+    and store their audio features in the cache. The audio features returned
+    are matched to the Track IDs by the id field of each track rather than by
+    their position in the response.
 
-    # Concatenate the dataframe containing the date, song, artist, and track ID
-    # with the dataframe containing the corresponding audio features.
-    song_audio_dataframe = pd.concat([id_dataframe, audio_dataframe], axis=1)
-    return song_audio_dataframe
+    Args:
+        track_id_list: A list containing the Spotify IDs as strings. Can have a
+        maximum length of 100, but occasionally can be shorter.
+
+        cache: A ResponseCache storing earlier audio features, or None to
+        request the audio features of every Track ID.
+
+        policy: A RetryPolicy containing the number of attempts and the
+        pauses between them.
+
+        limiter: A TokenBucket shared by all threads sending requests, or None
+        to send requests as quickly as possible.
+
+    Returns:
+        A dictionary mapping each Track ID with audio features to a dictionary
+        of its audio features (around 20 for each track).
 
-def id_to_audio_feature(track_id_list):
+    Raises:
+        RequestFailed: If the request did not succeed within the number of
+        attempts allowed by the policy.
+    """
+    # Find the audio features already stored in the cache.
+    cache_keys = [ResponseCache.key("audio-features", track_id) for track_id \
+    in track_id_list]
+    cached = {} if cache is None else cache.get_many(cache_keys)
+    missing_ids = [track_id for track_id, cache_key in zip(track_id_list, \
+    cache_keys) if cache_key not in cached]
+    METRICS.count("audio_features", "cache_hits", len(cached))
+    records = {track_id: cached[cache_key] for track_id, cache_key in \
+    zip(track_id_list, cache_keys) if cached.get(cache_key)}
+
+    if missing_ids:
+        # Concatenate the list of missing Track IDs into a single,
+        # comma-separated string.
+        track_id_string = ",".join(missing_ids)
+
+        # Send GET request to Spotify API using the string of comma-separated
+        # Track IDs, repeating it if it fails.
+        query_data = send_with_retry(lambda: \
+        spotify_client.DEFAULT_CLIENT.get(BASE_URL + 'audio-features/?ids=' \
+        + track_id_string, headers=auth_headers()), policy, limiter, \
+        stage="audio_features", refresh_token=refresh_token)
+
+        # Convert the response to a JSON file, and store the audio features
+        # that were found in the cache.
+        fetched = {features["id"]: features for features in \
+        query_data.json()["audio_features"] if features}
+        if cache is not None:
+            cache.set_many({ResponseCache.key("audio-features", track_id): \
+            features for track_id, features in fetched.items()})
+        records.update(fetched)
+    return records
+
+def id_to_audio_feature(track_id_list, cache=DEFAULT_CACHE, \
+policy=DEFAULT_POLICY):
     """
     Return a dataframe containing the audio features for each of the input
     Spotify Track IDs.
 
-    Query the list of track IDs in one big GET request to the Spotify API.
-    Convert and index the resulting data to form a dataframe with the relevant
-    audio features (around 20 for each track).
+    Request the audio features with audio_feature_records, and convert the
+    resulting data to form a dataframe with the relevant audio features
+    (around 20 for each track).
 
     Args:
         track_id_list: A list containing the Spotify IDs as strings. Can have a
         maximum length of 100, but occasionally can be shorter.
 
-    Returns:
-        audio_data_clean: A Pandas dataframe containing the audio features for
-        each of the IDs in the input list.
-    """
-    # Concatenate the list of Track IDs into a single, comma-separated string.
-    track_id_string = ",".join(track_id_list)
+        cache: A ResponseCache storing earlier audio features, or None to
+        request the audio features of every Track ID.
 
-    # Send GET request to Spotify API using the string of comma-separated Track
-    # IDs.
-    query_data = requests.get(BASE_URL + 'audio-features/?ids=' + \
-    track_id_string, headers=headers)
+        policy: A RetryPolicy containing the number of attempts and the
+        pauses between them.
 
-    # Convert the response to a JSON file.
-    query_data = query_data.json()
+    Returns:
+        audio_data_clean: A Pandas dataframe containing the audio features for
+        each of the IDs in the input list, in the same order. Tracks without
+        audio features have a row of missing values.
 
-    # Restructure JSON file into a Pandas dataframe.
-    audio_data = pd.DataFrame.from_dict(query_data)
-    audio_data_clean = pd.json_normalize(audio_data['audio_features'])
+    Raises:
+        RequestFailed: If the request did not succeed within the number of
+        attempts allowed by the policy.
+    """
+    records = audio_feature_records(track_id_list, cache, policy)
+    audio_data_clean = pd.json_normalize([records.get(track_id, {}) for \
+    track_id in track_id_list])
     return audio_data_clean
@@ -0,0 +1,231 @@
+"""
+Record where the time goes when the dataset is built and analyzed. Each stage
+of the pipeline (downloading charts, searching Spotify, requesting audio
+features, and the analysis functions) is timed, and counters record the
+requests sent, retries, response body bytes (after any decompression), and
+rows processed by each stage. The measurements can be exported as JSON or in
+the Prometheus text format, and any stage can be profiled with cProfile and
+tracemalloc on request. Memory tracing is process-wide and cProfile only sees
+the thread it was started in, so only one stage is profiled at a time, and
+only when it runs in the main thread: the stages run by worker threads (such
+as billboard_download) are not profiled on their own.
+
+For example:
+
+    import instrumentation
+    instrumentation.METRICS.enable_profiling("search", memory=True)
+    ...build the dataset...
+    print(instrumentation.METRICS.to_json())
+"""
+
+# Import the required libraries.
+import contextlib
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+
+
+class Metrics:
+    """
+    A thread-safe record of the time spent in each stage of the pipeline and
+    of the counters of each stage.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counters = {}
+        self._profiled = {}
+        self._profiles = {}
+        self._profiling = False
+
+    @contextlib.contextmanager
+    def stage(self, name, rows=None):
+        """
+        Time the code run inside a with block as one call of a stage.
+
+        Args:
+            name: A string containing the name of the stage, such as 'search'.
+            rows: An integer containing the number of rows the stage
+            processes, added to its 'rows' counter, or None.
+        """
+        profiler, was_tracing = self._start_profile(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                timing = self._stages.setdefault(name, {"calls": 0, \
+                "seconds": 0.0, "max_seconds": 0.0})
+                timing["calls"] += 1
+                timing["seconds"] += seconds
+                timing["max_seconds"] = max(timing["max_seconds"], seconds)
+            if rows is not None:
+                self.count(name, "rows", rows)
+            self._stop_profile(name, profiler, was_tracing)
+
+    def count(self, stage, counter, amount=1):
+        """
+        Add to a counter of a stage.
+
+        Args:
+            stage: A string containing the name of the stage.
+            counter: A string containing the name of the counter, such as
+            'requests', 'retries', 'decoded_body_bytes', or 'rows'.
+            amount: A number to add to the counter.
+        """
+        with self._lock:
+            counters = self._counters.setdefault(stage, {})
+            counters[counter] = counters.get(counter, 0) + amount
+
+    def enable_profiling(self, stage, cpu=True, memory=False):
+        """
+        Profile every later call of a stage made from the main thread while no
+        other stage is being profiled.
+
+        Args:
+            stage: A string containing the name of the stage.
+            cpu: A boolean that is True to record the time spent in each
+            function with cProfile.
+            memory: A boolean that is True to record the peak memory
+            allocated by Python with tracemalloc.
+        """
+        with self._lock:
+            self._profiled[stage] = (cpu, memory)
+
+    def disable_profiling(self, stage):
+        """
+        Stop profiling a stage.
+        """
+        with self._lock:
+            self._profiled.pop(stage, None)
+
+    def snapshot(self):
+        """
+        Return a copy of everything recorded so far.
+
+        Returns:
+            A dictionary with a 'stages' dictionary mapping each stage name to
+            its 'calls', 'seconds', 'max_seconds', and counters, and a
+            'profiles' dictionary mapping each profiled stage to the text of
+            its slowest functions ('cpu') and its peak memory in bytes
+            ('peak_memory').
+        """
+        with self._lock:
+            stages = {name: dict(timing) for name, timing in \
+            self._stages.items()}
+            for name, counters in self._counters.items():
+                stages.setdefault(name, {"calls": 0, "seconds": 0.0, \
+                "max_seconds": 0.0}).update(counters)
+            return {"stages": stages, "profiles": {name: dict(profile) for \
+            name, profile in self._profiles.items()}}
+
+    def to_json(self, path=None):
+        """
+        Return everything recorded so far as JSON, optionally saving it.
+
+        Args:
+            path: A string containing the path of a file to save the JSON in,
+            or None to not save it.
+
+        Returns:
+            A string containing the JSON.
+        """
+        text = json.dumps(self.snapshot(), indent=2)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(text)
+        return text
+
+    def to_prometheus(self, prefix="pop_music"):
+        """
+        Return the timings and counters in the Prometheus text format.
+
+        Args:
+            prefix: A string put in front of the name of every metric.
+
+        Returns:
+            A string with one line per stage for each metric, such as
+            'pop_music_requests_total{stage="search"} 120'.
+        """
+        stages = self.snapshot()["stages"]
+        names = sorted({name for values in stages.values() for name in \
+        values})
+        lines = []
+        for name in names:
+            # The longest call is a gauge, and everything else only grows.
+            if name == "max_seconds":
+                metric, kind = f"{prefix}_{name}", "gauge"
+            else:
+                metric, kind = f"{prefix}_{name}_total", "counter"
+            lines.append(f"# TYPE {metric} {kind}")
+            for stage, values in sorted(stages.items()):
+                if name in values:
+                    lines.append(f'{metric}{{stage="{stage}"}} {values[name]}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """
+        Forget everything recorded so far, keeping the profiled stages.
+        """
+        with self._lock:
+            self._stages = {}
+            self._counters = {}
+            self._profiles = {}
+
+    def _start_profile(self, name):
+        """
+        Start profiling a stage if profiling has been enabled for it, it runs
+        in the main thread, and no other stage is being profiled. cProfile
+        only sees the thread that enables it, and tracemalloc is shared by
+        every thread, so a second session would stop or reset the first.
+        """
+        with self._lock:
+            cpu, memory = self._profiled.get(name, (False, False))
+            if self._profiling or threading.current_thread() is not \
+            threading.main_thread():
+                cpu, memory = False, False
+            elif cpu or memory:
+                self._profiling = True
+        profiler = cProfile.Profile() if cpu else None
+
+        # Remember whether memory was already being traced, so that tracing
+        # started by someone else is not stopped.
+        was_tracing = None
+        if memory:
+            was_tracing = tracemalloc.is_tracing()
+            if not was_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        if profiler is not None:
+            profiler.enable()
+        return profiler, was_tracing
+
+    def _stop_profile(self, name, profiler, was_tracing):
+        """
+        Stop profiling a stage and record the results.
+        """
+        profile = {}
+        if profiler is not None:
+            profiler.disable()
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text).sort_stats("cumulative")\
+            .print_stats(20)
+            profile["cpu"] = text.getvalue()
+        if was_tracing is not None:
+            profile["peak_memory"] = tracemalloc.get_traced_memory()[1]
+            if not was_tracing:
+                tracemalloc.stop()
+        if profile:
+            with self._lock:
+                self._profiles[name] = profile
+                self._profiling = False
+
+
+# The metrics recorded by every module of the pipeline.
+METRICS = Metrics()
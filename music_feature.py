@@ -6,18 +6,22 @@ features.
 
 # Import the required libraries.
 import datetime
+import numpy as np
 import pandas as pd
-from tqdm.autonotebook import tqdm
+import aggregation
+import parallel_analytics
+from instrumentation import METRICS
 
-def average_by_date(start_date, end_date, feature, song_dataframe):
+def average_by_date(start_date, end_date, feature, song_dataframe, \
+processes=None):
     """
     Return a dataframe containing the average values of a given feature for all
     the songs in each year.
 
     Calculate the numerical average (mean) of the values of the input feature
-    type for all of the songs in a given year, looped over each year in the
-    specified time period. Count and sum through the entire dataframe of songs
-    for a feature, and construct a dataframe of the results.
+    type for all of the songs in a given year, for each year in the specified
+    time period. The counting and summing is done for all the years at once by
+    the aggregation engine (see average_all).
 
     Args:
         start_date: An integer between 1958 and 2021 that contains the starting
@@ -35,7 +39,14 @@ def average_by_date(start_date, end_date, feature, song_dataframe):
         their corresponding Spotify Track IDs and Spotify-generated audio
         features. The dataframe has twenty four columns: Date, Song, Artist,
         Track ID, and the remaining columns represent various audio features.
-        Each row represents one song.
+        Each row represents one song. A SummaryIndex of the dataset can be
+        given instead, which answers without rescanning the songs, or a
+        ChartStore of the weekly charts, which counts every week a song
+        charted.
+
+        processes: An integer containing the largest number of processes the
+        songs are counted in (see parallel_analytics), or None to count them
+        in this process.
 
     Returns:
         average_by_date: A Pandas dataframe that contains the Date (of
@@ -43,40 +54,22 @@ def average_by_date(start_date, end_date, feature, song_dataframe):
         and Average (the numerical value of a particular audio feature for all
         the songs in a given year) for each of the years in the range specified.
     """
-    # Declare an empty dataframe with the appropriate columns.
-    feature_average = pd.DataFrame(columns=["Date", "Feature", "Average"])
-
-    # Loop through each year in the specified range.
-    for year in tqdm(range(start_date, end_date + 1, 1)):
-
-        # Set the date to the June 1st of the current year.
-        current_date = datetime.date(year, 6, 1)
-        current_sum = 0
-        count = 0
-
-        # Loop through each row in the input audio features dataframe.
-        for _, data in song_dataframe.iterrows():
-            # Check if the date matches at that instance.
-            if data["Date"] == str(current_date):
-                # Add the audio feature values.
-                current_sum += data[feature]
-                count += 1
+    return average_all(start_date, end_date, [feature], song_dataframe, \
+    processes)
 
-        # Calculate the average.
-        average = current_sum / count
-        feature_average = feature_average.append({"Date": current_date, \
-        "Feature": feature, "Average": average}, ignore_index=True)
-    return feature_average
 
-
-def average_all(start_date, end_date, features, song_dataframe):
+@METRICS.stage("average_all")
+def average_all(start_date, end_date, features, song_dataframe, \
+processes=None):
     """
     Return a dataframe containing the average values of each of the given
     features for all the songs in each year.
 
     Calculate the mean of the values of the input features for all of the songs
-    in a given year, looped over each year in the specified time period. Create
-    a dataframe for each audio feature and concatenate.
+    in a given year, for each year in the specified time period. Every song is
+    assigned to its year once, and the songs are counted and every feature is
+    summed for all the years in a single vectorized pass, so the running time
+    grows linearly with the number of songs.
 
     Args:
         start_date: An integer between 1958 and 2021 that contains the starting
@@ -94,41 +87,66 @@ def average_all(start_date, end_date, features, song_dataframe):
         their corresponding Spotify Track IDs and Spotify-generated audio
         features. The dataframe has twenty four columns: Date, Song, Artist,
         Track ID, and the remaining columns represent various audio features.
-        Each row represents one song.
+        Each row represents one song. A SummaryIndex of the dataset can be
+        given instead, which answers without rescanning the songs, or a
+        ChartStore of the weekly charts, which counts every week a song
+        charted.
+
+        processes: An integer containing the largest number of processes the
+        songs are counted in (see parallel_analytics), or None to count them
+        in this process.
 
     Returns:
         average_all: A Pandas dataframe that contains the Date (of featuring on
         Billboard Hot 100), Feature (audio feature by Spotify), and Average
         (the numerical value of a particular audio feature for all the songs in
-        a given year) for each of the years in the range specified.
-    """
-    # Declare an empty dataframe with the appropriate columns.
-    average_all_features = pd.DataFrame(columns=["Date", "Feature", "Average"])
+        a given year) for each of the years in the range specified. Years
+        without any songs have an Average of NaN.
 
-    # Loop through each feature in the input list.
-    for feature in features:
-        # Find the dataframe containing the averages the current feature.
-        current_averages = average_by_date(start_date, end_date, feature, \
-        song_dataframe)
-        # Concatenate dataframes together fall all the features.
-        average_all_features = pd.concat\
-        ([average_all_features, current_averages], ignore_index=True)
-
-    return average_all_features
+    Raises:
+        ValueError: If processes is less than 1.
+    """
+    parallel_analytics.check_processes(processes)
+
+    # Count the songs and sum each feature for every year in one pass, or ask
+    # a summary index or chart store for the counts and sums.
+    if not isinstance(song_dataframe, pd.DataFrame):
+        counts, sums = song_dataframe.feature_sums(start_date, end_date, \
+        features, processes)
+    elif processes is not None:
+        counts, sums = parallel_analytics.frame_feature_sums(start_date, \
+        end_date, features, song_dataframe, processes)
+    else:
+        counts, sums = aggregation.frame_feature_sums(start_date, end_date, \
+        features, song_dataframe)
+    if isinstance(song_dataframe, pd.DataFrame):
+        METRICS.count("average_all", "rows", len(song_dataframe))
+
+    # Divide and lay out the averages in the format used for plotting.
+    return aggregation.average_frame(start_date, end_date, features, counts, \
+    sums)
 
 # A list containing all the 12 musical keys in a particular standard format so
 # that an index of 0 corresponds to C and so forth.
 KEY_NAME_LIST = ["C", "C#", "D", "D#", "E", "F", \
 "F#", "G", "G#", "A", "A#", "B"]
 
-def key_proportion(start_date, end_date, song_dataframe):
+# The names of the two modes in the order of the mode index returned by the
+# Spotify API.
+MODE_NAME_LIST = ["Minor", "Major"]
+
+@METRICS.stage("key_proportion")
+def key_proportion(start_date, end_date, song_dataframe, by_mode=False, \
+processes=None):
     """
     Return a dataframe containing the relative proportion of songs in each key
     for each year.
 
     Add up the number of songs in each key for each year, and divide by the
     total number of songs in each year (which may not be 100 if all the track
-    IDs couldn't be found for a particular year).
+    IDs couldn't be found for a particular year). The songs are counted into a
+    matrix of years by keys in a single pass (see aggregation.key_counts), and
+    every proportion is then found with one division.
 
     Args:
         start_date: An integer between 1958 and 2021 that contains the starting
@@ -143,44 +161,68 @@ def key_proportion(start_date, end_date, song_dataframe):
         their corresponding Spotify Track IDs and Spotify-generated audio
         features. The dataframe has twenty four columns: Date, Song, Artist,
         Track ID, and the remaining columns represent various audio features.
-        Each row represents one song.
+        Each row represents one song. A SummaryIndex of the dataset can be
+        given instead, which answers without rescanning the songs, or a
+        ChartStore of the weekly charts, which counts every week a song
+        charted.
+
+        by_mode: A boolean that is True to count the major and minor songs in
+        each key separately.
+
+        processes: An integer containing the largest number of processes the
+        songs are counted in (see parallel_analytics), or None to count them
+        in this process.
 
     Returns:
         key_dataframe_final: A Pandas dataframe that contains the Date, Key,
-        Count, and Proportion for each of the years in the range specified.
+        Count, and Proportion for each of the years in the range specified,
+        with a Mode column after the Key if by_mode is True. Only the keys
+        with at least one song are included, sorted by date and then key.
+        Songs without a detected key are not counted.
+
+    Raises:
+        ValueError: If processes is less than 1.
     """
-    # Declare a list of years spanning the specified time period
-    year_list = [str(datetime.date(year, 6, 1)) for year in range(start_date, \
-    end_date+1)]
-
-    # Slice out the section of the input dataframe that is within the specified
-    # time period.
-    time_span_dataframe = song_dataframe[song_dataframe.Date.isin(year_list)]
-
-    # Count the number of songs for each key for each year.
-    key_dataframe = time_span_dataframe.groupby(by=["Date","key"]).count()
-
-    # Remove the redundant columns, keeping only the first one.
-    key_dataframe = key_dataframe.drop\
-    (key_dataframe.columns[range(1,len(key_dataframe.columns))], axis=1)
-
-    # Calculate the proportion of each key by summing the number of songs for
-    # each year and dividing that by the number of songs in a particular key
-    # for the respective years.
-    key_proportions = key_dataframe.groupby(level=0).apply\
-    (lambda x: x/float(x.sum()))
-
-    # Concatenating the dataframes containing the Count and Proportion and
-    # re-introducing the columns containing the Date and the Key.
-    key_dataframe_final = pd.concat([key_dataframe, key_proportions], axis=1)\
-    .reset_index()
-
-    # Setting the names for the columns of the resulting dataframe.
-    key_dataframe_final.columns = ["Date", "Key", "Count", "Proportion"]
-
-    # Replacing the key index integer returned by the Spotify API with a string
-    # containing the actual key corresponding to that key index.
-    key_dataframe_final["Key"] = key_dataframe_final["Key"].replace(range(12),
-    KEY_NAME_LIST)
+    parallel_analytics.check_processes(processes)
+
+    # Count the songs in each key (and mode) for every year in one pass, or
+    # ask a summary index or chart store for the counts.
+    if not isinstance(song_dataframe, pd.DataFrame):
+        counts = song_dataframe.key_counts(start_date, end_date, by_mode, \
+        processes)
+    else:
+        METRICS.count("key_proportion", "rows", len(song_dataframe))
+        offsets = aggregation.year_offsets(song_dataframe["Date"], \
+        start_date, end_date)
+        keys = song_dataframe["key"].to_numpy(dtype=np.float64, \
+        na_value=np.nan)
+        modes = song_dataframe["mode"].to_numpy(dtype=np.float64, \
+        na_value=np.nan) if by_mode else None
+        if processes is None:
+            counts = aggregation.key_counts(offsets, keys, end_date - \
+            start_date + 1, modes)
+        else:
+            counts = parallel_analytics.key_counts(offsets, keys, end_date - \
+            start_date + 1, modes, processes)
+
+    # Divide every count by the number of songs in its year at once.
+    totals = counts.reshape(len(counts), -1).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        proportions = counts / totals.reshape((-1,) + (1,) * \
+        (counts.ndim - 1))
+
+    # Keep the keys that have songs and look up their dates and names.
+    cells = np.nonzero(counts)
+    years = np.array([str(datetime.date(year, 6, 1)) for year in \
+    range(start_date, end_date + 1)], dtype=object)
+    key_dataframe_final = pd.DataFrame({
+        "Date": years[cells[0]],
+        "Key": np.array(KEY_NAME_LIST, dtype=object)[cells[1]],
+    })
+    if by_mode:
+        key_dataframe_final["Mode"] = np.array(MODE_NAME_LIST, \
+        dtype=object)[cells[2]]
+    key_dataframe_final["Count"] = counts[cells].astype(np.int64)
+    key_dataframe_final["Proportion"] = proportions[cells]
 
     return key_dataframe_final
@@ -0,0 +1,156 @@
+"""
+Clean artist names and titles, and turn them into match keys. The substrings
+that clutter artist names (such as '&' and 'featuring') are removed with one
+translation table and one precompiled regular expression that only matches
+whole words, instead of one replace pass per substring that also cut 'and'
+out of names like 'Rolland'. Whole columns are cleaned at once by cleaning
+each distinct name only once, since the same artists chart week after week.
+Match keys are a stricter canonical form of a (title, artist) pair, used to
+recognize the same song written differently when caching and removing
+duplicates.
+"""
+
+# Import the required libraries.
+import re
+import unicodedata
+import numpy as np
+import pandas as pd
+
+# Define the substrings that must be cleaned from the artists' name.
+CLUTTERERS = [".", "&", "featuring ", "and ", "+", "?", " x ", "feat"]
+
+# The clutterers in two passes: a translation table for the symbols, and one
+# expression for the words, which only match on their own. Each clutterer is
+# replaced by a single space, as the separate replace passes did.
+CLUTTER_SYMBOLS = str.maketrans(".&+?", "    ")
+CLUTTER_PATTERN = re.compile(r"\b(?:featuring\b ?|and\b ?|feat\b)| x ")
+
+# The words left out of match keys, since they are written in different ways
+# (or not at all) for the same song. Words such as 'x' and 'with' are kept,
+# since they are also common words of real titles.
+MATCH_STOP_WORDS = {"the", "and", "feat", "featuring", "ft"}
+
+# Anything other than letters and digits, which separates the words of a key.
+NON_WORD_PATTERN = re.compile(r"[^a-z0-9]+")
+
+
+def clean_artist(artist):
+    """
+    Return the artist name in a reformatted form that is consistent across all
+    songs that feature multiple artists.
+
+    Convert the artists' names to lowercase, and remove strings such as ".",
+    "&", "featuring ", "and ", "+", "?", " x ", and "feat", replacing them with
+    whitespace. The words are only removed where they stand on their own, so
+    names such as 'Rolland' or 'Featherstone' are kept. This makes it easier to
+    keyword search the tracks in the Spotify API later on.
+
+    Args:
+        artist: A string containing the name(s) of the artist(s) who perform or
+        are featured in any track.
+
+    Returns:
+        A string containing the reformatted name(s) of the artist(s) in
+        lowercase without the unnecessary and confusing symbols used when there
+        are multiple artists.
+    """
+    return CLUTTER_PATTERN.sub(" ", artist.lower().translate(CLUTTER_SYMBOLS))
+
+
+def clean_artists(artists):
+    """
+    Return every artist name in a column cleaned by clean_artist.
+
+    Args:
+        artists: A Pandas series or list of artist name strings.
+
+    Returns:
+        A Pandas series of the cleaned names, with the same index as artists
+        if it is a series.
+    """
+    return _map_unique(artists, clean_artist)
+
+
+def match_key(title, artist):
+    """
+    Return the canonical form of a song used to recognize the same song
+    written in different ways.
+
+    Accents are removed, the text is lowercased, punctuation is dropped, and
+    the words in MATCH_STOP_WORDS are left out, so 'Beyoncé & JAY-Z' and
+    'beyonce featuring jay z' give the same key.
+
+    Args:
+        title: A string containing the title of the song.
+        artist: A string containing the name(s) of the artist(s).
+
+    Returns:
+        A string containing the title and artist keys separated by '|'.
+    """
+    return f"{canonical_text(title)}|{canonical_text(artist)}"
+
+
+def match_keys(titles, artists):
+    """
+    Return the match key of every song in two columns.
+
+    Args:
+        titles: A Pandas series or list of song titles.
+        artists: A Pandas series or list of artist names, in the same order.
+
+    Returns:
+        A Pandas series of match key strings.
+    """
+    return canonical_texts(titles).str.cat(canonical_texts(artists)\
+    .to_numpy(), sep="|")
+
+
+def canonical_texts(texts):
+    """
+    Return the canonical form (see canonical_text) of every text in a column,
+    working out each distinct text only once.
+
+    Args:
+        texts: A Pandas series or list of titles or artist names.
+
+    Returns:
+        A Pandas series of strings, with missing texts left missing.
+    """
+    return _map_unique(texts, canonical_text)
+
+
+def canonical_text(text):
+    """
+    Return a title or artist name without accents, punctuation, case, or the
+    words in MATCH_STOP_WORDS.
+
+    If nothing would be left, as for a title such as 'The' or a name written
+    only in a non-Latin script, the lowercased NFKC form of the text is
+    returned instead, so that different songs are not given the same key.
+
+    Args:
+        text: A string.
+
+    Returns:
+        A string of lowercase words separated by single spaces.
+    """
+    text = str(text)
+    ascii_text = unicodedata.normalize("NFKD", text).encode("ascii", \
+    "ignore").decode("ascii").lower()
+    canonical = " ".join(word for word in NON_WORD_PATTERN.sub(" ", \
+    ascii_text).split() if word not in MATCH_STOP_WORDS)
+    return canonical or " ".join(unicodedata.normalize("NFKC", text).lower()\
+    .split())
+
+
+def _map_unique(values, function):
+    """
+    Apply a function to each distinct value of a column only once, and give
+    every row the result for its value. Missing values stay missing.
+    """
+    series = values if isinstance(values, pd.Series) else pd.Series(values, \
+    dtype=object)
+    codes, uniques = pd.factorize(series)
+    results = np.array([function(value) for value in uniques] + [np.nan], \
+    dtype=object)
+    return pd.Series(results[codes], index=series.index, dtype=object)
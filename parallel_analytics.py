@@ -0,0 +1,248 @@
+"""
+Spread the counting and summing behind music_feature.average_all and
+key_proportion over several processes. The songs are split into contiguous
+ranges of rows that start and end at year boundaries, each process counts and
+sums its range with the aggregation engine, and the partial counts, sums, and
+key histograms are added together. The song arrays are placed in shared
+memory once, so the processes read them directly rather than receiving a
+pickled copy of the dataframe. No more processes than CPU cores are started,
+and datasets too small to repay starting them are counted in this process.
+"""
+
+# Import the required libraries.
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+import aggregation
+
+# The fewest songs counted in several processes. Starting the processes and
+# sharing the arrays takes longer than counting fewer songs in one.
+PARALLEL_MIN_ROWS = 1_000_000
+
+
+def default_processes():
+    """
+    Return the number of processes used when none is given, which is the
+    number of CPU cores.
+    """
+    return os.cpu_count() or 1
+
+
+def check_processes(processes):
+    """
+    Check that a number of processes is None or at least 1.
+
+    Raises:
+        ValueError: If processes is less than 1.
+    """
+    if processes is not None and processes < 1:
+        raise ValueError(f"processes must be at least 1, not {processes}")
+
+
+def worker_count(row_count, processes=None):
+    """
+    Return the number of processes worth counting a number of songs in.
+
+    Args:
+        row_count: An integer containing the number of songs.
+        processes: An integer containing the largest number of processes, or
+        None for one per CPU core.
+
+    Returns:
+        An integer containing the number of processes, which is 1 when there
+        are fewer than PARALLEL_MIN_ROWS songs and is never more than the
+        number of CPU cores.
+    """
+    if row_count < PARALLEL_MIN_ROWS:
+        return 1
+    return min(default_processes(), default_processes() if processes is None \
+    else processes)
+
+
+def partition(offsets, parts):
+    """
+    Return the boundaries of contiguous row ranges of roughly equal size that
+    do not split the rows of one year, as long as the rows are sorted by date.
+
+    Args:
+        offsets: A numpy integer array containing the year offset of each
+        song, as returned by aggregation.year_offsets.
+        parts: An integer containing the largest number of ranges.
+
+    Returns:
+        A list of (start, stop) tuples of row numbers covering every row.
+    """
+    row_count = len(offsets)
+    bounds = np.linspace(0, row_count, parts + 1).astype(np.int64)
+
+    # Move each boundary forward to the first row of the next year.
+    changes = np.append(np.flatnonzero(np.diff(offsets)) + 1, row_count)
+    bounds[1:-1] = changes[np.minimum(np.searchsorted(changes, \
+    bounds[1:-1]), len(changes) - 1)]
+    bounds = np.unique(bounds)
+    return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], \
+    bounds[1:]) if stop > start] or [(0, row_count)]
+
+
+def feature_sums(offsets, values, year_count, processes=None):
+    """
+    Return the number of songs and the sum of each feature for every year,
+    like aggregation.feature_sums, using several processes.
+
+    When the rows are sorted by date each year is summed by one process in
+    the same order as aggregation.feature_sums, so the results are identical.
+    Otherwise the partial sums of a year are added together, which can differ
+    from a single pass in the last bits of the floating point sums.
+
+    Args:
+        offsets: A numpy integer array containing the year offset of each
+        song. Songs with an offset of -1 are skipped.
+        values: A two dimensional numpy array with one row per song and one
+        column per feature.
+        year_count: An integer containing the number of years.
+        processes: An integer containing the largest number of processes (see
+        worker_count), or None to use one per CPU core.
+
+    Returns:
+        A tuple of the counts and sums arrays described in
+        aggregation.feature_sums.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if worker_count(len(values), processes) == 1:
+        return aggregation.feature_sums(offsets, values, year_count)
+    parts = _map_parts(_feature_sums_part, offsets, [values], year_count, \
+    processes)
+    feature_count = values.shape[1]
+    counts = np.zeros((year_count, feature_count), dtype=np.int64)
+    sums = np.zeros((year_count, feature_count))
+    for part_counts, part_sums in parts:
+        counts += part_counts
+        sums += part_sums
+    return counts, sums
+
+
+def key_counts(offsets, keys, year_count, modes=None, processes=None):
+    """
+    Return the number of songs in each key (and optionally each mode) for
+    every year, like aggregation.key_counts, using several processes.
+
+    Args:
+        offsets: A numpy integer array containing the year offset of each
+        song.
+        keys: A numpy array containing the key index of each song.
+        year_count: An integer containing the number of years.
+        modes: A numpy array containing the mode of each song, or None to
+        count the keys only.
+        processes: An integer containing the largest number of processes (see
+        worker_count), or None to use one per CPU core.
+
+    Returns:
+        The count array described in aggregation.key_counts.
+    """
+    if worker_count(len(keys), processes) == 1:
+        return aggregation.key_counts(offsets, keys, year_count, modes)
+    arrays = [np.asarray(keys, dtype=np.float64)]
+    if modes is not None:
+        arrays.append(np.asarray(modes, dtype=np.float64))
+    return sum(_map_parts(_key_counts_part, offsets, arrays, year_count, \
+    processes))
+
+
+def frame_feature_sums(start_date, end_date, features, song_dataframe, \
+processes=None):
+    """
+    Return the yearly song counts and feature sums of a song dataframe, like
+    aggregation.frame_feature_sums, using several processes.
+    """
+    offsets = aggregation.year_offsets(song_dataframe["Date"], start_date, \
+    end_date)
+    values = song_dataframe[list(features)].to_numpy(dtype=np.float64, \
+    na_value=np.nan)
+    return feature_sums(offsets, values, end_date - start_date + 1, processes)
+
+
+def _map_parts(work, offsets, arrays, year_count, processes):
+    """
+    Share the offsets and song arrays, run work on every range of rows in a
+    pool of processes, and return the results in order.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    ranges = partition(offsets, worker_count(len(offsets), processes))
+    blocks = [_SharedArray(array) for array in [offsets] + arrays]
+    try:
+        specs = [block.spec for block in blocks]
+        with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+            return list(executor.map(work, [specs] * len(ranges), \
+            [start for start, _ in ranges], [stop for _, stop in ranges], \
+            [year_count] * len(ranges)))
+    finally:
+        for block in blocks:
+            block.release()
+
+
+def _feature_sums_part(specs, start, stop, year_count):
+    """
+    Count and sum the features of one range of rows in a worker process.
+    """
+    memories, (offsets, values) = _attach(specs)
+    result = aggregation.feature_sums(offsets[start:stop], values[start:stop], \
+    year_count)
+    del offsets, values
+    _detach(memories)
+    return result
+
+
+def _key_counts_part(specs, start, stop, year_count):
+    """
+    Count the keys (and modes) of one range of rows in a worker process.
+    """
+    memories, arrays = _attach(specs)
+    modes = arrays[2][start:stop] if len(arrays) > 2 else None
+    result = aggregation.key_counts(arrays[0][start:stop], \
+    arrays[1][start:stop], year_count, modes)
+    del arrays, modes
+    _detach(memories)
+    return result
+
+
+class _SharedArray:
+    """
+    A copy of a numpy array in a block of shared memory, which is removed by
+    release.
+
+    Attributes:
+        spec: A (name, shape, dtype) tuple used by worker processes to attach
+        to the block.
+    """
+
+    def __init__(self, array):
+        self._memory = shared_memory.SharedMemory(create=True, \
+        size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=self._memory.buf)[:] = \
+        array
+        self.spec = (self._memory.name, array.shape, array.dtype.str)
+
+    def release(self):
+        self._memory.close()
+        self._memory.unlink()
+
+
+def _attach(specs):
+    """
+    Attach to shared arrays in a worker process, returning the blocks of
+    shared memory and numpy views of the arrays. Every view must be deleted
+    before the blocks are passed to _detach.
+    """
+    memories = [shared_memory.SharedMemory(name=name) for name, _, _ in specs]
+    return memories, [np.ndarray(shape, dtype, buffer=memory.buf) for \
+    memory, (_, shape, dtype) in zip(memories, specs)]
+
+
+def _detach(memories):
+    """
+    Detach from the blocks of shared memory attached to by _attach.
+    """
+    for memory in memories:
+        memory.close()
@@ -0,0 +1,76 @@
+"""
+Limit how quickly requests are sent to the Spotify API when many threads are
+querying it at once. Spotify answers clients that send too many requests with
+HTTP 429 (Too Many Requests) and a Retry-After header, so the limiter can also
+be paused for every thread at once when that happens.
+"""
+
+# Import the required libraries.
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket that allows a steady number of requests per
+    second with short bursts of up to `capacity` requests.
+
+    Attributes:
+        rate: A float containing the number of tokens added per second.
+        capacity: A float containing the maximum number of stored tokens.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        Create a full token bucket.
+
+        Args:
+            rate: A positive number containing the average number of requests
+            allowed per second.
+
+            capacity: A number containing the largest burst of requests
+            allowed at once. Defaults to one second's worth of requests.
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else \
+        max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Wait until a request may be sent, then use up one token.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+
+                # Add the tokens earned since the last update.
+                self._tokens = min(self.capacity, self._tokens + \
+                (now - self._updated) * self.rate)
+                self._updated = now
+
+                # Work out how long to wait, or take a token if one is free.
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Stop every thread from sending requests for a number of seconds, such
+        as the Retry-After time of an HTTP 429 response.
+
+        Args:
+            seconds: A float containing the number of seconds to pause for.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + \
+            seconds)
+            self._tokens = 0.0
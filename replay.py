@@ -0,0 +1,375 @@
+"""
+Record the responses of the Spotify API and the Billboard charts once, and
+replay them afterwards without a network connection or Spotify credentials.
+In record mode every Spotify GET request sent through the shared client, and
+every chart downloaded, is stored in one compressed, indexed SQLite archive.
+In replay mode the same requests are answered from the archive, optionally
+after a set latency, so that full runs of the pipeline are repeatable and take
+seconds. Charts are read through billboard_scraper.CHART_DATA, which offline
+replaces for the length of the run, so every step that downloads charts with
+the default chart source is covered. The shared response cache
+(response_cache.DEFAULT_CACHE) is disabled for the run as well, so that every
+request reaches the archive. For example:
+
+    with replay.offline("pipeline.sqlite", mode="record"):
+        songs = billboard_scraper.hot_100_data(1961, 2020)
+        ...
+    with replay.offline("pipeline.sqlite"):
+        ...the same calls, answered from the archive...
+
+Any other ResponseCache passed to spotify_id_query and get_audio_features is
+still used, and answers requests without recording them, so runs meant to be
+replayed should pass either the default cache or cache=None.
+"""
+
+# Import the required libraries.
+import contextlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import parse_qsl, urlsplit
+import billboard
+import requests
+
+import billboard_scraper
+import response_cache
+import spotify_client
+import spotify_id_query
+
+
+class ReplayMissing(LookupError):
+    """
+    Raised in replay mode when a request was not recorded in the archive.
+    """
+
+
+class Archive:
+    """
+    A thread-safe SQLite file of recorded responses, each compressed with zlib
+    and indexed by its request key.
+
+    Attributes:
+        path: A string containing the path of the SQLite database file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS responses (key "
+        "TEXT PRIMARY KEY, status INTEGER NOT NULL, body BLOB NOT NULL)")
+        self._connection.commit()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(method, url, params=None):
+        """
+        Return the key of a request, made of its method, path, and sorted
+        query parameters. The scheme and host are left out, so responses
+        recorded from one server can be replayed for another.
+
+        Args:
+            method: A string containing the HTTP method, such as 'GET'.
+            url: A string containing the URL, which may contain parameters.
+            params: A dictionary of any other query parameters.
+
+        Returns:
+            A string such as 'GET /v1/search?limit=1&q=halo&type=track'.
+        """
+        parts = urlsplit(requests.Request(method, url, params=params)\
+        .prepare().url)
+        query = "&".join(f"{name}={value}" for name, value in \
+        sorted(parse_qsl(parts.query, keep_blank_values=True)))
+        return f"{method.upper()} {parts.path}?{query}"
+
+    def get(self, key):
+        """
+        Return the (status, body) pair recorded under a key, or None.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT status, body FROM "
+            "responses WHERE key = ?", (key,)).fetchone()
+        return None if row is None else (row[0], zlib.decompress(row[1]))
+
+    def put(self, key, status, body):
+        """
+        Record a response under a key, replacing any earlier one.
+
+        Args:
+            key: A string containing the request key.
+            status: An integer containing the HTTP status code.
+            body: A bytes object containing the response body.
+        """
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO responses "
+            "VALUES (?, ?, ?)", (key, status, zlib.compress(body)))
+            self._connection.commit()
+
+    def __len__(self):
+        """
+        Return the number of recorded responses.
+        """
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM "
+            "responses").fetchone()[0]
+
+    def close(self):
+        """
+        Close the database file.
+        """
+        with self._lock:
+            self._connection.close()
+
+
+class RecordingClient:
+    """
+    A stand-in for a SpotifyClient that sends every request through the
+    client and records the answers to GET requests in an archive. Requests
+    for tokens are not recorded, and neither are server errors and rate
+    limits, which would only be retried.
+    """
+
+    def __init__(self, client, archive):
+        self.client = client
+        self.archive = archive
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request through the client, recording the response. See
+        SpotifyClient.request.
+        """
+        response = self.client.request(method, url, **kwargs)
+        if method.upper() == "GET" and response.status_code < 500 and \
+        response.status_code != 429:
+            self.archive.put(Archive.key(method, url, kwargs.get(\
+            "params")), response.status_code, response.content)
+        return response
+
+    def get(self, url, **kwargs):
+        """
+        Send a GET request. See request.
+        """
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """
+        Send a POST request. See request.
+        """
+        return self.request("POST", url, **kwargs)
+
+    def latency_stats(self):
+        """
+        Return the statistics of the client. See SpotifyClient.latency_stats.
+        """
+        return self.client.latency_stats()
+
+    def reset_stats(self):
+        """
+        Forget the times of the requests sent so far.
+        """
+        self.client.reset_stats()
+
+
+class ReplayClient:
+    """
+    A stand-in for a SpotifyClient that answers GET requests from an archive
+    without a network connection.
+
+    Attributes:
+        archive: The Archive the responses are read from.
+        latency: A float containing the number of seconds each request waits
+        before it is answered, to imitate a real server.
+    """
+
+    def __init__(self, archive, latency=0.0):
+        self.archive = archive
+        self.latency = latency
+
+    def request(self, method, url, **kwargs):
+        """
+        Return the recorded response to a request.
+
+        Raises:
+            ReplayMissing: If the request was not recorded.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        key = Archive.key(method, url, kwargs.get("params"))
+        recorded = self.archive.get(key)
+        if recorded is None:
+            raise ReplayMissing(f"No recorded response for {key}")
+        response = requests.Response()
+        response.status_code, response._content = recorded
+        response.headers["Content-Type"] = "application/json"
+        response.url = url
+        return response
+
+    def get(self, url, **kwargs):
+        """
+        Answer a GET request. See request.
+        """
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """
+        Answer a POST request. See request.
+        """
+        return self.request("POST", url, **kwargs)
+
+    def latency_stats(self):
+        """
+        Return empty statistics, since no requests are sent.
+        """
+        return {"count": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+
+    def reset_stats(self):
+        """
+        Do nothing, since no request times are recorded.
+        """
+
+
+class ReplayTokens:
+    """
+    A stand-in for a TokenProvider in replay mode, which needs neither
+    credentials nor a token request.
+    """
+
+    def token(self):
+        """
+        Return a made up access token.
+        """
+        return "replay"
+
+    def headers(self):
+        """
+        Return the request headers with the made up access token.
+        """
+        return {"Authorization": f"Bearer {self.token()}"}
+
+    def invalidate(self):
+        """
+        Do nothing, since the made up token is never rejected.
+        """
+
+
+class OfflineSession:
+    """
+    The archive of a run started by offline, and the chart source that
+    billboard_scraper uses while the run lasts.
+
+    Attributes:
+        archive: The Archive the responses are recorded in or read from.
+        mode: A string, either 'record' or 'replay'.
+        latency: A float containing the number of seconds each replayed
+        request waits before it is answered.
+    """
+
+    def __init__(self, archive, mode, latency=0.0, \
+    chart_data=billboard.ChartData):
+        self.archive = archive
+        self.mode = mode
+        self.latency = latency
+        self._download = chart_data
+
+    def chart_data(self, name, date):
+        """
+        Return a chart, called like billboard.ChartData. In record mode the
+        chart is downloaded and recorded, and in replay mode it is read from
+        the archive.
+
+        Args:
+            name: A string containing the name of the chart, such as
+            'hot-100'.
+            date: A date object or string containing the date of the chart.
+
+        Returns:
+            A RecordedChart.
+
+        Raises:
+            ReplayMissing: If the chart was not recorded, in replay mode.
+        """
+        key = f"CHART /{name}/{date}?"
+        if self.mode == "record":
+            entries = [[entry.title, entry.artist] for entry in \
+            self._download(name, date=date).entries]
+            self.archive.put(key, 200, json.dumps(entries).encode("utf-8"))
+        else:
+            if self.latency:
+                time.sleep(self.latency)
+            recorded = self.archive.get(key)
+            if recorded is None:
+                raise ReplayMissing(f"No recorded chart for {key}")
+            entries = json.loads(recorded[1])
+        return RecordedChart(entries)
+
+
+class RecordedChart:
+    """
+    A recorded chart, with the entries attribute of billboard.ChartData.
+
+    Attributes:
+        entries: A list of ChartEntry objects, one per song in chart order.
+    """
+
+    def __init__(self, entries):
+        self.entries = [ChartEntry(title, artist) for title, artist in \
+        entries]
+
+
+class ChartEntry:
+    """
+    One song of a recorded chart, with the title and artist attributes of
+    billboard.ChartEntry.
+    """
+
+    def __init__(self, title, artist):
+        self.title = title
+        self.artist = artist
+
+
+@contextlib.contextmanager
+def offline(path, mode="replay", latency=0.0, chart_data=None):
+    """
+    Record or replay every Spotify request and Billboard chart until the with
+    block ends. The shared Spotify client and billboard_scraper.CHART_DATA are
+    replaced, and response_cache.DEFAULT_CACHE is disabled, while the block
+    runs.
+
+    Args:
+        path: A string containing the path of the archive file.
+        mode: A string, 'record' to send the requests and record the
+        responses, or 'replay' to answer them from the archive.
+        latency: A float containing the number of seconds each replayed
+        request and chart waits before it is answered.
+        chart_data: The class used to download charts in record mode, called
+        like billboard.ChartData, or None to use billboard_scraper.CHART_DATA.
+
+    Yields:
+        An OfflineSession, whose chart_data method is the chart source used
+        by billboard_scraper until the block ends.
+
+    Raises:
+        ValueError: If the mode is neither 'record' nor 'replay'.
+    """
+    if mode not in ("record", "replay"):
+        raise ValueError(f"Unknown mode: {mode}")
+    archive = Archive(path)
+    saved = (spotify_client.DEFAULT_CLIENT, spotify_id_query.token_provider, \
+    billboard_scraper.CHART_DATA)
+    if mode == "record":
+        spotify_client.DEFAULT_CLIENT = RecordingClient(saved[0], archive)
+    else:
+        spotify_client.DEFAULT_CLIENT = ReplayClient(archive, latency)
+        spotify_id_query.token_provider = ReplayTokens()
+    session = OfflineSession(archive, mode, latency, chart_data or saved[2])
+    billboard_scraper.CHART_DATA = session.chart_data
+    cache_enabled = response_cache.DEFAULT_CACHE.enabled
+    response_cache.DEFAULT_CACHE.enabled = False
+    try:
+        yield session
+    finally:
+        spotify_client.DEFAULT_CLIENT, spotify_id_query.token_provider, \
+        billboard_scraper.CHART_DATA = saved
+        response_cache.DEFAULT_CACHE.enabled = cache_enabled
+        archive.close()
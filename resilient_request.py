@@ -0,0 +1,182 @@
+"""
+Send requests to the Spotify API again when they fail for a reason that is
+likely to pass, such as a dropped connection, a server error, or rate
+limiting. Each attempt waits exponentially longer than the one before, with a
+random jitter so that many threads do not all retry at the same moment, and
+the request is given up after a limited number of attempts. A request
+rejected once with HTTP 401 is sent again with a new access token.
+"""
+
+# Import the required libraries.
+import datetime
+import email.utils
+import random
+import time
+import requests
+
+from instrumentation import METRICS
+
+# The HTTP status codes of failures that are worth retrying.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RequestFailed(Exception):
+    """
+    Raised when a request has not succeeded after every allowed attempt, or
+    has failed in a way that retrying cannot fix.
+
+    Attributes:
+        response: The last requests.Response received, or None if the last
+        attempt raised an error instead.
+        attempts: An integer containing the number of attempts made.
+    """
+
+    def __init__(self, message, response=None, attempts=0):
+        super().__init__(message)
+        self.response = response
+        self.attempts = attempts
+
+
+class RetryPolicy:
+    """
+    How many times to attempt a request and how long to wait in between.
+
+    Attributes:
+        max_attempts: An integer containing the largest number of attempts.
+        base_delay: A float containing the number of seconds waited after the
+        first failed attempt, doubled after each further failure.
+        max_delay: A float containing the longest wait in seconds.
+        jitter: A boolean that is True to wait a random time between zero and
+        the exponential delay ("full jitter"), or False to wait the exact
+        delay.
+    """
+
+    def __init__(self, max_attempts=6, base_delay=0.5, max_delay=30.0, \
+    jitter=True):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def delay(self, attempt):
+        """
+        Return the number of seconds to wait after a failed attempt.
+
+        Args:
+            attempt: An integer containing the number of the failed attempt,
+            starting from 1.
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(0, delay) if self.jitter else delay
+
+
+# The policy used for Spotify requests unless another one is given.
+DEFAULT_POLICY = RetryPolicy()
+
+
+def retry_after_seconds(retry_after):
+    """
+    Return the number of seconds to wait given by a Retry-After header.
+
+    Args:
+        retry_after: A string containing the header value, either a number of
+        seconds or an HTTP date such as 'Wed, 21 Oct 2026 07:28:00 GMT'.
+
+    Returns:
+        A float containing the number of seconds, which is 0.0 for a date in
+        the past, or None if the value is neither a number nor a date.
+    """
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (date - datetime.datetime.now(datetime.timezone.utc))\
+    .total_seconds())
+
+
+def send_with_retry(send, policy=DEFAULT_POLICY, limiter=None, \
+stage="spotify", refresh_token=None):
+    """
+    Return the successful response of a request, attempting it again after
+    failures that are likely to pass.
+
+    Connection errors, timeouts, and the statuses in RETRY_STATUSES are
+    retried after the delay given by the policy, or after the Retry-After time
+    if Spotify gives one (in seconds or as an HTTP date). A Retry-After pause
+    is applied to every thread sharing the limiter. The first HTTP 401 is
+    retried at once after refresh_token is called, since the access token may
+    have been revoked before it was due to expire.
+
+    Args:
+        send: A function without arguments that sends the request and returns
+        a requests.Response.
+        policy: A RetryPolicy containing the number of attempts and delays.
+        limiter: A TokenBucket shared by all threads sending requests, or None
+        to send requests as quickly as possible.
+        stage: A string containing the name of the stage whose 'requests',
+        'retries', 'decoded_body_bytes', and 'failures' counters are updated
+        (see instrumentation). The body bytes are counted after decompression,
+        as the counter's name says.
+        refresh_token: A function without arguments that makes send use a new
+        access token, or None to not retry HTTP 401.
+
+    Returns:
+        The requests.Response of the first successful attempt.
+
+    Raises:
+        RequestFailed: If every attempt failed, or a failure cannot be fixed by
+        retrying (such as HTTP 400 or 404).
+    """
+    response = None
+    refreshed = False
+    for attempt in range(1, policy.max_attempts + 1):
+        if limiter is not None:
+            limiter.acquire()
+        if attempt > 1:
+            METRICS.count(stage, "retries")
+
+        # Send the request, treating connection problems like server errors.
+        METRICS.count(stage, "requests")
+        try:
+            response = send()
+        except requests.RequestException:
+            response = None
+        else:
+            METRICS.count(stage, "decoded_body_bytes", len(response.content))
+            if response.status_code < 400:
+                return response
+            if response.status_code == 401 and refresh_token is not None \
+            and not refreshed and attempt < policy.max_attempts:
+                refresh_token()
+                refreshed = True
+                continue
+            if response.status_code not in RETRY_STATUSES:
+                METRICS.count(stage, "failures")
+                raise RequestFailed(f"Spotify request failed with HTTP "
+                f"{response.status_code}", response, attempt)
+
+        if attempt == policy.max_attempts:
+            break
+
+        # Wait as long as Spotify asks, or back off exponentially.
+        retry_after = None if response is None else \
+        response.headers.get("Retry-After")
+        wait = None if retry_after is None else \
+        retry_after_seconds(retry_after)
+        if wait is not None:
+            if limiter is not None:
+                limiter.pause(wait)
+                continue
+        else:
+            wait = policy.delay(attempt)
+        time.sleep(wait)
+
+    METRICS.count(stage, "failures")
+    raise RequestFailed(f"Spotify request failed after {policy.max_attempts} "
+    "attempts", response, policy.max_attempts)
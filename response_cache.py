@@ -0,0 +1,277 @@
+"""
+Store the responses of Spotify API requests on disk so that rebuilding the
+dataset only queries the songs and Track IDs that have not been seen before.
+The Track ID found for a song title and artist, and the audio features of a
+Track ID, almost never change, so both are cached in one SQLite file shared by
+spotify_id_query and get_audio_features.
+"""
+
+# Import the required libraries.
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+# The file the shared cache is stored in, relative to the working directory
+# when the cache is first used.
+DEFAULT_CACHE_PATH = "spotify_cache.sqlite"
+
+# The number of looked up keys whose last use is remembered in memory before
+# it is written to the database in one transaction.
+ACCESS_BATCH = 1000
+
+
+class ResponseCache:
+    """
+    A persistent, thread-safe key-value cache of JSON-serializable values with
+    optional expiry and a size limit.
+
+    Entries older than `ttl` seconds are treated as missing. When more than
+    `max_entries` entries are stored, the least recently used ones are removed.
+    The database file is only opened when the cache is first used.
+
+    Lookups only read the database. The expired entries are removed, and the
+    times the looked up entries were last used are written, when values are
+    stored or after every ACCESS_BATCH lookups, so a cached search costs no
+    write transaction.
+
+    Attributes:
+        path: A string containing the path of the SQLite database file.
+        ttl: A number containing the lifetime of an entry in seconds, or None
+        to keep entries forever.
+        max_entries: An integer containing the largest number of stored
+        entries, or None for no limit.
+        hits: An integer containing the number of lookups found in the cache.
+        misses: An integer containing the number of lookups not found.
+        evictions: An integer containing the number of entries removed to stay
+        within max_entries.
+        enabled: A boolean that is False to treat every key as missing and
+        store nothing, without touching the database (see replay.offline).
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=None, max_entries=None):
+        """
+        Create a cache stored in the given file.
+
+        Args:
+            path: A string containing the path of the SQLite database file.
+            ttl: A number containing the lifetime of an entry in seconds, or
+            None to keep entries forever.
+            max_entries: An integer containing the largest number of stored
+            entries, or None for no limit.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.enabled = True
+        self._connection = None
+        self._accessed = {}
+        self._entries = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(namespace, *parts):
+        """
+        Return the cache key of a request from its contents.
+
+        Args:
+            namespace: A string naming the kind of request, such as 'search'.
+            *parts: The JSON-serializable values that identify the request.
+
+        Returns:
+            A string containing a hexadecimal SHA-256 digest.
+        """
+        content = json.dumps([namespace, *parts], ensure_ascii=False)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def _connect(self):
+        """
+        Return the database connection, opening it and creating the table the
+        first time. Must be called while holding the lock.
+        """
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, \
+            check_same_thread=False)
+            self._connection.execute("CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT "
+            "NULL, accessed REAL NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS "
+            "responses_accessed ON responses (accessed)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS "
+            "responses_created ON responses (created)")
+            self._connection.commit()
+        return self._connection
+
+    def get(self, key):
+        """
+        Return the value stored under a key, or None if it is missing or has
+        expired.
+
+        Args:
+            key: A string containing the cache key.
+        """
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """
+        Return the values stored under several keys at once.
+
+        Args:
+            keys: A list of strings containing the cache keys.
+
+        Returns:
+            A dictionary mapping each key found in the cache to its value.
+        """
+        if not self.enabled:
+            return {}
+        keys = list(dict.fromkeys(keys))
+        now = time.time()
+        found = {}
+        with self._lock:
+            connection = self._connect()
+
+            # Look up the keys in groups that fit within SQLite's limit on
+            # the number of query parameters.
+            for start in range(0, len(keys), 500):
+                group = keys[start:start + 500]
+                rows = connection.execute("SELECT key, value, created FROM "
+                f"responses WHERE key IN ({','.join('?' * len(group))})", \
+                group).fetchall()
+                for key, value, created in rows:
+                    if self.ttl is None or now - created <= self.ttl:
+                        found[key] = json.loads(value)
+
+            # Remember that the keys found were used, and only write the
+            # times once enough have been collected.
+            self._accessed.update(dict.fromkeys(found, now))
+            if len(self._accessed) >= ACCESS_BATCH:
+                self._write_accessed()
+                connection.commit()
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set(self, key, value):
+        """
+        Store a value under a key, replacing any value already stored.
+
+        Args:
+            key: A string containing the cache key.
+            value: A JSON-serializable value.
+        """
+        self.set_many({key: value})
+
+    def set_many(self, items):
+        """
+        Store several values at once.
+
+        Args:
+            items: A dictionary mapping cache keys to JSON-serializable values.
+        """
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            self._write_accessed()
+
+            # Remove the expired entries, found through the index of their
+            # creation times.
+            if self.ttl is not None:
+                removed = connection.execute("DELETE FROM responses WHERE "
+                "created < ?", (now - self.ttl,)).rowcount
+                if self._entries is not None:
+                    self._entries -= removed
+
+            # Count the entries once, and then keep the count up to date
+            # from the number of keys that are new.
+            if self.max_entries is not None:
+                if self._entries is None:
+                    self._entries = connection.execute("SELECT COUNT(*) FROM "
+                    "responses").fetchone()[0]
+                self._entries += len(items) - len(self._stored(list(items)))
+            connection.executemany("INSERT OR REPLACE INTO responses (key, "
+            "value, created, accessed) VALUES (?, ?, ?, ?)", [(key, \
+            json.dumps(value), now, now) for key, value in items.items()])
+
+            # Remove the least recently used entries beyond the size limit.
+            if self.max_entries is not None:
+                excess = self._entries - self.max_entries
+                if excess > 0:
+                    connection.execute("DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY accessed LIMIT ?)", \
+                    (excess,))
+                    self.evictions += excess
+                    self._entries -= excess
+            connection.commit()
+
+    def _stored(self, keys):
+        """
+        Return the set of the keys that have an entry, expired or not. Must be
+        called while holding the lock.
+        """
+        stored = set()
+        for start in range(0, len(keys), 500):
+            group = keys[start:start + 500]
+            stored.update(key for key, in self._connect().execute("SELECT key "
+            f"FROM responses WHERE key IN ({','.join('?' * len(group))})", \
+            group))
+        return stored
+
+    def _write_accessed(self):
+        """
+        Write the times the looked up entries were last used, without
+        committing. Must be called while holding the lock.
+        """
+        if self._accessed:
+            self._connect().executemany("UPDATE responses SET accessed = ? "
+            "WHERE key = ?", [(accessed, key) for key, accessed in \
+            self._accessed.items()])
+            self._accessed = {}
+
+    def _count(self):
+        """
+        Return the number of entries stored that have not expired. Must be
+        called while holding the lock.
+        """
+        if self.ttl is None:
+            return self._connect().execute("SELECT COUNT(*) FROM responses")\
+            .fetchone()[0]
+        return self._connect().execute("SELECT COUNT(*) FROM responses WHERE "
+        "created >= ?", (time.time() - self.ttl,)).fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._count()
+
+    def stats(self):
+        """
+        Return the hit, miss, and eviction counters and the number of entries.
+
+        Returns:
+            A dictionary with the keys hits, misses, evictions, and entries.
+        """
+        entries = len(self)
+        return {"hits": self.hits, "misses": self.misses, "evictions": \
+        self.evictions, "entries": entries}
+
+    def clear(self):
+        """
+        Remove every entry and reset the counters.
+        """
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM responses")
+            connection.commit()
+            self._accessed = {}
+            self._entries = 0 if self.max_entries is not None else None
+            self.hits = self.misses = self.evictions = 0
+
+
+# The cache shared by spotify_id_query and get_audio_features by default.
+DEFAULT_CACHE = ResponseCache()
@@ -0,0 +1,332 @@
+"""
+Query slices of the song dataset without scanning every song. A SongTable
+keeps the songs sorted by date, with the dates as a numpy array and the
+artists numbered by a categorical index, both made once. A SongQuery records
+filters on the date range, artist, key, mode, and feature thresholds, and the
+columns wanted, but runs nothing until its results are asked for. The date
+range is then found by binary search in the sorted dates, and the other
+filters are evaluated as vectorized masks over the rows of that range only,
+so a query takes milliseconds however many years the dataset covers. For
+example:
+
+    table = song_query.SongTable.read_csv("track_features_by_date.csv")
+    slow_songs = table.query().years(1990, 1999).mode(0).where("tempo", \
+    maximum=90).select("Date", "Song", "Artist", "tempo")
+    slow_songs.count()
+    slow_songs.to_frame()
+"""
+
+# Import the required libraries.
+import numpy as np
+import pandas as pd
+
+
+class SongTable:
+    """
+    The song dataset sorted by date, with the indexes its queries use.
+
+    Attributes:
+        songs: A Pandas dataframe containing the songs, sorted by date and
+        keeping the chart order of each date, numbered from 0.
+        dates: A numpy datetime64[D] array containing the date of every song,
+        in order.
+    """
+
+    def __init__(self, songs):
+        self.songs = songs
+        self.dates = pd.to_datetime(songs["Date"]).to_numpy()\
+        .astype("datetime64[D]")
+        self._values = {}
+        self._codes = {}
+
+    @classmethod
+    def from_frame(cls, song_dataframe):
+        """
+        Return the table of a song dataframe.
+
+        Args:
+            song_dataframe: A Pandas dataframe containing the song dataset,
+            with a Date column of date strings, date objects, or timestamps.
+
+        Returns:
+            A SongTable.
+        """
+        order = np.argsort(pd.to_datetime(song_dataframe["Date"]).to_numpy(), \
+        kind="stable")
+        return cls(song_dataframe.iloc[order].reset_index(drop=True))
+
+    @classmethod
+    def read_csv(cls, path):
+        """
+        Return the table of a song dataset saved as a CSV file.
+
+        Args:
+            path: A string containing the path of the CSV file.
+
+        Returns:
+            A SongTable.
+        """
+        return cls.from_frame(pd.read_csv(path, index_col=0))
+
+    def __len__(self):
+        """
+        Return the number of songs.
+        """
+        return len(self.songs)
+
+    def query(self):
+        """
+        Return a query of every song in the table, to be narrowed down.
+        """
+        return SongQuery(self)
+
+    def row_range(self, start=None, end=None):
+        """
+        Return the range of rows of the songs between two dates, found by
+        binary search in the sorted dates.
+
+        Args:
+            start: The first date included, as a string or date, or None for
+            no first date.
+            end: The last date included, as a string or date, or None for no
+            last date.
+
+        Returns:
+            A tuple of the first row and the row after the last.
+        """
+        first = 0 if start is None else int(np.searchsorted(self.dates, \
+        _day(start), side="left"))
+        stop = len(self) if end is None else int(np.searchsorted(self.dates, \
+        _day(end), side="right"))
+        return first, max(first, stop)
+
+    def values(self, column):
+        """
+        Return a column as a numpy array, made when first needed. Numeric
+        columns are returned as floats, with NaN for missing values.
+
+        Raises:
+            KeyError: If the column is not in the table.
+        """
+        values = self._values.get(column)
+        if values is None:
+            series = self.songs[column]
+            values = series.to_numpy(dtype=np.float64, na_value=np.nan) if \
+            pd.api.types.is_numeric_dtype(series) else series.to_numpy()
+            self._values[column] = values
+        return values
+
+    def codes(self, column):
+        """
+        Return the categorical index of a column: the number of every song's
+        value, and the distinct values those numbers stand for. It is made
+        when first needed.
+
+        Raises:
+            KeyError: If the column is not in the table.
+        """
+        codes = self._codes.get(column)
+        if codes is None:
+            numbers, categories = pd.factorize(self.songs[column])
+            codes = numbers, pd.Index(categories)
+            self._codes[column] = codes
+        return codes
+
+
+class SongQuery:
+    """
+    A lazy query of a SongTable. Each filter returns a new query, and the
+    songs are only looked at when count, rows, to_frame, or mean is called.
+
+    Attributes:
+        table: The SongTable queried.
+        start: The first date included, or None.
+        end: The last date included, or None.
+        filters: A tuple of (kind, column, arguments) tuples, where kind is
+        'in' for songs whose value is one of the arguments, or 'range' for
+        songs whose value lies between the two arguments.
+        columns: A tuple of the column names returned by to_frame, or None
+        for every column.
+    """
+
+    def __init__(self, table, start=None, end=None, filters=(), columns=None):
+        self.table = table
+        self.start = start
+        self.end = end
+        self.filters = filters
+        self.columns = columns
+
+    def _with(self, **changes):
+        """
+        Return a copy of the query with some attributes changed.
+        """
+        attributes = {"start": self.start, "end": self.end, "filters": \
+        self.filters, "columns": self.columns}
+        attributes.update(changes)
+        return SongQuery(self.table, **attributes)
+
+    def between(self, start=None, end=None):
+        """
+        Return the query narrowed to the songs charting between two dates,
+        both included. Narrowing twice keeps the dates in both ranges.
+
+        Args:
+            start: The first date, as a string or date, or None to keep the
+            current first date.
+            end: The last date, as a string or date, or None to keep the
+            current last date.
+
+        Returns:
+            A SongQuery.
+        """
+        if start is not None and self.start is not None:
+            start = max(_day(start), _day(self.start))
+        if end is not None and self.end is not None:
+            end = min(_day(end), _day(self.end))
+        return self._with(start=self.start if start is None else start, \
+        end=self.end if end is None else end)
+
+    def years(self, start_year, end_year=None):
+        """
+        Return the query narrowed to the songs charting within whole years.
+
+        Args:
+            start_year: An integer containing the first year.
+            end_year: An integer containing the last year. Defaults to
+            start_year.
+
+        Returns:
+            A SongQuery.
+        """
+        end_year = start_year if end_year is None else end_year
+        return self.between(f"{start_year}-01-01", f"{end_year}-12-31")
+
+    def artist(self, *artists):
+        """
+        Return the query narrowed to the songs by any of the artists, written
+        exactly as in the dataset.
+        """
+        return self._with(filters=self.filters + (("in", "Artist", \
+        artists),))
+
+    def key(self, *keys):
+        """
+        Return the query narrowed to the songs in any of the keys, numbered
+        from 0 (C) to 11 (B).
+        """
+        return self._with(filters=self.filters + (("in", "key", keys),))
+
+    def mode(self, mode):
+        """
+        Return the query narrowed to the songs in a mode, 1 for major or 0 for
+        minor.
+        """
+        return self._with(filters=self.filters + (("in", "mode", \
+        (mode,)),))
+
+    def where(self, feature, minimum=None, maximum=None):
+        """
+        Return the query narrowed to the songs whose value of a feature lies
+        between two thresholds, both included. Songs missing the feature are
+        left out.
+
+        Args:
+            feature: A string containing the name of the feature, such as
+            'tempo'.
+            minimum: A number containing the lowest value kept, or None.
+            maximum: A number containing the highest value kept, or None.
+
+        Returns:
+            A SongQuery.
+        """
+        return self._with(filters=self.filters + (("range", feature, \
+        (minimum, maximum)),))
+
+    def select(self, *columns):
+        """
+        Return the query returning only some columns from to_frame.
+        """
+        return self._with(columns=columns)
+
+    def rows(self):
+        """
+        Return the rows of the table matching the query.
+
+        The date range is found by binary search, and each filter is then
+        evaluated over the rows of that range only, the artists through their
+        categorical index.
+
+        Returns:
+            A numpy integer array of the row numbers, in order.
+
+        Raises:
+            KeyError: If a filtered column is not in the table.
+        """
+        first, stop = self.table.row_range(self.start, self.end)
+        mask = np.ones(stop - first, dtype=bool)
+        for kind, column, arguments in self.filters:
+            if kind == "in" and column == "Artist":
+                codes, categories = self.table.codes(column)
+                wanted = categories.get_indexer(list(arguments))
+                mask &= np.isin(codes[first:stop], wanted[wanted >= 0])
+            elif kind == "in":
+                mask &= np.isin(self.table.values(column)[first:stop], \
+                list(arguments))
+            else:
+                minimum, maximum = arguments
+                values = self.table.values(column)[first:stop].astype(\
+                np.float64)
+                if minimum is not None:
+                    mask &= values >= minimum
+                if maximum is not None:
+                    mask &= values <= maximum
+        return first + np.flatnonzero(mask)
+
+    def count(self):
+        """
+        Return the number of songs matching the query.
+        """
+        return len(self.rows())
+
+    def to_frame(self):
+        """
+        Return the songs matching the query, with the selected columns.
+
+        Returns:
+            A Pandas dataframe with one row per song, sorted by date and
+            numbered from 0.
+
+        Raises:
+            KeyError: If a filtered or selected column is not in the table.
+        """
+        songs = self.table.songs if self.columns is None else \
+        self.table.songs[list(self.columns)]
+        return songs.iloc[self.rows()].reset_index(drop=True)
+
+    def mean(self, features):
+        """
+        Return the average of features over the songs matching the query,
+        leaving out songs missing a feature.
+
+        Args:
+            features: A list of strings containing the names of the features.
+
+        Returns:
+            A Pandas series with one average per feature, or NaN for a feature
+            no matching song has.
+        """
+        rows = self.rows()
+        averages = {}
+        for feature in features:
+            values = self.table.values(feature)[rows].astype(np.float64)
+            present = ~np.isnan(values)
+            averages[feature] = values[present].mean() if present.any() \
+            else np.nan
+        return pd.Series(averages, dtype=np.float64)
+
+
+def _day(date):
+    """
+    Return a date string, date, or timestamp as a numpy datetime64[D].
+    """
+    return np.datetime64(pd.Timestamp(date).date(), "D")
@@ -0,0 +1,158 @@
+"""
+Save and load the song dataset as a typed columnar file (Parquet or Feather)
+instead of a CSV file. Dates are stored as real dates, the artist and key
+columns as categories, and the audio features as 32 bit floats, while columns
+that only repeat the Track ID or the row number are left out. Only the
+columns needed by an analysis have to be read back.
+"""
+
+# Import the required libraries.
+import os
+import numpy as np
+import pandas as pd
+
+# The columns of an audio features response, in the order Spotify returns
+# them.
+AUDIO_FEATURE_COLUMNS = ["danceability", "energy", "key", "loudness", \
+"mode", "speechiness", "acousticness", "instrumentalness", "liveness", \
+"valence", "tempo", "type", "id", "uri", "track_href", "analysis_url", \
+"duration_ms", "time_signature"]
+
+# The columns of the CSV dataset that are not stored: row numbers left by
+# earlier saves, and columns that repeat the Track ID or the kind of object.
+REDUNDANT_COLUMNS = ["Unnamed: 0", "Unnamed: 0.1", "type", "id", "uri", \
+"track_href", "analysis_url"]
+
+# The type each column of the dataset is stored as. The integer columns use
+# the nullable types, since songs whose audio features could not be requested
+# have missing values.
+SCHEMA = {
+    "Song": "object",
+    "Artist": "category",
+    "Track ID": "object",
+    "danceability": "float32",
+    "energy": "float32",
+    "key": pd.CategoricalDtype(categories=range(12)),
+    "loudness": "float32",
+    "mode": "Int8",
+    "speechiness": "float32",
+    "acousticness": "float32",
+    "instrumentalness": "float32",
+    "liveness": "float32",
+    "valence": "float32",
+    "tempo": "float32",
+    "duration_ms": "Int32",
+    "time_signature": "Int8",
+}
+
+
+def stored_types(columns, categories_only=False):
+    """
+    Return the stored type of each of the columns given that is in SCHEMA.
+
+    Args:
+        columns: A list of column names.
+        categories_only: A boolean that is True to only return the
+        categorical types, which Parquet files do not keep for integer
+        columns such as the key.
+
+    Returns:
+        A dictionary mapping column names to types, to pass to astype.
+    """
+    return {column: SCHEMA[column] for column in columns if column in SCHEMA \
+    and (not categories_only or isinstance(SCHEMA[column], \
+    pd.CategoricalDtype))}
+
+
+def to_typed(song_dataframe):
+    """
+    Return the song dataset with the redundant columns removed and every
+    remaining column converted to its stored type.
+
+    Args:
+        song_dataframe: A Pandas dataframe containing the song dataset, as
+        loaded from track_features_by_date.csv.
+
+    Returns:
+        A Pandas dataframe with a datetime Date column and the column types
+        given in SCHEMA. Columns not in SCHEMA keep their type.
+    """
+    typed = song_dataframe.drop(columns=[column for column in \
+    REDUNDANT_COLUMNS if column in song_dataframe.columns])
+    typed = typed.astype(stored_types(typed.columns))
+    typed["Date"] = pd.to_datetime(typed["Date"])
+    return typed.reset_index(drop=True)
+
+
+def save_songs(song_dataframe, path):
+    """
+    Save the song dataset as a typed columnar file.
+
+    Args:
+        song_dataframe: A Pandas dataframe containing the song dataset.
+        path: A string containing the path of the file. A path ending in
+        '.feather' is saved in the Feather format, and any other path in the
+        Parquet format.
+    """
+    typed = to_typed(song_dataframe)
+    if _is_feather(path):
+        typed.to_feather(path)
+    else:
+        typed.to_parquet(path, index=False)
+
+
+def load_songs(path, columns=None):
+    """
+    Return the song dataset stored in a typed columnar file.
+
+    Args:
+        path: A string containing the path of a file saved by save_songs.
+        columns: A list of strings containing the names of the columns to
+        read, or None to read every column. Only these columns are read from
+        the file.
+
+    Returns:
+        A Pandas dataframe containing the song dataset with the types given in
+        SCHEMA and a datetime Date column.
+    """
+    if _is_feather(path):
+        song_dataframe = pd.read_feather(path, columns=columns)
+    else:
+        song_dataframe = pd.read_parquet(path, columns=columns)
+
+    # Parquet files do not keep the categories of integer columns such as the
+    # key, so they are restored here.
+    return song_dataframe.astype(stored_types(song_dataframe.columns, \
+    categories_only=True))
+
+
+def convert_csv(csv_path, path):
+    """
+    Save the song dataset stored in a CSV file as a typed columnar file.
+
+    Args:
+        csv_path: A string containing the path of the CSV dataset.
+        path: A string containing the path of the columnar file to create.
+    """
+    save_songs(pd.read_csv(csv_path), path)
+
+
+def _is_feather(path):
+    """
+    Return whether a path names a Feather file rather than a Parquet file.
+    """
+    return os.path.splitext(str(path))[1].lower() == ".feather"
+
+
+def typed_memory(song_dataframe):
+    """
+    Return the number of bytes of memory used by a song dataframe, including
+    the strings it holds.
+
+    Args:
+        song_dataframe: A Pandas dataframe.
+
+    Returns:
+        An integer containing the number of bytes.
+    """
+    return int(np.sum(song_dataframe.memory_usage(deep=True)))
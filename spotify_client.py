@@ -0,0 +1,190 @@
+"""
+Send every request to the Spotify API through one shared HTTP session, so
+that the thousands of search and audio feature requests reuse a small pool of
+kept-alive connections instead of opening a new TCP and TLS connection each
+time. The client also times every request so the effect of reusing
+connections can be measured over a full run. Access tokens are requested the
+first time they are needed and renewed shortly before they expire.
+"""
+
+# Import the required libraries.
+import threading
+import time
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+# The default number of kept-alive connections, which should be at least the
+# number of threads sending requests at the same time.
+POOL_SIZE = 16
+
+# The default (connect, read) timeouts of a request in seconds.
+TIMEOUT = (5.0, 30.0)
+
+
+class SpotifyClient:
+    """
+    A thread-safe HTTP client with a pool of kept-alive connections and
+    per-request latency statistics.
+
+    Attributes:
+        session: The requests.Session whose connections are reused.
+        timeout: A (connect, read) tuple of timeouts in seconds, used for
+        requests that do not give their own timeout.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, timeout=TIMEOUT):
+        """
+        Create a client with its own pool of connections.
+
+        Args:
+            pool_size: An integer containing the number of connections kept
+            alive for each host.
+            timeout: A (connect, read) tuple of timeouts in seconds.
+        """
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, \
+        pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+        self.timeout = timeout
+        self._latencies = []
+        self._lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request and record how long it took.
+
+        Args:
+            method: A string containing the HTTP method, such as 'GET'.
+            url: A string containing the URL.
+            **kwargs: Any other arguments accepted by requests.Session.request.
+
+        Returns:
+            The requests.Response.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.perf_counter()
+        try:
+            return self.session.request(method, url, **kwargs)
+        finally:
+            with self._lock:
+                self._latencies.append(time.perf_counter() - start)
+
+    def get(self, url, **kwargs):
+        """
+        Send a GET request. See request.
+        """
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """
+        Send a POST request. See request.
+        """
+        return self.request("POST", url, **kwargs)
+
+    def latency_stats(self):
+        """
+        Return statistics of the time taken by the requests sent so far.
+
+        Returns:
+            A dictionary containing the number of requests ('count') and the
+            mean, median ('p50'), 95th percentile ('p95'), and longest ('max')
+            request times in seconds. The times are 0.0 if no requests have
+            been sent.
+        """
+        with self._lock:
+            latencies = np.array(self._latencies)
+        if len(latencies) == 0:
+            return {"count": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, \
+            "max": 0.0}
+        return {"count": len(latencies), "mean": float(latencies.mean()), \
+        "p50": float(np.percentile(latencies, 50)), "p95": \
+        float(np.percentile(latencies, 95)), "max": float(latencies.max())}
+
+    def reset_stats(self):
+        """
+        Forget the times of the requests sent so far.
+        """
+        with self._lock:
+            self._latencies = []
+
+
+class TokenProvider:
+    """
+    A thread-safe source of Spotify access tokens that authenticates on first
+    use, reuses the token while it is valid, and requests a new one shortly
+    before it expires (Spotify tokens last an hour).
+
+    Attributes:
+        auth_url: A string containing the URL of the token endpoint.
+        credentials: A function without arguments returning the (client ID,
+        client secret) pair, only called when a token is needed.
+        refresh_margin: A number containing how many seconds before expiry the
+        token is renewed.
+        client: The SpotifyClient used to request tokens, or None to use
+        DEFAULT_CLIENT.
+    """
+
+    def __init__(self, auth_url, credentials, refresh_margin=60.0, \
+    client=None):
+        self.auth_url = auth_url
+        self.credentials = credentials
+        self.refresh_margin = refresh_margin
+        self.client = client
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def token(self):
+        """
+        Return a valid access token, requesting a new one if there is none yet
+        or the current one is about to expire.
+
+        Returns:
+            A string containing the access token.
+        """
+        with self._lock:
+            if self._token is None or time.monotonic() >= self._expires_at - \
+            self.refresh_margin:
+                self._request_token()
+            return self._token
+
+    def headers(self):
+        """
+        Return the request headers that authorize a Spotify API request.
+
+        Returns:
+            A dictionary containing the Authorization header.
+        """
+        return {"Authorization": f"Bearer {self.token()}"}
+
+    def invalidate(self):
+        """
+        Forget the current token, so that the next call of token requests a
+        new one. Called when Spotify rejects the token with HTTP 401.
+        """
+        with self._lock:
+            self._token = None
+
+    def _request_token(self):
+        """
+        Request a new access token with the client credentials flow. Must be
+        called while holding the lock.
+        """
+        client_id, client_secret = self.credentials()
+        response = (self.client or DEFAULT_CLIENT).post(self.auth_url, data={
+            "grant_type": "client_credentials",
+            "client_id": client_id,
+            "client_secret": client_secret,
+        })
+        response.raise_for_status()
+        token_data = response.json()
+        self._token = token_data["access_token"]
+        self._expires_at = time.monotonic() + float(token_data.get(\
+        "expires_in", 3600))
+
+
+# The client shared by spotify_id_query and get_audio_features.
+DEFAULT_CLIENT = SpotifyClient()
@@ -6,106 +6,182 @@ less than the number of songs queried.
 """
 
 # Import the required libraries.
-import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
+import numpy as np
 import pandas as pd
-import requests
 from tqdm import tqdm
 
+from instrumentation import METRICS
+from normalization import match_keys
+from rate_limiter import TokenBucket
+from resilient_request import DEFAULT_POLICY, RequestFailed, send_with_retry
+from response_cache import DEFAULT_CACHE, ResponseCache
+import spotify_client
+from track_index import MIN_CONFIDENCE, similarity
+
 
 # The Track IDs are queried using GET requests to the Spotify API, and these
 # requests require Authorization in the form of client and secret IDs that
 # are specific to the user accessing the API (and stored in external text files
 # because these must not be publicly shared.) These text files are not provided
 # in the repository and must be created independently and named as illustrated
-# in the code below.
-
+# in the code below. They are only read, and the access token only requested,
+# when the first request is sent, so importing this module needs neither the
+# files nor a network connection.
 
-#Get the client and secret IDs from files stored and remove the newline
-with open('client_id.txt') as f:
-    CLIENT_ID = str(f.read())
-CLIENT_ID = CLIENT_ID[0:-1]
-
-with open('secret_id.txt') as f:
-    CLIENT_SECRET = str(f.read())
-CLIENT_SECRET = CLIENT_SECRET[0:-1]
+# Files containing the client and secret IDs, each followed by a newline.
+CLIENT_ID_PATH = 'client_id.txt'
+SECRET_ID_PATH = 'secret_id.txt'
 
 # URL used to create an access token.
 AUTH_URL = 'https://accounts.spotify.com/api/token'
 
-# POST
-auth_response = requests.post(AUTH_URL, {
-    'grant_type': 'client_credentials',
-    'client_id': CLIENT_ID,
-    'client_secret': CLIENT_SECRET,
-})
+def read_credentials():
+    """
+    Return the client and secret IDs stored in their files.
+
+    Returns:
+        A tuple of the client ID and secret ID strings, without the newline.
+    """
+    with open(CLIENT_ID_PATH) as f:
+        client_id = f.read().rstrip("\n")
+    with open(SECRET_ID_PATH) as f:
+        client_secret = f.read().rstrip("\n")
+    return client_id, client_secret
+
+# Requests the access token on first use and renews it before it expires.
+token_provider = spotify_client.TokenProvider(AUTH_URL, read_credentials)
 
-# Convert the response to JSON.
-auth_response_data = auth_response.json()
+def auth_headers():
+    """
+    Return the GET request headers, including a valid access token.
 
-# Save the access token.
-access_token = auth_response_data['access_token']
+    Returns:
+        A dictionary containing the Authorization header.
+    """
+    return token_provider.headers()
 
-# Define the GET request headers.
-headers = {
-    'Authorization': 'Bearer {token}'.format(token=access_token)
-}
+def refresh_token():
+    """
+    Make the next request use a new access token, after Spotify has rejected
+    the current one.
+    """
+    token_provider.invalidate()
 
 # Base URL of all Spotify API endpoints.
 BASE_URL = 'https://api.spotify.com/v1/'
 
 
-def query_track(title, artist):
+# The default number of songs searched at the same time, and the default
+# number of search requests sent per second across all of those threads.
+MAX_WORKERS = 8
+REQUESTS_PER_SECOND = 20
+
+
+def search_request(title, artist, limit=1):
+    """
+    Send one keyword search for a song to the Spotify API through the shared
+    client and return the response.
+
+    Args:
+        title: A string containing the title of the song to be queried.
+        artist: A string containing the name(s) of the artist(s) performing
+        and/or featured in the song.
+        limit: An integer containing the number of tracks to return.
+
+    Returns:
+        The requests.Response returned by the Spotify API.
+    """
+    return spotify_client.DEFAULT_CLIENT.get(BASE_URL + 'search', params={"q": \
+    f"{title} {artist}", "type": "track", "limit": limit}, \
+    headers=auth_headers())
+
+
+def query_track(title, artist, limiter=None, cache=DEFAULT_CACHE, \
+policy=DEFAULT_POLICY):
     """
     Return the Spotify Track ID of a given song title and artist.
 
     Each unique song consists of its title and the artist performing it.
-    Concatenate these and query in the the Spotify API by using a GET request.
+    Concatenate these and query in the the Spotify API by using a GET request,
+    unless the song has already been searched and is stored in the cache.
     Convert the GET request's response and appropriately index to find the
-    Track ID. If GET request fails, print error and repeat until successful.
+    Track ID. If the GET request fails, it is repeated with increasing pauses
+    (see resilient_request.send_with_retry), or for as long as the
+    Retry-After header asks if the API is rate limiting requests (HTTP 429).
 
     Args:
         title: A string containing the title of the song to be queried.
         artist: A string containing the name(s) of the artist(s) performing
         and/or featured in the song.
+        limiter: A TokenBucket shared by all threads sending requests, or None
+        to send requests as quickly as possible.
+        cache: A ResponseCache storing earlier search results, or None to
+        always search.
+        policy: A RetryPolicy containing the number of attempts and the
+        pauses between them.
 
     Returns:
         track_id: A string containing the unique Spotify Track ID for the song.
+
+    Raises:
+        RequestFailed: If the search did not succeed within the number of
+        attempts allowed by the policy.
     """
+    # Return the earlier result if this song has already been searched.
+    if cache is not None:
+        cache_key = ResponseCache.key("search", title, artist)
+        cached_id = cache.get(cache_key)
+        if cached_id is not None:
+            METRICS.count("search", "cache_hits")
+            return cached_id
+
     # Send GET request to Spotify API using the song title and artist as
-    # keyword searches.
-    response = requests.get(BASE_URL + 'search', params={"q": \
-    f"{title} {artist}", "type": "track", "limit": 1}, headers=headers)
-
-    # Catch GET request failure. Print, pause, and repeat action until the
-    # request succeeds.
-    while response.status_code != 200:
-        print("Failed Spotify Request")
-        time.sleep(1)
-        response = requests.get(BASE_URL + 'search', params={"q": \
-        f"{title} {artist}", "type": "track", "limit": 1}, headers=headers)
+    # keyword searches, repeating it if it fails.
+    response = send_with_retry(lambda: search_request(title, artist), policy, \
+    limiter, stage="search", refresh_token=refresh_token)
 
     # Convert the response to a JSON file.
     response = response.json()
 
-    # Check that GET request doesn't return empty.
+    # Check that GET request doesn't return empty, and otherwise index the
+    # JSON file appropriately to find the Track ID.
     if response["tracks"]["items"] == []:
-        return "Error: Not in Spotify"
+        track_id = "Error: Not in Spotify"
+    else:
+        track_id = response["tracks"]["items"][0]["id"]
 
-    # Index the JSON file appropriately to find the Track ID
-    track_id = response["tracks"]["items"][0]["id"]
+    # Remember the result, including songs that are not in Spotify.
+    if cache is not None:
+        cache.set(cache_key, track_id)
 
     return track_id
 
-def query_all_tracks(track_dataframe):
+@METRICS.stage("search")
+def query_all_tracks(track_dataframe, max_workers=MAX_WORKERS, \
+requests_per_second=REQUESTS_PER_SECOND, cache=DEFAULT_CACHE, \
+policy=DEFAULT_POLICY, index=None, min_confidence=MIN_CONFIDENCE):
     """
     Return a dataframe containing the Date, Song, Artist and Spotify Track ID
     for every searchable song on Billboard Hot 100 over the past 60 years.
 
     Use the songs (title) and artists stored in the input dataframe to find the
     corresponding Spotify Track IDs using keyword searches involving GET
-    requests to the Spotify API (see the documentation of query_track). Store
-    the results in another dataframe containing the input dataframe plus an
-    additional column containing the Spotify Track IDs for each song.
+    requests to the Spotify API (see the documentation of query_track). The
+    searches are sent from a pool of threads, and a shared token bucket keeps
+    the total request rate within Spotify's limits. Songs that appear on
+    several charts, or are written in ways that give the same
+    normalization.match_key, are only searched once, and songs stored in the
+    cache from an earlier run are not searched again. If a TrackIndex of
+    songs whose Track IDs are already known is given, songs matching one of
+    them confidently are not searched either, and the songs that are
+    searched are added to the index. Store the results in
+    another dataframe containing the input dataframe plus an additional column
+    containing the Spotify Track IDs for each song, in the original order.
+    Songs whose search kept failing are left out rather than stopping the
+    whole run, and are listed in the 'failed_songs' entry of the returned
+    dataframe's attrs so they can be searched again later.
 
     Args:
         track_dataframe: A Pandas dataframe, imported from billboard_scraper,
@@ -115,25 +191,166 @@ def query_all_tracks(track_dataframe):
         date of featuring on Billboard Hot 100, NOT the release date, while
         'Song' refers to the song's title.
 
+        max_workers: An integer containing the number of songs searched at the
+        same time.
+
+        requests_per_second: A number containing the largest average number of
+        search requests sent per second.
+
+        cache: A ResponseCache storing earlier search results, or None to
+        search every song.
+
+        policy: A RetryPolicy containing the number of attempts and the
+        pauses between them for each search.
+
+        index: A TrackIndex of the songs whose Track IDs are already known,
+        or None to search every song.
+
+        min_confidence: A float containing the lowest confidence of a match
+        in the index used instead of searching Spotify.
+
     Returns:
         id_dataframe: A Pandas dataframe that contains the Billboard Hot 100
         songs on the June 1st of every year from 1961 to 2020 as well as their
         corresponding Spotify Track IDs. The dataframe has four columns: Date,
-        Song, Artist, and Track ID. Each row represents one song.
+        Song, Artist, and Track ID. Each row represents one song. Its
+        attrs["failed_songs"] is a list of the (Song, Artist) pairs whose
+        searches failed, and attrs["searches_saved"] is the number of
+        searches avoided because the song had already been searched or was
+        found in the index. attrs["low_confidence_songs"] is a dataframe of
+        the distinct songs found in the index without an exact match, with
+        the columns Song, Artist, Track ID, and Confidence, which can be
+        searched again with requery_tracks.
     """
-    # Declare an empty dataframe with the appropriate columns.
-    id_dataframe = pd.DataFrame(columns=["Date", "Song", "Artist", "Track ID"])
+    limiter = TokenBucket(requests_per_second)
+    titles = track_dataframe["Song"].tolist()
+    artists = track_dataframe["Artist"].tolist()
+
+    # Normalize each song and artist, and number the distinct songs by their
+    # match keys in the order they first appear. Songs missing a title or
+    # artist have a missing key, which is numbered like any other key. Each
+    # distinct song is searched for as it is first written.
+    queries = pd.DataFrame({"title": [normalize_query(title) for title in \
+    titles], "artist": [normalize_query(artist) for artist in artists], \
+    "key": match_keys(titles, artists).to_numpy()})
+    query_numbers, _ = pd.factorize(queries["key"], use_na_sentinel=False)
+    unique_queries = queries.iloc[np.unique(query_numbers, \
+    return_index=True)[1]]
 
-    # Loop through each row in the dataframe (i.e. each song).
-    for _, data in tqdm(track_dataframe.iterrows()):
+    # Look the distinct songs up in the index first, and only search the
+    # songs without a confident match.
+    unique_songs = track_dataframe[["Song", "Artist"]].iloc[\
+    unique_queries.index].reset_index(drop=True)
+    if index is not None:
+        matches = index.lookup_many(unique_songs["Song"], \
+        unique_songs["Artist"])
+    else:
+        matches = pd.DataFrame({"Track ID": [None] * len(unique_songs), \
+        "Confidence": 0.0})
+    searched = (matches["Confidence"] < min_confidence).to_numpy()
+    METRICS.count("search", "index_hits", int((~searched).sum()))
 
-        # Query the Track ID for the current song and artist.
-        current_id = query_track(data["Song"], data["Artist"])
+    # Query the Track ID for every distinct song and artist that must be
+    # searched. The executor returns the Track IDs in the same order as the
+    # searches.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        searched_ids = list(tqdm(executor.map(_query_or_none, \
+        unique_queries["title"][searched], unique_queries["artist"][searched], \
+        repeat(limiter), repeat(cache), repeat(policy)), \
+        total=int(searched.sum())))
+    unique_ids = matches["Track ID"].to_numpy(dtype=object)
+    unique_ids[searched] = searched_ids
+    if index is not None:
+        index.add(unique_songs[searched].assign(**{"Track ID": searched_ids}))
 
-        # Only append Track ID to the dataframe if the error message is not
-        # returned.
-        if current_id != "Error: Not in Spotify":
-            id_dataframe = id_dataframe.append({"Date": data["Date"], \
-            "Song": data["Song"], "Artist": data["Artist"], \
-            "Track ID" : current_id}, ignore_index=True)
+    # Give every song the Track ID found by its search or in the index.
+    track_ids = [unique_ids[number] for number in query_numbers]
+    searches_saved = len(titles) - int(searched.sum())
+    METRICS.count("search", "rows", len(titles))
+    METRICS.count("search", "searches_saved", searches_saved)
+
+    # Build the dataframe once, and only keep the songs whose Track ID was
+    # found.
+    id_dataframe = track_dataframe[["Date", "Song", "Artist"]].assign(\
+    **{"Track ID": track_ids})
+    found = id_dataframe["Track ID"].notna() & (id_dataframe["Track ID"] != \
+    "Error: Not in Spotify")
+    id_dataframe = id_dataframe[found].reset_index(drop=True)
+
+    # Record the songs whose searches failed.
+    id_dataframe.attrs["failed_songs"] = [(title, artist) for title, artist, \
+    track_id in zip(titles, artists, track_ids) if track_id is None]
+    id_dataframe.attrs["searches_saved"] = searches_saved
+    id_dataframe.attrs["low_confidence_songs"] = unique_songs.assign(**{\
+    "Track ID": unique_ids, "Confidence": matches["Confidence"]})[~searched \
+    & (matches["Confidence"] < 1).to_numpy()].reset_index(drop=True)
     return id_dataframe
+
+def requery_tracks(song_dataframe, limit=10, \
+requests_per_second=REQUESTS_PER_SECOND, policy=DEFAULT_POLICY):
+    """
+    Return the best matching Spotify Track ID of each song from a search
+    returning several tracks, such as for the songs in the
+    low_confidence_songs of query_all_tracks.
+
+    Each song is searched once with the given limit, and the track whose name
+    and artists are most like the song's title and artist is chosen (see
+    track_index.similarity). The searches bypass the cache, which only stores
+    the first result of each search.
+
+    Args:
+        song_dataframe: A Pandas dataframe with Song and Artist columns.
+        limit: An integer containing the number of tracks returned by each
+        search.
+        requests_per_second: A number containing the largest average number of
+        search requests sent per second.
+        policy: A RetryPolicy containing the number of attempts and the
+        pauses between them for each search.
+
+    Returns:
+        A Pandas dataframe with the columns Song, Artist, Track ID, and
+        Confidence, where Confidence is the similarity of the chosen track.
+        Songs without any results have no Track ID and a confidence of 0.
+
+    Raises:
+        RequestFailed: If a search did not succeed within the number of
+        attempts allowed by the policy.
+    """
+    limiter = TokenBucket(requests_per_second)
+    matches = []
+    for title, artist in zip(song_dataframe["Song"], song_dataframe["Artist"]):
+        response = send_with_retry(lambda: search_request(normalize_query(\
+        title), normalize_query(artist), limit), policy, limiter, \
+        stage="search", refresh_token=refresh_token).json()
+        candidates = [(item["id"], similarity(f"{title} {artist}", \
+        " ".join([item.get("name", "")] + [performer["name"] for performer \
+        in item.get("artists", [])]))) for item in \
+        response["tracks"]["items"]]
+        matches.append(max(candidates, key=lambda match: match[1], \
+        default=(None, 0.0)))
+    return song_dataframe[["Song", "Artist"]].reset_index(drop=True).assign(\
+    **{"Track ID": [track_id for track_id, _ in matches], "Confidence": \
+    [confidence for _, confidence in matches]})
+
+def normalize_query(text):
+    """
+    Return a song title or artist name in the form used to search for it, so
+    that the same song written slightly differently is only searched once.
+
+    Args:
+        text: A string containing a song title or artist name.
+
+    Returns:
+        A string in lowercase with surrounding whitespace removed and any run
+        of whitespace replaced by a single space.
+    """
+    return " ".join(str(text).lower().split())
+
+def _query_or_none(title, artist, limiter, cache, policy):
+    """
+    Return the Track ID found by query_track, or None if the search failed.
+    """
+    try:
+        return query_track(title, artist, limiter, cache, policy)
+    except RequestFailed:
+        return None
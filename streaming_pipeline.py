@@ -0,0 +1,305 @@
+"""
+Build the song dataset as a stream instead of one step after another. Songs
+flow from the Billboard charts into a pool of threads searching Spotify, and
+their Track IDs are gathered into batches of 100 whose audio features are
+requested as soon as each batch is full. The finished songs are appended to
+the output file batch by batch, so the audio feature requests overlap with the
+searching and the memory used is limited by the sizes of the queues between
+the steps. Songs whose requests kept failing are recorded in a file next to
+the output, and retry_failed requests them again.
+"""
+
+# Import the required libraries.
+import os
+import queue
+import threading
+import pandas as pd
+
+import billboard_scraper
+import get_audio_features
+import spotify_id_query
+from rate_limiter import TokenBucket
+from resilient_request import RequestFailed
+from response_cache import DEFAULT_CACHE
+from song_storage import AUDIO_FEATURE_COLUMNS
+
+# Marks the end of the songs passed from one step to the next.
+END_OF_SONGS = object()
+
+# The default number of songs waiting between two steps of the pipeline.
+QUEUE_SIZE = 200
+
+# The largest number of Track IDs whose audio features Spotify returns at once.
+BATCH_SIZE = 100
+
+# The columns of the songs passed between the steps, and written to the file
+# of failed songs.
+SONG_COLUMNS = ["Date", "Song", "Artist", "Track ID"]
+
+# The columns of the output file, in order, whichever audio features a batch
+# has.
+OUTPUT_COLUMNS = SONG_COLUMNS + AUDIO_FEATURE_COLUMNS
+
+
+def stream_dataset(output_path, year_start, year_end, \
+search_workers=spotify_id_query.MAX_WORKERS, \
+requests_per_second=spotify_id_query.REQUESTS_PER_SECOND, \
+queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE, checkpoint_dir=None, \
+chart_data=None, cache=DEFAULT_CACHE):
+    """
+    Return the number of songs written after streaming the Billboard Hot 100
+    songs of the specified years through the Spotify search and audio feature
+    steps into a CSV file.
+
+    The charts are read by one thread, searched by `search_workers` threads,
+    and the audio features are requested and written by the calling thread,
+    with the columns in OUTPUT_COLUMNS. Songs that are not in Spotify are
+    left out. Songs whose search or audio feature requests kept failing are
+    written to the file named by failed_path instead, and can be requested
+    again with retry_failed. Because the searches run at the same time the
+    songs are written roughly, but not exactly, in chart order. If any step
+    fails, the others are stopped and the error is raised once the songs
+    already finished have been written.
+
+    Args:
+        output_path: A string containing the path of the CSV file to create.
+        year_start: An integer containing the first year of the charts.
+        year_end: An integer containing the last year of the charts.
+        search_workers: An integer containing the number of songs searched at
+        the same time.
+        requests_per_second: A number containing the largest average number
+        of search requests sent per second.
+        queue_size: An integer containing the largest number of songs waiting
+        between two steps.
+        batch_size: An integer containing the number of Track IDs in each audio
+        feature request, at most 100.
+        checkpoint_dir: A string containing the path of a folder the
+        downloaded charts are saved in, or None to not save the charts.
+        chart_data: The class used to download a chart, called like
+        billboard.ChartData, or None to use billboard_scraper.CHART_DATA.
+        cache: A ResponseCache storing earlier Spotify responses, or None to
+        not use a cache.
+
+    Returns:
+        An integer containing the number of songs written to output_path.
+    """
+    chart_songs = queue.Queue(maxsize=queue_size)
+    failed = []
+    found_songs = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+    limiter = TokenBucket(requests_per_second)
+
+    def read_charts():
+        # Pass every song on the charts on to the searching threads.
+        for song in billboard_scraper.iter_chart_songs(\
+        billboard_scraper.chart_dates(year_start, year_end), checkpoint_dir, \
+        chart_data):
+            _put(chart_songs, song, stop)
+        for _ in range(search_workers):
+            _put(chart_songs, END_OF_SONGS, stop)
+
+    def search_songs():
+        # Search each song and pass the ones found in Spotify on.
+        while True:
+            song = _get(chart_songs, stop)
+            if song is END_OF_SONGS:
+                _put(found_songs, END_OF_SONGS, stop)
+                return
+            try:
+                track_id = spotify_id_query.query_track(song[1], song[2], \
+                limiter, cache)
+            except RequestFailed:
+                failed.append((*song, None))
+                continue
+            if track_id != "Error: Not in Spotify":
+                _put(found_songs, (*song, track_id), stop)
+
+    threads = [threading.Thread(target=_guard, args=(read_charts, stop, \
+    errors), daemon=True)] + [threading.Thread(target=_guard, \
+    args=(search_songs, stop, errors), daemon=True) for _ in \
+    range(search_workers)]
+    for thread in threads:
+        thread.start()
+
+    # Request the audio features of each full batch and append it to the file.
+    for path in [output_path, failed_path(output_path)]:
+        if os.path.exists(path):
+            os.remove(path)
+    written = 0
+    batch = []
+    finished_searches = 0
+    try:
+        while finished_searches < search_workers:
+            song = _get(found_songs, stop)
+            if song is END_OF_SONGS:
+                finished_searches += 1
+            else:
+                batch.append(song)
+            if len(batch) == batch_size or (batch and finished_searches == \
+            search_workers):
+                written += _write_batch(batch, output_path, cache, failed)
+                batch = []
+    except _Stopped:
+        pass
+    except Exception as error:
+        errors.append(error)
+        stop.set()
+
+    for thread in threads:
+        thread.join()
+    _write_failed(failed, failed_path(output_path))
+    if errors:
+        raise errors[0]
+    return written
+
+
+def failed_path(output_path):
+    """
+    Return the path of the file recording the songs of an output file whose
+    requests kept failing.
+
+    Args:
+        output_path: A string containing the path of the output CSV file.
+
+    Returns:
+        A string containing the path of the file of failed songs.
+    """
+    return os.path.splitext(str(output_path))[0] + ".failed.csv"
+
+
+def retry_failed(output_path, batch_size=BATCH_SIZE, cache=DEFAULT_CACHE):
+    """
+    Return the number of songs written after requesting the failed songs of
+    an earlier stream_dataset run again. The songs found are appended to the
+    output file, and the songs that fail again stay in the file of failed
+    songs.
+
+    Args:
+        output_path: A string containing the path of the output CSV file.
+        batch_size: An integer containing the number of Track IDs in each audio
+        feature request, at most 100.
+        cache: A ResponseCache storing earlier Spotify responses, or None to
+        not use a cache.
+
+    Returns:
+        An integer containing the number of songs written to output_path.
+    """
+    path = failed_path(output_path)
+    if not os.path.exists(path):
+        return 0
+    failed_songs = pd.read_csv(path)
+    failed = []
+    found = []
+    for date, song, artist, track_id in failed_songs[SONG_COLUMNS]\
+    .itertuples(index=False, name=None):
+        if pd.isna(track_id):
+            try:
+                track_id = spotify_id_query.query_track(song, artist, None, \
+                cache)
+            except RequestFailed:
+                failed.append((date, song, artist, None))
+                continue
+            if track_id == "Error: Not in Spotify":
+                continue
+        found.append((date, song, artist, track_id))
+
+    written = 0
+    for start in range(0, len(found), batch_size):
+        written += _write_batch(found[start:start + batch_size], output_path, \
+        cache, failed)
+    _write_failed(failed, path)
+    return written
+
+
+def _write_batch(batch, output_path, cache, failed):
+    """
+    Append a batch of songs and their audio features to the output file, with
+    the columns in OUTPUT_COLUMNS. The column names are written if the file
+    does not exist yet.
+
+    Args:
+        batch: A list of (date, song, artist, Track ID) tuples.
+        output_path: A string containing the path of the CSV file.
+        cache: A ResponseCache storing earlier audio features, or None.
+        failed: A list that the songs of the batch are added to if the audio
+        feature request failed.
+
+    Returns:
+        An integer containing the number of songs written, which is zero if
+        the audio feature request failed.
+    """
+    songs = pd.DataFrame(batch, columns=SONG_COLUMNS)
+    try:
+        audio_data = get_audio_features.id_to_audio_feature(\
+        songs["Track ID"].tolist(), cache)
+    except RequestFailed:
+        failed.extend(batch)
+        return 0
+    pd.concat([songs, audio_data], axis=1).reindex(columns=OUTPUT_COLUMNS)\
+    .to_csv(output_path, mode="a", header=not os.path.exists(output_path), \
+    index=False)
+    return len(songs)
+
+
+def _write_failed(failed, path):
+    """
+    Save the songs whose requests kept failing, or remove the file of failed
+    songs if there are none.
+
+    Args:
+        failed: A list of (date, song, artist, Track ID) tuples, with a Track
+        ID of None for songs whose search failed.
+        path: A string containing the path of the file of failed songs.
+    """
+    if failed:
+        pd.DataFrame(failed, columns=SONG_COLUMNS).to_csv(path, index=False)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class _Stopped(Exception):
+    """
+    Raised inside a step of the pipeline when another step has failed.
+    """
+
+
+def _guard(step, stop, errors):
+    """
+    Run one step of the pipeline, recording its error and stopping the other
+    steps if it fails.
+    """
+    try:
+        step()
+    except _Stopped:
+        pass
+    except Exception as error:
+        errors.append(error)
+        stop.set()
+
+
+def _put(songs, song, stop):
+    """
+    Put a song on a queue, waiting while the queue is full unless the
+    pipeline has been stopped.
+    """
+    while not stop.is_set():
+        try:
+            songs.put(song, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+    raise _Stopped()
+
+
+def _get(songs, stop):
+    """
+    Take a song from a queue, waiting while the queue is empty unless the
+    pipeline has been stopped.
+    """
+    while not stop.is_set():
+        try:
+            return songs.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    raise _Stopped()
@@ -0,0 +1,288 @@
+"""
+A local stand-in for the Spotify Web API used to test and benchmark the code
+that queries Spotify without network access or credentials. The stub server
+answers the token, search, and audio feature endpoints used by this project,
+and can be made slow, unreliable, or rate limited on purpose.
+"""
+
+# Import the required libraries.
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def stub_track_id(query):
+    """
+    Return a made up but repeatable 22 character Track ID for a search query.
+
+    Args:
+        query: A string containing the search query.
+
+    Returns:
+        A string containing the Track ID.
+    """
+    return hashlib.sha1(query.encode("utf-8")).hexdigest()[:22]
+
+
+def stub_audio_features(track_id):
+    """
+    Return made up but repeatable audio features for a Track ID, in the format
+    returned by Spotify's audio-features endpoint.
+
+    Args:
+        track_id: A string containing the Spotify Track ID.
+
+    Returns:
+        A dictionary containing the audio features of the track.
+    """
+    generator = random.Random(track_id)
+    return {
+        "danceability": generator.random(),
+        "energy": generator.random(),
+        "key": generator.randrange(12),
+        "loudness": -generator.uniform(2, 20),
+        "mode": generator.randrange(2),
+        "speechiness": generator.random(),
+        "acousticness": generator.random(),
+        "instrumentalness": generator.random(),
+        "liveness": generator.random(),
+        "valence": generator.random(),
+        "tempo": generator.uniform(60, 200),
+        "type": "audio_features",
+        "id": track_id,
+        "uri": f"spotify:track:{track_id}",
+        "track_href": f"https://api.spotify.com/v1/tracks/{track_id}",
+        "analysis_url": \
+        f"https://api.spotify.com/v1/audio-analysis/{track_id}",
+        "duration_ms": generator.randrange(90_000, 400_000),
+        "time_signature": generator.choice([3, 4, 4, 4, 5]),
+    }
+
+
+class StubSpotifyServer:
+    """
+    A Spotify Web API stand-in running on a local port in a background thread.
+
+    Use it as a context manager:
+
+        with StubSpotifyServer() as server:
+            spotify_id_query.BASE_URL = server.base_url
+
+    Attributes:
+        tracks: A dictionary mapping lowercase search queries to Track IDs, or
+        None to answer every non-empty query with a made up Track ID.
+
+        latency: A float containing the number of seconds to wait before
+        answering each request.
+
+        error_rate: A float between 0 and 1 containing the proportion of API
+        requests answered with an HTTP 500 error.
+
+        rate_limit_every: An integer n so that every nth API request is
+        answered with HTTP 429 and a Retry-After header, or 0 to never rate
+        limit.
+
+        retry_after: A string containing the Retry-After header value sent
+        with HTTP 429 responses.
+
+        unauthorized: An integer containing the number of the next API
+        requests answered with HTTP 401, as if their token had been revoked.
+
+        invalid_ids: A set of Track IDs that make an audio feature request
+        asking for any of them fail with HTTP 400.
+
+        request_counts: A dictionary mapping each endpoint path to the number
+        of requests it has received.
+
+        client_addresses: A set of the (host, port) addresses requests have
+        come from, with one address for each connection opened.
+    """
+
+    def __init__(self, tracks=None, latency=0.0, error_rate=0.0, \
+    rate_limit_every=0, retry_after="1", seed=0):
+        """
+        Create the stub server without starting it.
+
+        Args:
+            tracks: A dictionary mapping lowercase search queries to Track
+            IDs, or None to answer every non-empty query.
+            latency: A float containing the delay before each response.
+            error_rate: A float containing the proportion of HTTP 500 errors.
+            rate_limit_every: An integer n to answer every nth API request
+            with HTTP 429, or 0 to never rate limit.
+            retry_after: A string containing the Retry-After header value.
+            seed: An integer used to seed the random errors.
+        """
+        self.tracks = tracks
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.unauthorized = 0
+        self.invalid_ids = set()
+        self.request_counts = {}
+        self.client_addresses = set()
+        self._random = random.Random(seed)
+        self._api_requests = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        """
+        Return the root URL of the running server, ending in a slash.
+        """
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    @property
+    def base_url(self):
+        """
+        Return the URL used in place of 'https://api.spotify.com/v1/'.
+        """
+        return self.url + "v1/"
+
+    @property
+    def auth_url(self):
+        """
+        Return the URL used in place of Spotify's token endpoint.
+        """
+        return self.url + "api/token"
+
+    def start(self):
+        """
+        Start answering requests on a free local port.
+        """
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), \
+        _make_handler(self))
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, \
+        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the server and wait for its thread to finish.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def respond(self, method, path, query, body):
+        """
+        Return the status, headers, and JSON body answering one request.
+
+        Args:
+            method: A string containing the HTTP method.
+            path: A string containing the path of the request URL.
+            query: A dictionary mapping query parameters to lists of values.
+            body: A dictionary containing the form fields of a POST request.
+
+        Returns:
+            A tuple of the integer status code, a dictionary of headers, and a
+            JSON-serializable response body.
+        """
+        with self._lock:
+            self.request_counts[path] = self.request_counts.get(path, 0) + 1
+
+        if method == "POST" and path == "/api/token":
+            if body.get("grant_type") != "client_credentials":
+                return 400, {}, {"error": "unsupported_grant_type"}
+            return 200, {}, {"access_token": "stub-token", "token_type": \
+            "Bearer", "expires_in": 3600}
+
+        # Decide whether to fail this API request on purpose.
+        with self._lock:
+            self._api_requests += 1
+            rate_limited = self.rate_limit_every and \
+            self._api_requests % self.rate_limit_every == 0
+            failed = self._random.random() < self.error_rate
+            unauthorized = self.unauthorized > 0
+            self.unauthorized = max(0, self.unauthorized - 1)
+        if unauthorized:
+            return 401, {}, {"error": {"status": 401, "message": \
+            "The access token expired"}}
+        if rate_limited:
+            return 429, {"Retry-After": self.retry_after}, \
+            {"error": {"status": 429, "message": "API rate limit exceeded"}}
+        if failed:
+            return 500, {}, {"error": {"status": 500, "message": \
+            "Server error"}}
+
+        if path == "/v1/search":
+            search = " ".join(query.get("q", [""])[0].lower().split())
+            if self.tracks is None:
+                track_id = stub_track_id(search) if search else None
+            else:
+                track_id = self.tracks.get(search)
+            items = [] if track_id is None else [{"id": track_id, "name": \
+            search}]
+            return 200, {}, {"tracks": {"items": items}}
+
+        if path.rstrip("/") == "/v1/audio-features":
+            ids = query.get("ids", [""])[0].split(",")
+            if self.invalid_ids.intersection(ids):
+                return 400, {}, {"error": {"status": 400, "message": \
+                "Invalid base62 id"}}
+            return 200, {}, {"audio_features": [stub_audio_features(track_id) \
+            if track_id else None for track_id in ids]}
+
+        return 404, {}, {"error": {"status": 404, "message": "Not found"}}
+
+
+def _make_handler(stub):
+    """
+    Return a request handler class that passes requests on to a stub server.
+    """
+
+    class StubHandler(BaseHTTPRequestHandler):
+        """
+        Turn HTTP requests into calls to StubSpotifyServer.respond, keeping
+        connections alive between requests.
+        """
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def _answer(self, method):
+            stub.client_addresses.add(self.client_address)
+            parsed = urlparse(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            body = {key: values[0] for key, values in parse_qs(\
+            self.rfile.read(length).decode("utf-8")).items()}
+
+            if stub.latency:
+                time.sleep(stub.latency)
+            status, headers, payload = stub.respond(method, parsed.path, \
+            parse_qs(parsed.query), body)
+
+            content = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_GET(self):
+            self._answer("GET")
+
+        def do_POST(self):
+            self._answer("POST")
+
+        def log_message(self, *args):
+            pass
+
+    return StubHandler
@@ -0,0 +1,322 @@
+"""
+Summarize the song dataset by year once so that repeated analyses do not have
+to rescan every song. The index holds the number of songs and the sum, sum of
+squares, minimum, and maximum of every audio feature for each year, together
+with the number of songs in each key and mode. The averaging and key
+functions in music_feature accept the index in place of the song dataframe,
+and answer from it in constant time per year. The index is saved next to the
+dataset and updated with only the songs of newly added charts.
+"""
+
+# Import the required libraries.
+import os
+import numpy as np
+import pandas as pd
+
+import aggregation
+import song_storage
+
+# The numeric audio features summarized by default.
+FEATURE_COLUMNS = ["danceability", "energy", "loudness", "speechiness", \
+"acousticness", "instrumentalness", "liveness", "valence", "tempo", \
+"duration_ms", "time_signature"]
+
+
+class SummaryIndex:
+    """
+    Yearly statistics of the songs on the June 1st Billboard Hot 100 charts.
+
+    Attributes:
+        first_year: An integer containing the year of the first row of the
+        arrays, or None if the index is empty.
+        features: A list of strings containing the names of the summarized
+        features, in the order of the columns of the arrays.
+        count: A numpy integer array with one row per year and one column per
+        feature containing the number of songs with a value.
+        sum: A numpy float array of the same shape containing the sum of the
+        values.
+        sumsq: A numpy float array containing the sum of the squared values.
+        min: A numpy float array containing the smallest value, or NaN.
+        max: A numpy float array containing the largest value, or NaN.
+        key_mode: A numpy integer array with one row per year, one column per
+        key, and a third axis for the minor (0) and major (1) modes containing
+        the number of songs.
+    """
+
+    def __init__(self, features, first_year=None, year_count=0):
+        """
+        Create an index covering year_count years without any songs.
+
+        Args:
+            features: A list of strings containing the names of the features
+            to summarize.
+            first_year: An integer containing the first year covered.
+            year_count: An integer containing the number of years covered.
+        """
+        self.features = list(features)
+        self.first_year = first_year
+        shape = (year_count, len(self.features))
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.sum = np.zeros(shape)
+        self.sumsq = np.zeros(shape)
+        self.min = np.full(shape, np.nan)
+        self.max = np.full(shape, np.nan)
+        self.key_mode = np.zeros((year_count, 12, 2), dtype=np.int64)
+
+    @classmethod
+    def from_songs(cls, song_dataframe, features=None):
+        """
+        Return the index of a song dataframe.
+
+        Args:
+            song_dataframe: A Pandas dataframe containing the song dataset.
+            features: A list of strings containing the names of the features
+            to summarize. Defaults to the columns of FEATURE_COLUMNS in the
+            dataframe.
+
+        Returns:
+            A SummaryIndex.
+        """
+        if features is None:
+            features = [feature for feature in FEATURE_COLUMNS if feature in \
+            song_dataframe.columns]
+        index = cls(features)
+        index.update(song_dataframe)
+        return index
+
+    @property
+    def years(self):
+        """
+        A list of integers containing the years covered by the index.
+        """
+        if self.first_year is None:
+            return []
+        return list(range(self.first_year, self.first_year + len(self.count)))
+
+    def update(self, new_songs):
+        """
+        Add the songs of newly added charts to the index.
+
+        The songs must not already be in the index, otherwise they are
+        counted twice.
+
+        Args:
+            new_songs: A Pandas dataframe containing the new songs, with the
+            same columns as the song dataset.
+        """
+        years = _june_years(new_songs["Date"])
+        if not years:
+            return
+        self._cover(min(years), max(years))
+        end_year = self.first_year + len(self.count) - 1
+        offsets = aggregation.year_offsets(new_songs["Date"], \
+        self.first_year, end_year)
+        selected = offsets >= 0
+
+        # Add the counts, sums, and sums of squares of every year at once.
+        values = new_songs[self.features].to_numpy(dtype=np.float64, \
+        na_value=np.nan)
+        counts, sums = aggregation.feature_sums(offsets, values, \
+        len(self.count))
+        _, sumsqs = aggregation.feature_sums(offsets, values ** 2, \
+        len(self.count))
+        self.count += counts
+        self.sum += sums
+        self.sumsq += sumsqs
+
+        # Combine the smallest and largest values of each year.
+        for extreme, reduce in [(self.min, np.fmin), (self.max, np.fmax)]:
+            new_extreme = np.full(extreme.shape, np.nan)
+            reduce.at(new_extreme, offsets[selected], values[selected])
+            extreme[:] = reduce(extreme, new_extreme)
+
+        self.key_mode += aggregation.key_counts(offsets, \
+        new_songs["key"].to_numpy(dtype=np.float64, na_value=np.nan), \
+        len(self.count), new_songs["mode"].to_numpy(dtype=np.float64, \
+        na_value=np.nan))
+
+    def feature_sums(self, start_date, end_date, features, processes=None):
+        """
+        Return the yearly song counts and feature sums of a time period, in
+        the format returned by aggregation.frame_feature_sums.
+
+        Args:
+            start_date: An integer containing the first year of the period.
+            end_date: An integer containing the last year of the period.
+            features: A list of strings containing the names of the features.
+            processes: Ignored, since the index is read without counting the
+            songs again.
+
+        Returns:
+            A tuple of the counts and sums arrays, with one row per year and
+            one column per feature. Years outside the index have no songs.
+        """
+        columns = [self._column(feature) for feature in features]
+        return self._years(self.count, start_date, end_date)[:, columns], \
+        self._years(self.sum, start_date, end_date)[:, columns]
+
+    def feature_sumsqs(self, start_date, end_date, features):
+        """
+        Return the yearly sums of the squared feature values of a time period.
+
+        Args:
+            start_date: An integer containing the first year of the period.
+            end_date: An integer containing the last year of the period.
+            features: A list of strings containing the names of the features.
+
+        Returns:
+            A numpy array with one row per year and one column per feature.
+        """
+        columns = [self._column(feature) for feature in features]
+        return self._years(self.sumsq, start_date, end_date)[:, columns]
+
+    def key_counts(self, start_date, end_date, by_mode=False, \
+    processes=None):
+        """
+        Return the number of songs in each key for every year of a time
+        period, in the format returned by aggregation.key_counts.
+
+        Args:
+            start_date: An integer containing the first year of the period.
+            end_date: An integer containing the last year of the period.
+            by_mode: A boolean that is True to keep the modes apart.
+            processes: Ignored, since the index is read without counting the
+            songs again.
+
+        Returns:
+            A numpy integer array with one row per year and one column per
+            key, with a third axis for the modes if by_mode is True.
+        """
+        key_mode = self._years(self.key_mode, start_date, end_date)
+        return key_mode if by_mode else key_mode.sum(axis=2)
+
+    def save(self, path):
+        """
+        Save the index as a compressed numpy file.
+
+        Args:
+            path: A string containing the path of the file.
+        """
+        with open(path, "wb") as f:
+            np.savez_compressed(f, features=np.array(self.features), \
+            first_year=np.array(-1 if self.first_year is None else \
+            self.first_year), count=self.count, sum=self.sum, \
+            sumsq=self.sumsq, min=self.min, max=self.max, \
+            key_mode=self.key_mode)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Return the index saved in a file by save.
+
+        Args:
+            path: A string containing the path of the file.
+
+        Returns:
+            A SummaryIndex.
+        """
+        with np.load(path) as arrays:
+            index = cls(arrays["features"].tolist())
+            first_year = int(arrays["first_year"])
+            index.first_year = None if first_year < 0 else first_year
+            for name in ["count", "sum", "sumsq", "min", "max", "key_mode"]:
+                setattr(index, name, arrays[name])
+        return index
+
+    def _column(self, feature):
+        """
+        Return the column of the arrays holding a feature.
+        """
+        try:
+            return self.features.index(feature)
+        except ValueError:
+            raise KeyError(f"{feature!r} is not in the summary index") \
+            from None
+
+    def _cover(self, start_year, end_year):
+        """
+        Extend the arrays so that they cover the years start_year to end_year.
+        """
+        if self.first_year is None:
+            first_year, last_year = start_year, end_year
+        else:
+            first_year = min(self.first_year, start_year)
+            last_year = max(self.first_year + len(self.count) - 1, end_year)
+        for name in ["count", "sum", "sumsq", "min", "max", "key_mode"]:
+            setattr(self, name, self._years(getattr(self, name), first_year, \
+            last_year, np.nan if name in ["min", "max"] else 0))
+        self.first_year = first_year
+
+    def _years(self, array, start_date, end_date, fill=0):
+        """
+        Return the rows of an array for the years start_date to end_date,
+        filling the years outside the index with the fill value.
+        """
+        years = np.full((end_date - start_date + 1,) + array.shape[1:], fill, \
+        dtype=array.dtype)
+        if self.first_year is None:
+            return years
+        start = max(start_date, self.first_year)
+        end = min(end_date, self.first_year + len(array) - 1)
+        if start <= end:
+            years[start - start_date:end - start_date + 1] = array[\
+            start - self.first_year:end - self.first_year + 1]
+        return years
+
+
+def _june_years(dates):
+    """
+    Return the years of the June 1st chart dates among a series of dates.
+    """
+    unique_dates = pd.DatetimeIndex(pd.to_datetime(pd.Series(dates).dropna()\
+    .unique()))
+    june_dates = unique_dates[(unique_dates.month == 6) & \
+    (unique_dates.day == 1)]
+    return june_dates.year.tolist()
+
+
+def index_path(data_path):
+    """
+    Return the path of the summary index saved next to a dataset file.
+
+    Args:
+        data_path: A string containing the path of the dataset file.
+
+    Returns:
+        A string containing the path of the index file.
+    """
+    return os.path.splitext(data_path)[0] + ".summary.npz"
+
+
+def load_or_build(data_path, features=None):
+    """
+    Return the summary index of a dataset file, loading the saved index if it
+    is newer than the dataset and summarizes every requested feature, and
+    otherwise building and saving it.
+
+    Args:
+        data_path: A string containing the path of a CSV, Parquet, or Feather
+        song dataset.
+        features: A list of strings containing the names of the features the
+        index must summarize. Defaults to FEATURE_COLUMNS. A rebuilt index
+        keeps the features of the saved index as well.
+
+    Returns:
+        A SummaryIndex.
+    """
+    path = index_path(data_path)
+    if os.path.exists(path) and os.path.getmtime(path) >= \
+    os.path.getmtime(data_path):
+        index = SummaryIndex.load(path)
+        if features is None or set(features) <= set(index.features):
+            return index
+        features = index.features + [feature for feature in features if \
+        feature not in index.features]
+
+    if data_path.endswith(".csv"):
+        song_dataframe = pd.read_csv(data_path)
+    else:
+        song_dataframe = song_storage.load_songs(data_path)
+    index = SummaryIndex.from_songs(song_dataframe, features)
+    index.save(path)
+    return index
@@ -2,10 +2,47 @@
 Used to test all the functions across different files in our code that are
 possible to test.
 """
+import concurrent.futures
 import datetime
+import email.utils
+import importlib
+import os
+import subprocess
+import sys
+import time
 import pytest
+import numpy as np
 import pandas as pd
-from billboard_scraper import clean_artist
+import requests
+import billboard
+import billboard_scraper
+from billboard_scraper import clean_artist, hot_100_data
+from chart_store import ChartStore, weekly_chart_store
+from appearance_store import AppearanceStore
+import feature_matrix
+import normalization
+import parallel_analytics
+from instrumentation import METRICS
+from normalization import clean_artists, match_key, match_keys
+from rate_limiter import TokenBucket
+import replay
+import response_cache
+from resilient_request import RequestFailed, RetryPolicy, \
+retry_after_seconds, send_with_retry
+from response_cache import ResponseCache
+from spotify_client import SpotifyClient, TokenProvider
+from song_query import SongTable
+import song_storage
+import summary_index
+from summary_index import SummaryIndex
+from track_index import TrackIndex
+from trend_statistics import plot_frame, trend_statistics
+from track_store import TrackStore
+from stub_spotify import StubSpotifyServer
+
+# The song dataset provided with the repository.
+DATASET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+"track_features_by_date.csv")
 
 from music_feature import (
     average_by_date,
@@ -122,6 +159,23 @@ datetime.date(2020, 6, 1)], "Feature": ["Loudness", "Loudness", "Duration", \
 "Duration"], "Average": [0.2, 0.9, 6.0, 35.0]}
 multi_average_dataframe_7 = pd.DataFrame(multi_average_dict_7)
 
+# Dates stored as date objects are averaged like date strings, while songs
+# from charts other than the June 1st snapshots are left out.
+test_dict_12 = {"Date": [datetime.date(2020, 6, 1), datetime.date(2020, 6, 1), \
+datetime.date(2020, 7, 1)], "Loudness": [0.25, 0.75, 0.9], "Duration": [4.0, \
+6.0, 100.0]}
+test_dataframe_12 = pd.DataFrame(test_dict_12)
+multi_average_dict_12 = {"Date": [datetime.date(2020, 6, 1), \
+datetime.date(2020, 6, 1)], "Feature": ["Loudness", "Duration"], \
+"Average": [0.5, 5.0]}
+multi_average_dataframe_12 = pd.DataFrame(multi_average_dict_12)
+
+# Years without any songs are given an average of NaN.
+multi_average_dict_13 = {"Date": [datetime.date(2019, 6, 1), \
+datetime.date(2020, 6, 1)], "Feature": ["Loudness", "Loudness"], \
+"Average": [float("nan"), 0.1]}
+multi_average_dataframe_13 = pd.DataFrame(multi_average_dict_13)
+
 average_all_cases = [
     # Test that a single year, single feature, single item dataframe yields the
     # correct average
@@ -133,7 +187,12 @@ average_all_cases = [
     # Test that multiple year, multiple feature, multiple item dataframe yields
     (2019, 2020, ["Loudness", "Duration"], test_dataframe_7, \
     multi_average_dataframe_7),
-    # Since this function calls average_by_date, there isn't very much need to
+    # Test that date objects are averaged and other chart dates are skipped
+    (2020, 2020, ["Loudness", "Duration"], test_dataframe_12, \
+    multi_average_dataframe_12),
+    # Test that a year without any songs has an average of NaN
+    (2019, 2020, ["Loudness"], test_dataframe_1, multi_average_dataframe_13),
+    # Since average_by_date calls this function, there isn't very much need to
     # test the specifics of individual behaviors.
 ]
 
@@ -199,6 +258,36 @@ def test_clean_artist(artist, cleaned_artist):
     """
     assert clean_artist(artist) == cleaned_artist
 
+
+def test_normalization_of_columns():
+    """
+    Check that cleaning a whole column gives the same names as clean_artist,
+    that clutter words inside names are kept, that the same song written
+    differently gives the same match key, and that different songs whose
+    words would all be removed do not.
+    """
+    artists = [artist for artist, _ in clean_artist_cases] + ["Rolland", \
+    "Featherstone & Brandy", "Rolland"]
+    assert clean_artists(artists).tolist() == [clean_artist(artist) for \
+    artist in artists]
+    assert clean_artists(artists).tolist()[-3:] == ["rolland", \
+    "featherstone   brandy", "rolland"]
+    assert clean_artists(pd.Series(["A", None], index=[5, 7])).index.tolist() \
+    == [5, 7]
+
+    assert match_key("Crazy In Love", "Beyoncé Featuring JAY-Z") == \
+    match_key("crazy in love ", "beyonce & Jay Z")
+    assert match_key("Halo", "Beyonce") != match_key("Halo", "Rihanna")
+    assert match_keys(["Halo", "HALO!"], ["beyonce", "Beyonce"]).tolist() == \
+    [match_key("Halo", "Beyonce")] * 2
+    assert match_key("X", "tove lo") != match_key("Y", "tove lo")
+    assert match_key("With You", "Chris Brown") != match_key("You", \
+    "Chris Brown")
+    assert match_key("夜に駆ける", "YOASOBI") != match_key("群青", "YOASOBI")
+    assert match_key("Песня", "Кино") != match_key("Звезда", "Группа")
+    assert not match_keys(["The", "?"], ["the", "!"]).str.startswith("|")\
+    .any()
+
 # Test average_by_date
 @pytest.mark.parametrize("start_date,end_date,feature,\
 song_dataframe,date_average", average_by_date_cases)
@@ -302,3 +391,1040 @@ def test_key_proportion(start_date, end_date, song_dataframe, key_dataframe):
     """
     assert key_proportion(start_date, end_date, song_dataframe).\
     equals(key_dataframe)
+
+
+def test_parallel_analytics_matches_single_process(monkeypatch):
+    """
+    Check that counting the songs in several processes gives exactly the
+    same averages and key proportions as counting them in one, that small
+    datasets are counted in one process and no more processes than CPU cores
+    are used, and that fewer than one process is refused.
+    """
+    monkeypatch.setattr(parallel_analytics, "default_processes", lambda: 4)
+    assert parallel_analytics.worker_count(1000, 8) == 1
+    assert parallel_analytics.worker_count(10 ** 7, 8) == 4
+    assert parallel_analytics.worker_count(10 ** 7, 2) == 2
+
+    # Count the small dataset in several processes all the same.
+    monkeypatch.setattr(parallel_analytics, "PARALLEL_MIN_ROWS", 0)
+    song_data = pd.read_csv(DATASET_PATH)
+    features = ["acousticness", "danceability", "duration_ms"]
+    assert average_all(1961, 2020, features, song_data, processes=3).equals(\
+    average_all(1961, 2020, features, song_data))
+    assert key_proportion(1961, 2020, song_data, by_mode=True, \
+    processes=2).equals(key_proportion(1961, 2020, song_data, by_mode=True))
+    assert average_all(1961, 2020, features, song_data, processes=1).equals(\
+    average_all(1961, 2020, features, song_data))
+    for processes in [0, -2]:
+        with pytest.raises(ValueError):
+            average_all(1961, 2020, features, song_data, processes)
+        with pytest.raises(ValueError):
+            key_proportion(1961, 2020, TrackStore.from_frame(song_data), \
+            processes=processes)
+
+
+def test_key_proportion_by_mode():
+    """
+    Check that major and minor songs in the same key are counted separately
+    while their proportions are relative to every song that year.
+    """
+    song_dataframe = pd.DataFrame({"Date": [str(datetime.date(2020, 6, 1))] \
+    * 4, "key": [0, 0, 2, 0], "mode": [1, 0, 1, 1]})
+    key_dataframe = key_proportion(2020, 2020, song_dataframe, by_mode=True)
+    assert key_dataframe["Key"].tolist() == ["C", "C", "D"]
+    assert key_dataframe["Mode"].tolist() == ["Minor", "Major", "Major"]
+    assert key_dataframe["Count"].tolist() == [1, 2, 1]
+    assert key_dataframe["Proportion"].tolist() == [0.25, 0.5, 0.25]
+
+
+def test_trend_statistics():
+    """
+    Check the standard deviation, rolling mean, median, and rank-weighted mean
+    of a small dataframe against values worked out by hand.
+    """
+    song_dataframe = pd.DataFrame({"Date": ["2019-06-01"] * 3 + \
+    ["2020-06-01"] * 2, "Loudness": [1.0, 2.0, 6.0, 4.0, 8.0]})
+    statistics = trend_statistics(2019, 2020, ["Loudness"], song_dataframe, \
+    ["std", "rolling mean", "quantiles", "rank-weighted mean"], window=2, \
+    quantiles=(0.5,))
+
+    values = statistics.set_index(["Statistic", "Date"])["Value"]
+    june_2019, june_2020 = datetime.date(2019, 6, 1), datetime.date(2020, 6, 1)
+    assert values["std", june_2019] == pytest.approx(7 ** 0.5)
+    assert values["rolling mean", june_2019] == 3.0
+    assert values["rolling mean", june_2020] == 4.2
+    assert values["quantile 0.5", june_2019] == 2.0
+    assert values["quantile 0.5", june_2020] == 6.0
+    assert values["rank-weighted mean", june_2020] == pytest.approx((4.0 * \
+    100 + 8.0 * 99) / 199)
+    assert plot_frame(statistics, "std").columns.tolist() == ["Date", \
+    "Feature", "Average"]
+
+
+def test_trend_statistics_of_stores(tmp_path):
+    """
+    Check that a track store and a feature matrix of the dataset give the
+    statistics of the song dataframe, that a chart store is accepted, and
+    that other sources are refused with a TypeError.
+    """
+    song_data = song_storage.to_typed(pd.read_csv(DATASET_PATH, \
+    index_col=0))
+    features = ["tempo", "duration_ms"]
+    expected = trend_statistics(1961, 2020, features, song_data)
+    from_store = trend_statistics(1961, 2020, features, \
+    TrackStore.from_frame(song_data))
+    pd.testing.assert_frame_equal(from_store, expected)
+    song_data.loc[song_data.index[::6], "mode"] = pd.NA
+    features.append("mode")
+    expected = trend_statistics(1961, 2020, features, song_data)
+    feature_matrix.export_features(song_data, tmp_path)
+    from_matrix = trend_statistics(1961, 2020, features, \
+    feature_matrix.FeatureMatrix.open(tmp_path))
+    assert np.allclose(from_matrix["Value"], expected["Value"], rtol=1e-5, \
+    equal_nan=True)
+
+    store = ChartStore.from_frame(pd.DataFrame({"Date": ["2000-06-03"] * 2, \
+    "Song": ["a", "b"], "Artist": ["x", "y"], "Loudness": [1.0, 4.0]}))
+    statistics = trend_statistics(2000, 2000, ["Loudness"], store, \
+    ["mean", "rank-weighted mean"])
+    assert statistics["Value"].tolist() == [2.5, pytest.approx((100 + 4.0 * \
+    99) / 199)]
+    with pytest.raises(TypeError):
+        trend_statistics(2000, 2000, ["Loudness"], [1.0, 4.0])
+
+
+@pytest.fixture
+def stub_spotify():
+    """
+    Run a local Spotify API stand-in for the duration of a test.
+    """
+    with StubSpotifyServer() as server:
+        yield server
+
+
+@pytest.fixture
+def spotify_id_query(stub_spotify, monkeypatch):
+    """
+    Import spotify_id_query with its requests sent to the stub Spotify server.
+    """
+    module = importlib.import_module("spotify_id_query")
+    monkeypatch.setattr(module, "BASE_URL", stub_spotify.base_url)
+    monkeypatch.setattr(module, "token_provider", TokenProvider(\
+    stub_spotify.auth_url, lambda: ("stub-client", "stub-secret")))
+    return module
+
+
+@pytest.fixture
+def get_audio_features(spotify_id_query, stub_spotify, monkeypatch):
+    """
+    Import get_audio_features with its requests sent to the stub Spotify
+    server.
+    """
+    module = importlib.import_module("get_audio_features")
+    monkeypatch.setattr(module, "BASE_URL", stub_spotify.base_url)
+    return module
+
+
+def test_token_bucket_rate():
+    """
+    Check that the token bucket spaces out requests beyond its burst capacity.
+
+    A bucket allowing 100 requests per second with a capacity of one must take
+    at least 90 milliseconds to hand out ten tokens.
+    """
+    limiter = TokenBucket(100, capacity=1)
+    start = time.monotonic()
+    for _ in range(10):
+        limiter.acquire()
+    assert time.monotonic() - start >= 0.085
+
+
+def test_token_bucket_pause():
+    """
+    Check that pausing the token bucket (after an HTTP 429 response) holds
+    back the next request for the Retry-After time.
+    """
+    limiter = TokenBucket(1000)
+    limiter.pause(0.1)
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+def test_query_all_tracks_order(spotify_id_query, stub_spotify):
+    """
+    Check that concurrent searches keep the songs in their original order,
+    drop songs that are not in Spotify, and retry rate limited requests.
+    """
+    stub_spotify.tracks = {f"song {number} artist": f"id{number}" for number \
+    in range(40) if number % 5}
+    stub_spotify.rate_limit_every = 7
+    stub_spotify.retry_after = "0.01"
+    track_dataframe = pd.DataFrame({"Date": ["2020-06-01"] * 40, \
+    "Song": [f"song {number}" for number in range(40)], \
+    "Artist": ["artist"] * 40})
+
+    id_dataframe = spotify_id_query.query_all_tracks(track_dataframe, \
+    max_workers=8, requests_per_second=1000, cache=None)
+
+    expected = [f"id{number}" for number in range(40) if number % 5]
+    assert id_dataframe["Track ID"].tolist() == expected
+    assert list(id_dataframe.columns) == ["Date", "Song", "Artist", \
+    "Track ID"]
+
+
+def test_query_all_tracks_missing_title(spotify_id_query, stub_spotify):
+    """
+    Check that a song without a title in the middle of the charts does not
+    shift the Track IDs of the songs after it.
+    """
+    track_dataframe = pd.DataFrame({"Date": ["2020-06-01"] * 4, "Song": \
+    ["Halo", None, "Montero", "Halo"], "Artist": ["beyonce", "nobody", \
+    "lil nas x", "beyonce"]})
+    expected = {song: spotify_id_query.query_all_tracks(pd.DataFrame(\
+    {"Date": ["2020-06-01"], "Song": [song], "Artist": [artist]}), \
+    cache=None)["Track ID"][0] for song, artist in [("Halo", "beyonce"), \
+    ("Montero", "lil nas x")]}
+
+    id_dataframe = spotify_id_query.query_all_tracks(track_dataframe, \
+    cache=None)
+
+    songs = id_dataframe.set_index("Artist")["Track ID"]
+    assert songs["lil nas x"] == expected["Montero"]
+    assert songs["beyonce"].tolist() == [expected["Halo"]] * 2
+    assert id_dataframe.attrs["searches_saved"] == 1
+
+
+def test_query_all_tracks_searches_each_song_once(spotify_id_query, \
+stub_spotify):
+    """
+    Check that a song charting several times, even written differently, is
+    only searched once and its Track ID is given to every chart entry.
+    """
+    track_dataframe = pd.DataFrame({"Date": ["2019-06-01", "2020-06-01", \
+    "2020-06-01", "2021-06-01"], "Song": ["Halo", "halo ", "Montero", \
+    "HALO"], "Artist": ["beyonce", "Beyonce", "lil nas x", "beyonce"]})
+
+    id_dataframe = spotify_id_query.query_all_tracks(track_dataframe, \
+    cache=None)
+
+    assert stub_spotify.request_counts["/v1/search"] == 2
+    assert id_dataframe.attrs["searches_saved"] == 2
+    assert id_dataframe["Song"].tolist() == ["Halo", "halo ", "Montero", \
+    "HALO"]
+    assert id_dataframe["Track ID"].nunique() == 2
+    assert id_dataframe["Track ID"].tolist()[0] == \
+    id_dataframe["Track ID"].tolist()[3]
+
+
+def test_query_all_tracks_uses_track_index(spotify_id_query, stub_spotify):
+    """
+    Check that songs matching a known song confidently are not searched, that
+    inexact matches are reported with their confidence, that searched songs
+    are added to the index, and that low confidence songs can be searched
+    again with more results.
+    """
+    index = TrackIndex.from_frame(pd.DataFrame({"Song": ["Halo", \
+    "Crazy In Love"], "Artist": ["beyonce", "beyonce   jay-z"], "Track ID": \
+    ["halo-id", "crazy-id"]}))
+    assert index.lookup("HALO!", "Beyoncé") == ("halo-id", 1.0)
+    assert index.lookup("Crazy In Love (Remix)", "beyonce jay z")[0] == \
+    "crazy-id"
+    assert index.lookup("Halo", "Rihanna")[1] < 0.8
+
+    # Different songs by the same artist are not confident matches, however
+    # long the artist's name is.
+    artist = "Earth, Wind & Fire featuring The Emotions"
+    same_artist = TrackIndex.from_frame(pd.DataFrame({"Song": ["Prime Time", \
+    "Love Me Do", "Reunited", "Let Me"], "Artist": [artist] * 4, \
+    "Track ID": ["prime-id", "love-id", "reunited-id", "let-id"]}))
+    for title in ["Time", "Love Me", "United", "Kicks"]:
+        assert same_artist.lookup(title, artist)[1] < 0.8
+
+    track_dataframe = pd.DataFrame({"Date": ["2020-06-01"] * 3, "Song": \
+    ["Halo", "Crazy In Lov", "Montero"], "Artist": ["Beyonce", \
+    "beyonce jay z", "lil nas x"]})
+    id_dataframe = spotify_id_query.query_all_tracks(track_dataframe, \
+    cache=None, index=index)
+
+    assert stub_spotify.request_counts["/v1/search"] == 1
+    assert id_dataframe["Track ID"].tolist()[:2] == ["halo-id", "crazy-id"]
+    low_confidence = id_dataframe.attrs["low_confidence_songs"]
+    assert low_confidence["Song"].tolist() == ["Crazy In Lov"]
+    assert 0.8 <= low_confidence["Confidence"][0] < 1
+    assert len(index) == 3
+
+    requeried = spotify_id_query.requery_tracks(low_confidence)
+    assert stub_spotify.request_counts["/v1/search"] == 2
+    assert requeried["Track ID"].notna().all()
+    assert requeried["Confidence"][0] > 0.8
+
+
+def test_response_cache_expiry_and_eviction(tmp_path):
+    """
+    Check that cached values expire after their lifetime, that the least
+    recently used value is evicted beyond the size limit, and that the hits
+    and misses are counted.
+    """
+    cache = ResponseCache(tmp_path / "cache.sqlite", ttl=0.2, max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", {"value": 2})
+    assert cache.get("a") == 1
+    cache.set("c", [3])
+    assert cache.get("b") is None
+    assert cache.get_many(["a", "c"]) == {"a": 1, "c": [3]}
+    time.sleep(0.3)
+    assert cache.get("a") is None
+    assert cache.stats() == {"hits": 3, "misses": 2, "evictions": 1, \
+    "entries": 0}
+
+
+def test_response_cache_lookups_do_not_write(tmp_path):
+    """
+    Check that looking up cached values writes nothing to the database until
+    values are stored, and that the times they were used then decide which
+    value is evicted.
+    """
+    cache = ResponseCache(tmp_path / "cache.sqlite", max_entries=2)
+    cache.set_many({"a": 1, "b": 2})
+    connection = cache._connect()
+    changes = connection.total_changes
+    assert cache.get_many(["a", "b", "c"]) == {"a": 1, "b": 2}
+    assert cache.get("a") == 1
+    assert connection.total_changes == changes
+    assert not connection.in_transaction
+    cache.set("c", 3)
+    assert cache.get_many(["a", "b", "c"]) == {"a": 1, "c": 3}
+    assert cache.stats()["entries"] == 2
+
+
+def test_query_all_tracks_cached(spotify_id_query, stub_spotify, tmp_path):
+    """
+    Check that a second run reading a persisted cache only searches the songs
+    that have not been searched before.
+    """
+    track_dataframe = pd.DataFrame({"Date": ["2020-06-01"] * 3, \
+    "Song": ["halo", "montero", "levitating"], "Artist": ["beyonce", \
+    "lil nas x", "dua lipa"]})
+    spotify_id_query.query_all_tracks(track_dataframe.iloc[:2], \
+    cache=ResponseCache(tmp_path / "cache.sqlite"))
+
+    cache = ResponseCache(tmp_path / "cache.sqlite")
+    id_dataframe = spotify_id_query.query_all_tracks(track_dataframe, \
+    cache=cache)
+    assert len(id_dataframe) == 3
+    assert stub_spotify.request_counts["/v1/search"] == 3
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_id_to_audio_feature_cached(get_audio_features, stub_spotify, \
+tmp_path):
+    """
+    Check that cached audio features are combined with newly requested ones in
+    the order of the input Track IDs.
+    """
+    cache = ResponseCache(tmp_path / "cache.sqlite")
+    get_audio_features.id_to_audio_feature(["id1", "id2"], cache)
+    audio_data = get_audio_features.id_to_audio_feature(["id3", "id1", \
+    "id2"], cache)
+    assert audio_data["id"].tolist() == ["id3", "id1", "id2"]
+    assert stub_spotify.request_counts["/v1/audio-features/"] == 2
+    assert (cache.hits, cache.misses) == (2, 3)
+
+
+def test_find_audio_features_requests_each_id_once(get_audio_features, \
+stub_spotify):
+    """
+    Check that a Track ID on several charts is only requested once, in a
+    single batch, and that every chart entry is given the audio features of
+    its own Track ID.
+    """
+    id_dataframe = pd.DataFrame({"Date": ["2020-06-01"] * 4, "Song": ["a", \
+    "b", "a", "c"], "Artist": ["x"] * 4, "Track ID": ["id1", "id2", "id1", \
+    "id3"]}, index=[10, 11, 12, 13])
+    song_audio_data = get_audio_features.find_audio_features(id_dataframe, \
+    None)
+    assert stub_spotify.request_counts["/v1/audio-features/"] == 1
+    assert song_audio_data.index.tolist() == [10, 11, 12, 13]
+    assert song_audio_data["id"].tolist() == ["id1", "id2", "id1", "id3"]
+
+
+def test_track_store_matches_dataframe(tmp_path):
+    """
+    Check that the store keeps each Track ID once, that adding charts and
+    saving keep every appearance, including a track without audio features,
+    and that the averages and key proportions are the same as with the song
+    dataframe.
+    """
+    song_data = pd.read_csv(DATASET_PATH)
+    song_data.loc[song_data["Track ID"] == song_data["Track ID"][10], \
+    "danceability":] = np.nan
+    early = song_data["Date"] < "1990"
+    store = TrackStore.from_frame(song_data[early])
+    store.add(song_data[~early])
+    assert len(store) == len(song_data)
+    assert len(store.tracks) == song_data["Track ID"].nunique()
+    assert store.dedup_ratio > 1
+    assert "uri" not in store.tracks.columns
+    assert store.missing_ids(["new", song_data["Track ID"][0], "new", \
+    song_data["Track ID"][10]]) == ["new", song_data["Track ID"][10]]
+    assert store.to_frame(["Track ID"])["Track ID"].tolist() == \
+    song_data["Track ID"].tolist()
+
+    store.save(tmp_path / "tracks")
+    store = TrackStore.load(tmp_path / "tracks")
+    features = ["acousticness", "duration_ms"]
+    assert np.allclose(average_all(1961, 2020, features, store)["Average"], \
+    average_all(1961, 2020, features, song_data)["Average"], rtol=1e-6)
+    assert key_proportion(1961, 2020, store, by_mode=True).equals(\
+    key_proportion(1961, 2020, song_data, by_mode=True))
+
+
+def test_appearance_store_needs_appearance_offsets():
+    """
+    Check that a store that does not choose which years its appearances are
+    counted in cannot be created.
+    """
+    class IncompleteStore(AppearanceStore):
+        pass
+
+    with pytest.raises(TypeError):
+        IncompleteStore([], pd.DataFrame(), [], [])
+    with pytest.raises(TypeError):
+        AppearanceStore([], pd.DataFrame(), [], [])
+
+
+def test_find_audio_features_uses_track_store(get_audio_features, \
+stub_spotify):
+    """
+    Check that the audio features of tracks already in a TrackStore are taken
+    from the store, with the columns left out of it rebuilt, and that only
+    the other Track IDs are requested.
+    """
+    song_data = pd.read_csv(DATASET_PATH, index_col=0).head(3)
+    store = TrackStore.from_frame(song_data)
+    id_dataframe = pd.concat([song_data[["Date", "Song", "Artist", \
+    "Track ID"]], pd.DataFrame({"Date": ["2020-06-01"], "Song": ["new"], \
+    "Artist": ["artist"], "Track ID": ["new1"]})], ignore_index=True)
+
+    song_audio_data = get_audio_features.find_audio_features(id_dataframe, \
+    None, store=store)
+
+    assert stub_spotify.request_counts["/v1/audio-features/"] == 1
+    assert song_audio_data["id"].tolist() == id_dataframe["Track ID"]\
+    .tolist()
+    assert song_audio_data.head(3)[list(song_data.columns[5:])].equals(\
+    song_data.reset_index(drop=True)[list(song_data.columns[5:])])
+
+
+class FakeChartData:
+    """
+    A stand-in for billboard.ChartData that makes up a chart of three songs
+    for any date and counts the charts requested.
+    """
+    requested = []
+    failing_dates = set()
+
+    def __init__(self, name, date):
+        if date in self.failing_dates:
+            raise ConnectionError(f"Could not download {name} on {date}")
+        self.requested.append(date)
+        self.entries = [FakeChartEntry(f"Song {rank} of {date.year}", \
+        f"Artist {rank} & Friend") for rank in range(1, 4)]
+
+
+class FakeChartEntry:
+    """
+    A stand-in for one entry of a billboard.ChartData chart.
+    """
+
+    def __init__(self, title, artist):
+        self.title = title
+        self.artist = artist
+
+
+def test_hot_100_data_resumes(tmp_path, monkeypatch):
+    """
+    Check that the charts are collected in date order with cleaned artist
+    names, that a download interrupted by an error resumes from the saved
+    charts without downloading them again, and that iter_chart_songs yields
+    the same songs.
+    """
+    monkeypatch.setattr(FakeChartData, "requested", [])
+    monkeypatch.setattr(FakeChartData, "failing_dates", \
+    {datetime.date(2003, 6, 1)})
+    with pytest.raises(ConnectionError):
+        hot_100_data(2000, 2004, max_workers=1, checkpoint_dir=tmp_path, \
+        chart_data=FakeChartData)
+    assert len(FakeChartData.requested) == 4
+
+    FakeChartData.failing_dates = set()
+    all_hot_100 = hot_100_data(2000, 2004, max_workers=4, \
+    checkpoint_dir=tmp_path, chart_data=FakeChartData)
+    assert len(FakeChartData.requested) == 5
+    assert all_hot_100["Date"].tolist() == [datetime.date(year, 6, 1) for \
+    year in range(2000, 2005) for _ in range(3)]
+    assert all_hot_100["Song"].iloc[4] == "Song 2 of 2001"
+    assert all_hot_100["Artist"].iloc[4] == "artist 2   friend"
+    assert list(billboard_scraper.iter_chart_songs([datetime.date(2001, 6, \
+    1)], tmp_path, FakeChartData)) == list(all_hot_100.iloc[3:6].itertuples(\
+    index=False, name=None))
+    assert billboard_scraper.CLUTTERERS is normalization.CLUTTERERS
+
+
+def test_offline_record_and_replay(spotify_id_query, get_audio_features, \
+stub_spotify, tmp_path, monkeypatch):
+    """
+    Check that a run of the pipeline recorded in an archive is replayed with
+    the same results without downloading a chart or sending a request, even
+    when the default chart source and response cache are used, and that a
+    request that was not recorded is reported.
+    """
+    monkeypatch.setattr(FakeChartData, "requested", [])
+
+    # Fill the default cache with the searches first, so that a run that
+    # used it would leave them out of the archive.
+    cache = response_cache.DEFAULT_CACHE
+    monkeypatch.setattr(cache, "path", str(tmp_path / "cache.sqlite"))
+    monkeypatch.setattr(cache, "_connection", None)
+    spotify_id_query.query_all_tracks(hot_100_data(2000, 2001, \
+    chart_data=FakeChartData))
+    FakeChartData.requested.clear()
+
+    def run(session):
+        charts = hot_100_data(2000, 2000, max_workers=2, \
+        chart_data=session.chart_data)
+        charts = pd.concat([charts, hot_100_data(2001, 2001)], \
+        ignore_index=True)
+        ids = spotify_id_query.query_all_tracks(charts)
+        return get_audio_features.find_audio_features(ids)
+
+    archive_path = tmp_path / "archive.sqlite"
+    with replay.offline(archive_path, mode="record", \
+    chart_data=FakeChartData) as session:
+        recorded = run(session)
+        assert len(session.archive) == 2 + 6 + 1
+    request_counts = dict(stub_spotify.request_counts)
+
+    with replay.offline(archive_path) as session:
+        replayed = run(session)
+        with pytest.raises(replay.ReplayMissing):
+            hot_100_data(2002, 2002)
+    pd.testing.assert_frame_equal(replayed, recorded)
+    assert billboard_scraper.CHART_DATA is billboard.ChartData
+    assert cache.enabled and len(cache) == 6
+    assert len(FakeChartData.requested) == 2
+    assert stub_spotify.request_counts == request_counts
+
+
+def test_weekly_chart_store(tmp_path, monkeypatch):
+    """
+    Check that the weekly charts are stored with each song once, and that the
+    averages and key proportions count every week a song charted.
+    """
+    monkeypatch.setattr(FakeChartData, "requested", [])
+    store = weekly_chart_store(2000, 2001, max_workers=4, \
+    chart_data=FakeChartData)
+    assert len(FakeChartData.requested) == 105
+    assert all(date.weekday() == 5 for date in FakeChartData.requested)
+    assert (len(store), len(store.songs)) == (315, 6)
+    assert store.ranks[:3].tolist() == [1, 2, 3]
+
+    store.add_songs_data(pd.DataFrame({"Song": ["Song 1 of 2000", \
+    "Song 2 of 2000", "Song 1 of 2001"], "Artist": ["artist 1   friend", \
+    "artist 2   friend", "artist 1   friend"], "Loudness": [1.0, 3.0, 5.0], \
+    "key": [0, 2, 2], "mode": [1, 1, 1]}))
+    store.save(tmp_path / "charts")
+    store = ChartStore.load(tmp_path / "charts")
+
+    averages = average_all(2000, 2001, ["Loudness"], store)
+    assert averages["Average"].tolist() == [2.0, 5.0]
+    keys = key_proportion(2000, 2000, store)
+    assert keys["Count"].tolist() == [53, 53]
+    assert keys["Proportion"].tolist() == [0.5, 0.5]
+
+
+def test_update_dataset_only_fetches_new_dates(get_audio_features, \
+tmp_path, monkeypatch):
+    """
+    Check that updating the dataset only scrapes the missing charts, and that
+    the new songs are appended to the dataset file with the same columns.
+    """
+    update_dataset = importlib.import_module("update_dataset")
+    song_data = pd.read_csv(DATASET_PATH, index_col=0)
+    song_data = song_data[song_data["Date"] < "1963"]
+    csv_path = tmp_path / "songs.csv"
+    song_data.to_csv(csv_path)
+    SummaryIndex.from_songs(song_data).save(tmp_path / "songs.summary.npz")
+    monkeypatch.setattr(FakeChartData, "requested", [])
+
+    updated = update_dataset.update_dataset(csv_path, 1961, 1964, \
+    chart_data=FakeChartData, cache=None)
+
+    assert FakeChartData.requested == [datetime.date(1963, 6, 1), \
+    datetime.date(1964, 6, 1)]
+    saved = pd.read_csv(csv_path, index_col=0)
+    assert list(saved.columns) == list(song_data.columns)
+    assert len(saved) == len(song_data) + 6
+    assert saved["Date"].iloc[-1] == "1964-06-01"
+    assert saved["Song"].iloc[-1] == "Song 3 of 1964"
+    assert len(updated) == len(saved)
+    index = SummaryIndex.load(tmp_path / "songs.summary.npz")
+    assert index.years == [1961, 1962, 1963, 1964]
+    assert index.count[:, 0].sum() == len(saved)
+
+
+def test_update_dataset_leaves_out_failed_charts(get_audio_features, \
+stub_spotify, tmp_path, monkeypatch):
+    """
+    Check that a chart whose audio feature batch failed is not written, and
+    is fetched again by the next update.
+    """
+    update_dataset = importlib.import_module("update_dataset")
+    spotify_id_query = importlib.import_module("spotify_id_query")
+    song_data = pd.read_csv(DATASET_PATH, index_col=0)
+    song_data = song_data[song_data["Date"] < "1963"]
+    csv_path = tmp_path / "songs.csv"
+    song_data.to_csv(csv_path)
+    SummaryIndex.from_songs(song_data).save(tmp_path / "songs.summary.npz")
+    monkeypatch.setattr(FakeChartData, "requested", [])
+    monkeypatch.setattr(get_audio_features, "BATCH_SIZE", 3)
+
+    # Fail the batch of the 1964 chart only.
+    stub_spotify.invalid_ids = {spotify_id_query.query_track(\
+    spotify_id_query.normalize_query("Song 1 of 1964"), \
+    spotify_id_query.normalize_query(clean_artist("Artist 1 & Friend")), \
+    cache=None)}
+    updated = update_dataset.update_dataset(csv_path, 1961, 1964, \
+    chart_data=FakeChartData, cache=None)
+    assert updated.attrs["incomplete_dates"] == ["1964-06-01"]
+    saved = pd.read_csv(csv_path, index_col=0)
+    assert len(saved) == len(song_data) + 3
+    assert "1964-06-01" not in set(saved["Date"])
+    assert SummaryIndex.load(tmp_path / "songs.summary.npz").years[-1] == 1963
+
+    stub_spotify.invalid_ids = set()
+    updated = update_dataset.update_dataset(csv_path, 1961, 1964, \
+    chart_data=FakeChartData, cache=None)
+    assert updated.attrs["incomplete_dates"] == []
+    assert FakeChartData.requested[-1:] == [datetime.date(1964, 6, 1)]
+    assert len(pd.read_csv(csv_path, index_col=0)) == len(song_data) + 6
+    assert SummaryIndex.load(tmp_path / "songs.summary.npz").years[-1] == 1964
+
+
+def test_summary_index_matches_dataframe(tmp_path):
+    """
+    Check that an index built in two parts and saved answers the averages and
+    key proportions exactly like the song dataframe, and that a saved index
+    lacking a requested feature is rebuilt.
+    """
+    song_data = pd.read_csv(DATASET_PATH)
+    early = song_data["Date"] < "1990"
+    index = SummaryIndex.from_songs(song_data[early])
+    index.update(song_data[~early])
+    index.save(tmp_path / "songs.summary.npz")
+    index = SummaryIndex.load(tmp_path / "songs.summary.npz")
+
+    features = ["acousticness", "duration_ms"]
+    from_index = average_all(1960, 2020, features, index)
+    from_songs = average_all(1960, 2020, features, song_data)
+    assert (from_index["Average"] - from_songs["Average"]).abs().max() < 1e-9
+    assert key_proportion(1961, 2020, index).equals(key_proportion(1961, \
+    2020, song_data))
+    durations = song_data.loc[song_data["Date"] == "1961-06-01", \
+    "duration_ms"]
+    column = index.features.index("duration_ms")
+    assert (index.min[0, column], index.max[0, column]) == \
+    (durations.min(), durations.max())
+
+    csv_path = tmp_path / "songs.csv"
+    song_data.to_csv(csv_path, index=False)
+    assert summary_index.load_or_build(str(csv_path), ["energy"]).features \
+    == ["energy"]
+    index = summary_index.load_or_build(str(csv_path), ["tempo"])
+    assert index.features == ["energy", "tempo"]
+    assert summary_index.load_or_build(str(csv_path)).features == ["energy", \
+    "tempo"]
+
+
+def test_feature_matrix_matches_dataframe(tmp_path):
+    """
+    Check that the memory-mapped feature matrix, exported from a dataframe or
+    streamed from the CSV file, gives the same averages (to float32
+    precision) and key proportions as the song dataframe.
+    """
+    song_data = pd.read_csv(DATASET_PATH)
+    feature_matrix.export_features(song_data.sample(frac=1, \
+    random_state=0), tmp_path / "frame")
+    feature_matrix.export_csv(DATASET_PATH, tmp_path / "csv", chunk_rows=500)
+    matrix = feature_matrix.FeatureMatrix.open(tmp_path / "csv")
+    assert isinstance(matrix.features, np.memmap)
+    assert (matrix.starts[-1], len(matrix.dates)) == (len(song_data), 60)
+
+    features = ["tempo", "duration_ms", "valence"]
+    from_songs = average_all(1960, 2020, features, song_data)
+    for directory in ["frame", "csv"]:
+        matrix = feature_matrix.FeatureMatrix.open(tmp_path / directory)
+        from_matrix = average_all(1960, 2020, features, matrix)
+        assert np.allclose(from_matrix["Average"], from_songs["Average"], \
+        rtol=1e-6, equal_nan=True)
+        assert key_proportion(1961, 2020, matrix, by_mode=True).equals(\
+        key_proportion(1961, 2020, song_data, by_mode=True))
+
+
+def test_feature_matrix_category_averages(tmp_path):
+    """
+    Check that the mode and time signature of a feature matrix average like
+    those of the song dataframe, leaving out the songs missing them.
+    """
+    song_data = pd.read_csv(DATASET_PATH)
+    song_data.loc[song_data.index[::7], "mode"] = np.nan
+    song_data.loc[song_data.index[::5], "time_signature"] = np.nan
+    feature_matrix.export_features(song_data, tmp_path)
+    matrix = feature_matrix.FeatureMatrix.open(tmp_path)
+    features = ["mode", "time_signature", "tempo"]
+    assert np.allclose(average_all(1961, 2020, features, matrix)["Average"], \
+    average_all(1961, 2020, features, song_data)["Average"], rtol=1e-6, \
+    equal_nan=True)
+
+    song_data.iloc[::-1].to_csv(tmp_path / "reversed.csv")
+    with pytest.raises(ValueError):
+        feature_matrix.export_csv(tmp_path / "reversed.csv", tmp_path / "bad")
+
+
+@pytest.mark.parametrize("file_name", ["songs.parquet", "songs.feather"])
+def test_song_storage_round_trip(file_name, tmp_path):
+    """
+    Check that the dataset saved as a typed columnar file loads with its
+    stored types, that only the requested columns are read, that songs
+    without audio features are kept, and that the analysis functions give
+    the same results as with the CSV dataset.
+    """
+    song_data = pd.read_csv(DATASET_PATH)
+    song_data.loc[10, "danceability":] = np.nan
+    path = tmp_path / file_name
+    song_storage.save_songs(song_data, path)
+
+    typed = song_storage.load_songs(path)
+    assert typed.loc[10, ["mode", "duration_ms", "time_signature"]].isna()\
+    .all()
+    assert str(typed["mode"].dtype) == "Int8"
+    assert "uri" not in typed.columns
+    assert str(typed["Date"].dtype) == "datetime64[ns]"
+    assert str(typed["danceability"].dtype) == "float32"
+    assert str(typed["key"].dtype) == "category"
+    assert list(song_storage.load_songs(path, ["Date", "key"]).columns) == \
+    ["Date", "key"]
+    assert key_proportion(1961, 2020, typed, by_mode=True).equals(\
+    key_proportion(1961, 2020, song_data, by_mode=True))
+    averages = average_all(1961, 2020, ["danceability", "duration_ms"], \
+    typed)["Average"]
+    expected = average_all(1961, 2020, ["danceability", "duration_ms"], \
+    song_data)["Average"]
+    assert (averages - expected).abs().max() < 1e-6
+
+
+def test_stream_dataset(get_audio_features, stub_spotify, tmp_path, \
+monkeypatch):
+    """
+    Check that streaming the charts through the search and audio feature steps
+    writes every song found in Spotify with its audio features, that songs
+    whose audio features could not be requested are recorded and written by
+    retry_failed, and that an error in one step stops the pipeline and is
+    raised.
+    """
+    streaming_pipeline = importlib.import_module("streaming_pipeline")
+    monkeypatch.setattr(FakeChartData, "requested", [])
+    output_path = tmp_path / "songs.csv"
+
+    written = streaming_pipeline.stream_dataset(output_path, 2000, 2003, \
+    search_workers=3, requests_per_second=1000, queue_size=2, batch_size=5, \
+    chart_data=FakeChartData, cache=None)
+
+    songs = pd.read_csv(output_path)
+    assert written == len(songs) == 12
+    assert sorted(songs["Song"]) == sorted(f"Song {rank} of {year}" for \
+    rank in range(1, 4) for year in range(2000, 2004))
+    assert (songs["id"] == songs["Track ID"]).all()
+    assert stub_spotify.request_counts["/v1/audio-features/"] == 3
+    assert list(songs.columns) == streaming_pipeline.OUTPUT_COLUMNS
+    assert not os.path.exists(streaming_pipeline.failed_path(output_path))
+
+    # Fail the first audio feature request, and answer the second with the
+    # columns in another order and one missing.
+    original = get_audio_features.id_to_audio_feature
+    calls = []
+    def id_to_audio_feature(track_ids, cache):
+        calls.append(track_ids)
+        if len(calls) == 1:
+            raise RequestFailed("Rate limited")
+        if len(calls) == 2:
+            return pd.DataFrame({"tempo": 1.0, "id": track_ids})
+        return original(track_ids, cache)
+    monkeypatch.setattr(get_audio_features, "id_to_audio_feature", \
+    id_to_audio_feature)
+    written = streaming_pipeline.stream_dataset(output_path, 2000, 2003, \
+    search_workers=1, requests_per_second=1000, batch_size=5, \
+    chart_data=FakeChartData, cache=None)
+    assert written == 7
+    failed = pd.read_csv(streaming_pipeline.failed_path(output_path))
+    assert len(failed) == 5
+    assert streaming_pipeline.retry_failed(output_path, cache=None) == 5
+    songs = pd.read_csv(output_path)
+    assert len(songs) == 12
+    assert (songs["id"] == songs["Track ID"]).all()
+    assert songs["tempo"].notna().all()
+    assert not os.path.exists(streaming_pipeline.failed_path(output_path))
+
+    monkeypatch.setattr(FakeChartData, "failing_dates", \
+    {datetime.date(2002, 6, 1)})
+    with pytest.raises(ConnectionError):
+        streaming_pipeline.stream_dataset(output_path, 2000, 2003, \
+        chart_data=FakeChartData, cache=None)
+
+
+def test_retry_policy_backoff():
+    """
+    Check that the pause between attempts doubles after each failure up to
+    the longest pause, and that jitter never waits longer than that.
+    """
+    policy = RetryPolicy(base_delay=1.0, max_delay=5.0, jitter=False)
+    assert [policy.delay(attempt) for attempt in range(1, 6)] == [1.0, 2.0, \
+    4.0, 5.0, 5.0]
+    jittered = RetryPolicy(base_delay=1.0, max_delay=5.0)
+    assert all(0 <= jittered.delay(4) <= 5.0 for _ in range(100))
+
+
+def test_send_with_retry(stub_spotify):
+    """
+    Check that failing requests are retried until they succeed, that the
+    request is given up after the allowed number of attempts, and that
+    failures retrying cannot fix are not retried.
+    """
+    policy = RetryPolicy(max_attempts=30, base_delay=0.001, max_delay=0.001)
+    search_url = stub_spotify.base_url + "search?q=halo"
+    stub_spotify.error_rate = 0.5
+    response = send_with_retry(lambda: requests.get(search_url), policy)
+    assert response.status_code == 200
+
+    stub_spotify.error_rate = 1.0
+    with pytest.raises(RequestFailed) as failure:
+        send_with_retry(lambda: requests.get(search_url), RetryPolicy(\
+        max_attempts=3, base_delay=0.001))
+    assert failure.value.attempts == 3
+    assert failure.value.response.status_code == 500
+
+    stub_spotify.error_rate = 0.0
+    with pytest.raises(RequestFailed) as failure:
+        send_with_retry(lambda: requests.get(stub_spotify.base_url + \
+        "missing"), policy)
+    assert failure.value.attempts == 1
+
+    # A Retry-After date is waited for, and an unreadable one is replaced by
+    # the policy's delay.
+    assert retry_after_seconds("2.5") == 2.5
+    assert 50 < retry_after_seconds(email.utils.format_datetime(\
+    datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(\
+    seconds=60), usegmt=True)) <= 60
+    assert retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert retry_after_seconds("soon") is None
+    stub_spotify.rate_limit_every = 2
+    stub_spotify.retry_after = "soon"
+    start = time.perf_counter()
+    for _ in range(2):
+        send_with_retry(lambda: requests.get(search_url), policy)
+    assert time.perf_counter() - start < 1
+
+
+def test_refresh_token_on_401(spotify_id_query, stub_spotify):
+    """
+    Check that a request rejected with HTTP 401 is sent once more with a new
+    access token, and fails if the new token is rejected too.
+    """
+    spotify_id_query.query_track("halo", "beyonce", cache=None)
+    stub_spotify.unauthorized = 1
+    assert spotify_id_query.query_track("montero", "lil nas x", \
+    cache=None) is not None
+    assert stub_spotify.request_counts["/api/token"] == 2
+
+    stub_spotify.unauthorized = 2
+    with pytest.raises(RequestFailed) as failure:
+        spotify_id_query.query_track("levitating", "dua lipa", cache=None)
+    assert failure.value.response.status_code == 401
+    assert failure.value.attempts == 2
+    assert stub_spotify.request_counts["/api/token"] == 3
+
+
+def test_find_audio_features_partial_failure(get_audio_features, \
+stub_spotify, tmp_path):
+    """
+    Check that a failing batch does not stop the other batches, that its songs
+    are given missing audio features and recorded, and that running again
+    with the same cache only requests the failed Track IDs.
+    """
+    id_dataframe = pd.DataFrame({"Date": ["2020-06-01"] * 250, "Song": \
+    ["song"] * 250, "Artist": ["artist"] * 250, "Track ID": [f"id{number}" \
+    for number in range(250)]})
+    cache = ResponseCache(tmp_path / "cache.sqlite")
+    policy = RetryPolicy(max_attempts=1)
+
+    # Rate limit every second request and send one batch at a time, so that
+    # the first batch of 100 succeeds, the second fails, and the last
+    # succeeds.
+    stub_spotify.rate_limit_every = 2
+    song_audio_data = get_audio_features.find_audio_features(id_dataframe, \
+    cache, policy, max_workers=1)
+
+    assert song_audio_data.attrs["failed_ids"] == [f"id{number}" for number \
+    in range(100, 200)]
+    assert song_audio_data["danceability"].isna().sum() == 100
+    assert (song_audio_data["id"].dropna() == song_audio_data["Track ID"]\
+    [song_audio_data["id"].notna()]).all()
+
+    stub_spotify.rate_limit_every = 0
+    song_audio_data = get_audio_features.find_audio_features(id_dataframe, \
+    cache, policy)
+    assert song_audio_data.attrs["failed_ids"] == []
+    assert (song_audio_data["id"] == song_audio_data["Track ID"]).all()
+    assert cache.misses == 100 + 250
+
+
+def test_spotify_client_reuses_connections(stub_spotify):
+    """
+    Check that requests sent through the client reuse one kept-alive
+    connection, unlike separate requests.get calls, and that each request is
+    timed.
+    """
+    client = SpotifyClient(pool_size=2)
+    for _ in range(10):
+        assert client.get(stub_spotify.base_url + "search?q=halo")\
+        .status_code == 200
+    assert len(stub_spotify.client_addresses) == 1
+
+    for _ in range(10):
+        requests.get(stub_spotify.base_url + "search?q=halo")
+    assert len(stub_spotify.client_addresses) == 11
+
+    stats = client.latency_stats()
+    assert stats["count"] == 10
+    assert 0 < stats["p50"] <= stats["p95"] <= stats["max"]
+
+
+def test_benchmark_results_compared(tmp_path):
+    """
+    Check that saved benchmark results are matched with new ones by what was
+    measured, and that a large slowdown is marked as a regression.
+    """
+    benchmark = importlib.import_module("benchmark")
+    baseline = {"analytics": pd.DataFrame({"Function": ["average_all", \
+    "key_proportion"], "Rows": [5000, 5000], "Seconds": [1.0, 2.0]})}
+    benchmark.save_results(baseline, tmp_path / "baseline.json")
+    results = {"analytics": pd.DataFrame({"Function": ["key_proportion", \
+    "average_all"], "Rows": [5000, 5000], "Seconds": [2.1, 1.5]})}
+
+    comparison = benchmark.compare_results(tmp_path / "baseline.json", \
+    results, threshold=0.1)
+    assert comparison["Baseline Seconds"].tolist() == [2.0, 1.0]
+    assert comparison["Regression"].tolist() == [False, True]
+
+
+def test_instrumentation(spotify_id_query, stub_spotify):
+    """
+    Check that the search stage counts its requests, retries, body bytes, and
+    rows, that the metrics are exported, and that a stage can be profiled
+    from the main thread only, one stage at a time.
+    """
+    METRICS.reset()
+    stub_spotify.rate_limit_every = 3
+    stub_spotify.retry_after = "0.01"
+    track_dataframe = pd.DataFrame({"Date": ["2020-06-01"] * 4, "Song": \
+    ["halo", "halo", "montero", "levitating"], "Artist": ["beyonce"] * 4})
+    spotify_id_query.query_all_tracks(track_dataframe, max_workers=1, \
+    cache=None)
+
+    stages = METRICS.snapshot()["stages"]
+    assert stages["search"]["calls"] == 1
+    assert stages["search"]["rows"] == 4
+    assert (stages["search"]["requests"], stages["search"]["retries"]) == \
+    (4, 1)
+    assert stages["search"]["decoded_body_bytes"] > 0
+    assert 'pop_music_retries_total{stage="search"} 1' in \
+    METRICS.to_prometheus().splitlines()
+
+    # Profile a stage, then check that it is not profiled again inside
+    # another profiled stage or from a worker thread.
+    METRICS.enable_profiling("average_all", memory=True)
+    average_all(2020, 2020, ["Loudness"], test_dataframe_1)
+    assert METRICS.snapshot()["profiles"]["average_all"]["peak_memory"] > 0
+    METRICS.reset()
+    METRICS.enable_profiling("outer")
+    with METRICS.stage("outer"):
+        average_all(2020, 2020, ["Loudness"], test_dataframe_1)
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        executor.submit(average_all, 2020, 2020, ["Loudness"], \
+        test_dataframe_1).result()
+    METRICS.disable_profiling("average_all")
+    METRICS.disable_profiling("outer")
+    assert list(METRICS.snapshot()["profiles"]) == ["outer"]
+    assert METRICS.snapshot()["stages"]["average_all"]["calls"] == 2
+
+
+def test_import_without_credentials(tmp_path):
+    """
+    Check that the Spotify modules can be imported without the credential
+    files or a network connection.
+    """
+    result = subprocess.run([sys.executable, "-c", \
+    "import get_audio_features"], cwd=tmp_path, env={**os.environ, \
+    "PYTHONPATH": os.path.dirname(DATASET_PATH)}, capture_output=True, \
+    text=True, check=False)
+    assert result.returncode == 0, result.stderr
+
+
+def test_token_provider_refresh(stub_spotify):
+    """
+    Check that the token is only requested when first needed, is reused while
+    valid, and is requested again once it is about to expire.
+    """
+    credential_reads = []
+    provider = TokenProvider(stub_spotify.auth_url, lambda: \
+    credential_reads.append(1) or ("stub-client", "stub-secret"))
+    assert credential_reads == []
+
+    assert provider.headers() == {"Authorization": "Bearer stub-token"}
+    provider.token()
+    assert stub_spotify.request_counts["/api/token"] == 1
+
+    provider.refresh_margin = 3600
+    provider.token()
+    assert stub_spotify.request_counts["/api/token"] == 2
+    assert len(credential_reads) == 2
+
+
+def test_song_query_matches_dataframe_filters():
+    """
+    Check that a query finds the same songs as filtering the dataframe row by
+    row, that narrowing a query leaves the original unchanged, and that its
+    averages leave out missing values.
+    """
+    song_data = pd.read_csv(DATASET_PATH, index_col=0)
+    table = SongTable.from_frame(song_data.sample(frac=1, random_state=0))
+    query = table.query().between("1990-01-01", "1999-12-31").mode(0)\
+    .where("tempo", maximum=90)
+    expected = song_data[(song_data["Date"] >= "1990") & (song_data["Date"] \
+    < "2000") & (song_data["mode"] == 0) & (song_data["tempo"] <= 90)]
+    songs = query.select("Date", "Song", "tempo").to_frame()
+    assert list(songs.columns) == ["Date", "Song", "tempo"]
+    assert sorted(songs["Song"]) == sorted(expected["Song"])
+    assert songs["Date"].is_monotonic_increasing
+
+    artist = song_data["Artist"].iloc[0]
+    by_artist = query.artist(artist, "nobody")
+    assert by_artist.count() == ((expected["Artist"] == artist).sum())
+    assert query.count() == len(expected)
+    assert table.query().years(2000).between(end="2000-05-31").count() == 0
+    assert table.query().key(0, 7).years(2000, 2020).mean(["energy"])\
+    ["energy"] == pytest.approx(song_data[song_data["key"].isin([0, 7]) & \
+    (song_data["Date"] >= "2000")]["energy"].mean())
+    assert np.isnan(table.query().artist("nobody").mean(["energy"])\
+    ["energy"])
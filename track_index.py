@@ -0,0 +1,233 @@
+"""
+Find the Spotify Track IDs of songs without searching Spotify, from the songs
+whose Track IDs are already known. Each known song is stored under its match
+key (see normalization.match_key) and in inverted indexes from the trigrams
+(runs of three characters) of its title and of its artist to the songs
+containing them. A song written exactly the same way is found with one
+dictionary lookup, and a song written slightly differently is found by
+counting the title and artist trigrams it shares with each known song. Every
+match comes with a confidence between 0 and 1, so that only the songs without
+a confident match need to be searched in Spotify.
+"""
+
+# Import the required libraries.
+import numpy as np
+import pandas as pd
+
+from normalization import canonical_text, canonical_texts
+
+# The lowest confidence of a match used instead of searching Spotify.
+MIN_CONFIDENCE = 0.8
+
+
+def trigrams(text):
+    """
+    Return the set of runs of three characters in a text, padded with spaces
+    so that the starts and ends of words count as well.
+
+    Args:
+        text: A string, such as a match key.
+
+    Returns:
+        A set of three character strings.
+    """
+    padded = f"  {text} "
+    return {padded[position:position + 3] for position in \
+    range(len(padded) - 2)}
+
+
+def similarity(first, second):
+    """
+    Return how alike two texts are, as the fraction of trigrams they share
+    (the Dice coefficient of their trigram sets) once written canonically.
+
+    Args:
+        first: A string, such as a song title and artist.
+        second: Another string.
+
+    Returns:
+        A float between 0 (no trigrams in common) and 1 (the same text).
+    """
+    first, second = trigrams(canonical_text(first)), \
+    trigrams(canonical_text(second))
+    return 2 * len(first & second) / (len(first) + len(second))
+
+
+class TrackIndex:
+    """
+    The songs whose Spotify Track IDs are known, indexed for exact and fuzzy
+    lookups by title and artist.
+    """
+
+    # The parts of a song indexed separately, in the order of its key.
+    PARTS = ("title", "artist")
+
+    def __init__(self):
+        self._keys = []
+        self._track_ids = []
+        self._sizes = {part: [] for part in self.PARTS}
+        self._numbers = {}
+        self._postings = {}
+        self._arrays = {}
+
+    @classmethod
+    def from_frame(cls, track_dataframe, title_column="Song", \
+    artist_column="Artist", id_column="Track ID"):
+        """
+        Return the index of the songs in a dataframe.
+
+        Args:
+            track_dataframe: A Pandas dataframe with a title, an artist, and a
+            Track ID column, such as the song dataset, the dataframe returned
+            by spotify_id_query.query_all_tracks, or a catalog of Spotify
+            tracks.
+            title_column: A string containing the name of the title column.
+            artist_column: A string containing the name of the artist column.
+            id_column: A string containing the name of the Track ID column.
+
+        Returns:
+            A TrackIndex.
+        """
+        index = cls()
+        index.add(track_dataframe, title_column, artist_column, id_column)
+        return index
+
+    @classmethod
+    def from_catalog(cls, path, title_column="name", artist_column="artists", \
+    id_column="id"):
+        """
+        Return the index of a catalog of Spotify tracks saved as a CSV file,
+        such as a bulk dump of the Spotify tracks of the Hot 100 years.
+
+        Args:
+            path: A string containing the path of the CSV file.
+            title_column: A string containing the name of the title column.
+            artist_column: A string containing the name of the artist column.
+            The artists may be written as a list, since punctuation is left
+            out of the match keys.
+            id_column: A string containing the name of the Track ID column.
+
+        Returns:
+            A TrackIndex.
+        """
+        return cls.from_frame(pd.read_csv(path, usecols=[title_column, \
+        artist_column, id_column]), title_column, artist_column, id_column)
+
+    def __len__(self):
+        """
+        Return the number of distinct songs in the index.
+        """
+        return len(self._keys)
+
+    def add(self, track_dataframe, title_column="Song", \
+    artist_column="Artist", id_column="Track ID"):
+        """
+        Add the songs in a dataframe to the index. Songs without a Track ID
+        are skipped, and a song already in the index keeps its first Track ID.
+
+        Args:
+            track_dataframe: A Pandas dataframe, as described in from_frame.
+            title_column: A string containing the name of the title column.
+            artist_column: A string containing the name of the artist column.
+            id_column: A string containing the name of the Track ID column.
+        """
+        track_ids = track_dataframe[id_column]
+        found = (track_ids.notna() & (track_ids != "Error: Not in Spotify"))\
+        .to_numpy()
+        title_keys = canonical_texts(track_dataframe[title_column][found])
+        artist_keys = canonical_texts(track_dataframe[artist_column][found])
+        for title_key, artist_key, track_id in zip(title_keys, artist_keys, \
+        track_ids[found]):
+            key = f"{title_key}|{artist_key}"
+            if pd.isna(title_key) or pd.isna(artist_key) or key in \
+            self._numbers:
+                continue
+            number = len(self._keys)
+            self._numbers[key] = number
+            self._keys.append(key)
+            self._track_ids.append(track_id)
+            for part, part_key in zip(self.PARTS, (title_key, artist_key)):
+                part_trigrams = trigrams(part_key)
+                self._sizes[part].append(len(part_trigrams))
+                for trigram in part_trigrams:
+                    self._postings.setdefault((part, trigram), []).append(\
+                    number)
+        self._arrays = {}
+
+    def lookup(self, title, artist):
+        """
+        Return the Track ID of the known song most like a song, and how
+        confident the match is.
+
+        The confidence is the smaller of the title and artist similarities,
+        each the share of the trigrams of both texts that they have in common
+        (their Jaccard index). Songs by the same artist therefore only match
+        when their titles are nearly the same, so 'Love Me' is not taken for
+        'Love Me Do'.
+
+        Args:
+            title: A string containing the title of the song.
+            artist: A string containing the name(s) of the artist(s).
+
+        Returns:
+            A tuple of the Track ID string (or None if no known song shares
+            a title and an artist trigram with the song) and the confidence
+            of the match, a float between 0 and 1 that is 1 when the match
+            keys are equal.
+        """
+        part_keys = (canonical_text(title), canonical_text(artist))
+        number = self._numbers.get("|".join(part_keys))
+        if number is not None:
+            return self._track_ids[number], 1.0
+
+        # Count the title and artist trigrams each known song shares with the
+        # song, and keep the known song whose less similar part is the most
+        # similar.
+        scores = None
+        for part, part_key in zip(self.PARTS, part_keys):
+            part_trigrams = trigrams(part_key)
+            postings = [self._array((part, trigram)) for trigram in \
+            part_trigrams if (part, trigram) in self._postings]
+            if not postings:
+                return None, 0.0
+            shared = np.bincount(np.concatenate(postings), \
+            minlength=len(self))
+            part_scores = shared / (len(part_trigrams) + self._array(part) - \
+            shared)
+            scores = part_scores if scores is None else np.minimum(scores, \
+            part_scores)
+        number = int(np.argmax(scores))
+        if scores[number] == 0:
+            return None, 0.0
+        return self._track_ids[number], float(scores[number])
+
+    def lookup_many(self, titles, artists):
+        """
+        Look up several songs.
+
+        Args:
+            titles: A list of song titles.
+            artists: A list of artist names, in the same order.
+
+        Returns:
+            A Pandas dataframe with the columns Track ID and Confidence and
+            one row per song, in order.
+        """
+        matches = [self.lookup(title, artist) for title, artist in \
+        zip(titles, artists)]
+        return pd.DataFrame(matches, columns=["Track ID", "Confidence"], \
+        dtype=object).astype({"Confidence": np.float64})
+
+    def _array(self, posting):
+        """
+        Return the numbers of the songs containing a (part, trigram) posting
+        as a numpy array, or the number of trigrams in one part of every song
+        if posting is a part name. The arrays are made when first needed
+        after songs are added.
+        """
+        array = self._arrays.get(posting)
+        if array is None:
+            array = np.array(self._sizes[posting] if posting in self.PARTS \
+            else self._postings[posting], dtype=np.int64)
+            self._arrays[posting] = array
+        return array
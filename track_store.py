@@ -0,0 +1,203 @@
+"""
+Store the song dataset with every Spotify track once. The dataset repeats the
+Track ID, audio features, and Spotify URLs of a song on every chart it
+appears on, so instead each track is kept once in a table of tracks, keyed by
+its Track ID, and each chart appearance is a row of two small integers: the
+chart date and the track. The URL columns, which can be rebuilt from the
+Track ID, are left out. The storage and the averaging and key counting are
+shared with ChartStore (see appearance_store). The audio features of tracks
+already in the store can be given to get_audio_features.find_audio_features
+so that they are not requested again.
+"""
+
+# Import the required libraries.
+import os
+import numpy as np
+import pandas as pd
+
+import aggregation
+from appearance_store import AppearanceStore
+from song_storage import AUDIO_FEATURE_COLUMNS
+
+# The audio feature columns left out of the store, rebuilt from the Track ID.
+REBUILT_COLUMNS = {
+    "type": lambda track_id: "audio_features",
+    "id": lambda track_id: track_id,
+    "uri": lambda track_id: f"spotify:track:{track_id}",
+    "track_href": lambda track_id: \
+    f"https://api.spotify.com/v1/tracks/{track_id}",
+    "analysis_url": lambda track_id: \
+    f"https://api.spotify.com/v1/audio-analysis/{track_id}",
+}
+
+
+class TrackStore(AppearanceStore):
+    """
+    The song dataset as a table of unique tracks and a table of chart
+    appearances, keyed by Track ID.
+
+    Attributes:
+        dates: A numpy datetime64[D] array containing every chart date, in
+        order.
+        items: A Pandas dataframe with one row per Track ID, whose row number
+        is the track's number, also available as tracks. It has the Track ID,
+        Song, and Artist columns (as first written on the charts) and the
+        audio features.
+        date_ids: A numpy int16 array containing the position in dates of the
+        chart of each appearance.
+        item_ids: A numpy int32 array containing the number of the track of
+        each appearance.
+    """
+
+    ITEMS_FILE = "tracks.parquet"
+    ITEM_COLUMN = "Track"
+
+    @property
+    def tracks(self):
+        """
+        The table of unique tracks.
+        """
+        return self.items
+
+    @classmethod
+    def from_frame(cls, song_dataframe):
+        """
+        Return the store of a song dataframe.
+
+        Args:
+            song_dataframe: A Pandas dataframe containing the song dataset,
+            with Date and Track ID columns. Songs without a Track ID are
+            left out, and the columns listed in song_storage.REDUNDANT_COLUMNS
+            are dropped.
+
+        Returns:
+            A TrackStore.
+        """
+        song_dataframe = song_dataframe[song_dataframe["Track ID"].notna()]
+        track_numbers, _ = pd.factorize(song_dataframe["Track ID"])
+        dates, tracks, date_ids = cls.split_frame(song_dataframe, \
+        track_numbers)
+        return cls(dates, tracks, date_ids, track_numbers)
+
+    @property
+    def dedup_ratio(self):
+        """
+        The number of chart appearances per unique track.
+        """
+        return len(self) / max(len(self.items), 1)
+
+    def add(self, song_dataframe):
+        """
+        Add the songs of newly added charts to the store. Tracks already in
+        the store keep their stored columns, and only the appearances of
+        their new charts are added.
+
+        Args:
+            song_dataframe: A Pandas dataframe containing the new songs, in
+            the format described in from_frame.
+        """
+        new = TrackStore.from_frame(song_dataframe)
+        positions = pd.Index(self.items["Track ID"]).get_indexer(\
+        new.items["Track ID"])
+        fresh = positions < 0
+        numbers = np.where(fresh, len(self.items) + np.cumsum(fresh) - 1, \
+        positions)
+        self.items = pd.concat([self.items, new.items[fresh]], \
+        ignore_index=True)
+
+        # Renumber the chart dates of both stores in the combined dates.
+        dates = np.union1d(self.dates, new.dates)
+        self.date_ids = np.concatenate([np.searchsorted(dates, \
+        self.dates)[self.date_ids], np.searchsorted(dates, \
+        new.dates)[new.date_ids]]).astype(np.int16)
+        self.item_ids = np.concatenate([self.item_ids, \
+        numbers[new.item_ids]]).astype(np.int32)
+        self.dates = dates
+
+    def audio_features(self, track_ids):
+        """
+        Return the stored audio features of Track IDs, in the format of
+        Spotify's audio-features endpoint, so that they do not have to be
+        requested again. The columns left out of the store are rebuilt from
+        the Track ID.
+
+        Args:
+            track_ids: A list of Track ID strings.
+
+        Returns:
+            A dictionary mapping each Track ID stored with audio features to
+            a dictionary of its audio features. Track IDs that are not in the
+            store, or whose audio features are all missing, are left out.
+        """
+        features = [column for column in AUDIO_FEATURE_COLUMNS if column in \
+        self.items.columns]
+        if not features:
+            return {}
+        positions = pd.Index(self.items["Track ID"]).get_indexer(list(\
+        dict.fromkeys(track_ids)))
+        found = self.items.iloc[positions[positions >= 0]]
+        found = found[found[features].notna().any(axis=1)]
+        records = {}
+        for record in found[["Track ID"] + features].astype(object)\
+        .to_dict("records"):
+            track_id = record.pop("Track ID")
+            stored = {column: None if pd.isna(value) else value for column, \
+            value in record.items()}
+            stored.update({column: rebuild(track_id) for column, rebuild in \
+            REBUILT_COLUMNS.items()})
+            records[track_id] = {column: stored[column] for column in \
+            AUDIO_FEATURE_COLUMNS if column in stored}
+        return records
+
+    def missing_ids(self, track_ids):
+        """
+        Return the Track IDs whose audio features are not in the store yet,
+        each once, so that only their audio features have to be requested.
+
+        Args:
+            track_ids: A list of Track ID strings.
+
+        Returns:
+            A list of the new Track IDs, in the order they first appear.
+        """
+        known = self.audio_features(track_ids)
+        return [track_id for track_id in dict.fromkeys(track_ids) if \
+        track_id not in known]
+
+    def appearance_offsets(self, start_date, end_date):
+        """
+        Return the offset of each appearance's year from the start of the time
+        period, or -1 for appearances not counted, following the June 1st
+        rule of aggregation.year_offsets. Each chart date is only parsed once.
+
+        Args:
+            start_date: An integer containing the first year of the period.
+            end_date: An integer containing the last year of the period.
+
+        Returns:
+            A numpy integer array with one entry per appearance.
+        """
+        return aggregation.year_offsets(self.dates, start_date, end_date)[\
+        self.date_ids]
+
+
+def storage_report(csv_path, directory):
+    """
+    Return how much smaller the dataset is as a TrackStore than as a CSV
+    file, and how many chart appearances there are per track.
+
+    Args:
+        csv_path: A string containing the path of the CSV dataset.
+        directory: A string containing the path of a folder the store is
+        saved in.
+
+    Returns:
+        A dictionary containing the number of 'appearances' and 'tracks', the
+        'dedup_ratio', and the 'csv_bytes' and 'store_bytes' on disk.
+    """
+    store = TrackStore.from_frame(pd.read_csv(csv_path))
+    store.save(directory)
+    return {"appearances": len(store), "tracks": len(store.items), \
+    "dedup_ratio": store.dedup_ratio, "csv_bytes": os.path.getsize(csv_path), \
+    "store_bytes": sum(os.path.getsize(os.path.join(directory, name)) for \
+    name in ["tracks.parquet", "appearances.parquet"])}
@@ -0,0 +1,315 @@
+"""
+Calculate trend statistics of the audio features beyond the yearly average:
+the standard deviation, averages and standard deviations over a rolling window
+of years, quantiles such as the median, and averages weighted by chart
+position so that the #1 song counts more than the #100 song. Every statistic
+is calculated for all the years and all the features together, from the same
+yearly counts and sums used by music_feature, rather than by scanning the
+songs again for each statistic and feature.
+"""
+
+# Import the required libraries.
+import datetime
+import numpy as np
+import pandas as pd
+
+import aggregation
+from appearance_store import AppearanceStore
+from feature_matrix import FeatureMatrix
+from summary_index import SummaryIndex
+
+# The statistics calculated unless others are asked for.
+STATISTICS = ["mean", "std", "rolling mean", "rolling std", "quantiles", \
+"rank-weighted mean"]
+
+# The statistics that need the individual songs rather than a SummaryIndex.
+SONG_STATISTICS = {"quantiles", "rank-weighted mean"}
+
+
+def chart_positions(song_dataframe):
+    """
+    Return the chart position of every song.
+
+    Args:
+        song_dataframe: A Pandas dataframe containing the song dataset. If it
+        has a Rank column, the ranks are used. Otherwise the songs are assumed
+        to be in chart order within each date, as they are in
+        track_features_by_date.csv, and numbered from 1. Songs that could not
+        be found in Spotify are missing from the dataset, so these positions
+        are only approximately the ranks.
+
+    Returns:
+        A numpy integer array containing the position of each song.
+    """
+    if "Rank" in song_dataframe.columns:
+        return song_dataframe["Rank"].to_numpy(dtype=np.int64)
+    return song_dataframe.groupby("Date", sort=False).cumcount().to_numpy() \
+    + 1
+
+
+def rank_weights(positions, chart_size=100):
+    """
+    Return the weight of each song in the rank-weighted mean, falling linearly
+    from chart_size for the #1 song to 1 for the last song on the chart.
+
+    Args:
+        positions: A numpy integer array containing the chart positions.
+        chart_size: An integer containing the number of songs on a chart.
+
+    Returns:
+        A numpy float array containing the weights.
+    """
+    return np.clip(chart_size + 1 - positions, 1, None).astype(np.float64)
+
+
+def trend_statistics(start_date, end_date, features, song_dataframe, \
+statistics=None, window=5, quantiles=(0.25, 0.5, 0.75)):
+    """
+    Return a dataframe containing trend statistics of the given features for
+    each year.
+
+    The songs are assigned to their years once, and the counts, sums, sums of
+    squares, and rank-weighted sums of every feature are accumulated for all
+    the years in the same way as in music_feature.average_all. The rolling
+    statistics are then found from running totals of these sums, and the
+    quantiles from one sort of the songs by year and value.
+
+    Args:
+        start_date: An integer containing the first year of the time period.
+
+        end_date: An integer that must be greater than or equal to start_date
+        containing the last year of the time period.
+
+        features: A list of strings that specifies the names of the features,
+        such as ['duration_ms', 'instrumentalness'].
+
+        song_dataframe: A Pandas dataframe containing the song dataset, as
+        used by music_feature.average_all. A ChartStore, TrackStore, or
+        FeatureMatrix can be given instead, and a SummaryIndex for the
+        statistics that are not in SONG_STATISTICS.
+
+        statistics: A list of strings naming the statistics to calculate,
+        taken from STATISTICS. Defaults to all of them.
+
+        window: An integer containing the number of years in the rolling
+        window, which ends at each year.
+
+        quantiles: A tuple of floats between 0 and 1 containing the quantiles
+        calculated by the 'quantiles' statistic.
+
+    Returns:
+        A Pandas dataframe with the columns Date, Feature, Statistic, and
+        Value, in the long format used for plotting. Quantiles are named like
+        'quantile 0.5'. Statistics of years without enough songs are NaN.
+
+    Raises:
+        ValueError: If a statistic is unknown, or needs the individual songs
+        and a SummaryIndex was given.
+        TypeError: If song_dataframe is none of the types above.
+    """
+    statistics = list(STATISTICS if statistics is None else statistics)
+    unknown = set(statistics) - set(STATISTICS)
+    if unknown:
+        raise ValueError(f"Unknown statistics: {sorted(unknown)}")
+    year_count = end_date - start_date + 1
+
+    # Accumulate the count, sum, and sum of squares of every year at once.
+    if isinstance(song_dataframe, SummaryIndex):
+        if SONG_STATISTICS & set(statistics):
+            raise ValueError(f"{sorted(SONG_STATISTICS & set(statistics))} "
+            "need the song dataframe rather than a summary index")
+        counts, sums = song_dataframe.feature_sums(start_date, end_date, \
+        features)
+        sumsqs = song_dataframe.feature_sumsqs(start_date, end_date, \
+        features)
+    else:
+        offsets, values, positions = song_values(start_date, end_date, \
+        features, song_dataframe, "rank-weighted mean" in statistics)
+        counts, sums = aggregation.feature_sums(offsets, values, year_count)
+        _, sumsqs = aggregation.feature_sums(offsets, values ** 2, \
+        year_count)
+
+    results = {}
+    if "mean" in statistics:
+        results["mean"] = _divide(sums, counts)
+    if "std" in statistics:
+        results["std"] = _std(counts, sums, sumsqs)
+
+    # Sum each window of years from the running totals of every year.
+    if "rolling mean" in statistics or "rolling std" in statistics:
+        window_counts, window_sums, window_sumsqs = [_window_totals(totals, \
+        window) for totals in (counts, sums, sumsqs)]
+        if "rolling mean" in statistics:
+            results["rolling mean"] = _divide(window_sums, window_counts)
+        if "rolling std" in statistics:
+            results["rolling std"] = _std(window_counts, window_sums, \
+            window_sumsqs)
+
+    if "quantiles" in statistics:
+        for quantile, result in zip(quantiles, _quantiles(offsets, values, \
+        counts, quantiles)):
+            results[f"quantile {quantile:g}"] = result
+
+    # Weight each song's values by its chart position.
+    if "rank-weighted mean" in statistics:
+        weights = rank_weights(positions)[:, np.newaxis]
+        present_weights = np.where(np.isnan(values), np.nan, weights)
+        _, weight_totals = aggregation.feature_sums(offsets, present_weights, \
+        year_count)
+        _, weighted_sums = aggregation.feature_sums(offsets, values * \
+        weights, year_count)
+        results["rank-weighted mean"] = _divide(weighted_sums, weight_totals)
+
+    # Lay out the statistics feature by feature, as the plots expect.
+    years = [datetime.date(year, 6, 1) for year in range(start_date, \
+    end_date + 1)]
+    names = list(results)
+    stacked = np.stack([results[name] for name in names])
+    return pd.DataFrame({
+        "Date": years * (len(features) * len(names)),
+        "Feature": [feature for feature in features for _ in names for _ in \
+        years],
+        "Statistic": [name for _ in features for name in names for _ in \
+        years],
+        "Value": stacked.transpose(2, 0, 1).reshape(-1),
+    })
+
+
+def song_values(start_date, end_date, features, songs, with_positions=False):
+    """
+    Return the year offset, feature values, and chart position of every song
+    of a song dataframe, chart store, track store, or feature matrix.
+
+    Args:
+        start_date: An integer containing the first year of the time period.
+        end_date: An integer containing the last year of the time period.
+        features: A list of strings containing the names of the features.
+        songs: A Pandas dataframe, AppearanceStore, or FeatureMatrix. The
+        songs of a store are counted in the years chosen by its
+        appearance_offsets, and only the June 1st charts of a feature matrix
+        are read, with a missing key, mode, or time signature as NaN.
+        with_positions: A boolean that is True to find the chart positions
+        (see chart_positions).
+
+    Returns:
+        A tuple of a numpy integer array of year offsets (-1 for songs not
+        counted), a two dimensional numpy float array with one row per song
+        and one column per feature, and a numpy integer array of chart
+        positions, or None if with_positions is False.
+
+    Raises:
+        TypeError: If songs is none of the types above.
+    """
+    if isinstance(songs, FeatureMatrix):
+        year_rows = songs.year_rows(start_date, end_date)
+        offsets = np.concatenate([np.full(stop - start, offset, \
+        dtype=np.int64) for offset, start, stop in year_rows] + \
+        [np.zeros(0, dtype=np.int64)])
+        values = np.concatenate([np.column_stack([songs.float_column(\
+        feature, start, stop) for feature in features]) for _, start, stop \
+        in year_rows] + [np.zeros((0, len(features)))])
+        positions = np.concatenate([np.arange(1, stop - start + 1) for _, \
+        start, stop in year_rows] + [np.zeros(0, dtype=np.int64)]) if \
+        with_positions else None
+        return offsets, values, positions
+
+    if isinstance(songs, AppearanceStore):
+        offsets = songs.appearance_offsets(start_date, end_date)
+        songs = songs.to_frame(list(features))
+    elif isinstance(songs, pd.DataFrame):
+        offsets = aggregation.year_offsets(songs["Date"], start_date, \
+        end_date)
+    else:
+        raise TypeError("trend_statistics needs a song dataframe, "
+        f"ChartStore, TrackStore, FeatureMatrix, or SummaryIndex, not "
+        f"{type(songs).__name__}")
+    values = songs[list(features)].to_numpy(dtype=np.float64, \
+    na_value=np.nan)
+    return offsets, values, chart_positions(songs) if with_positions else \
+    None
+
+
+def plot_frame(statistics_frame, statistic):
+    """
+    Return one statistic from the frame returned by trend_statistics in the
+    format returned by music_feature.average_all, so that it can be plotted
+    in the same way.
+
+    Args:
+        statistics_frame: A Pandas dataframe returned by trend_statistics.
+        statistic: A string containing the name of the statistic.
+
+    Returns:
+        A Pandas dataframe with the columns Date, Feature, and Average.
+    """
+    selected = statistics_frame[statistics_frame["Statistic"] == statistic]
+    return selected[["Date", "Feature", "Value"]].rename(columns={"Value": \
+    "Average"}).reset_index(drop=True)
+
+
+def _divide(numerators, denominators):
+    """
+    Divide two arrays, leaving NaN where the denominator is zero.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominators > 0, numerators / denominators, np.nan)
+
+
+def _std(counts, sums, sumsqs):
+    """
+    Return the sample standard deviation from counts, sums, and sums of
+    squares, or NaN where fewer than two values were counted.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        variances = (sumsqs - sums ** 2 / counts) / (counts - 1)
+    return np.where(counts > 1, np.sqrt(np.clip(variances, 0, None)), np.nan)
+
+
+def _window_totals(totals, window):
+    """
+    Return the sum of each year's totals and those of the window - 1 years
+    before it.
+    """
+    running = np.cumsum(np.vstack([np.zeros((1, totals.shape[1])), totals]), \
+    axis=0)
+    starts = np.maximum(np.arange(1, len(totals) + 1) - window, 0)
+    return running[1:] - running[starts]
+
+
+def _quantiles(offsets, values, counts, quantiles):
+    """
+    Return each quantile of every feature for every year, interpolating
+    linearly between values like numpy.quantile.
+
+    The songs are sorted by year and then by value for every feature at once,
+    so the values of a year are next to each other with the missing values
+    last, and each quantile can be read from its position in that order.
+    """
+    selected = offsets >= 0
+    offsets, values = offsets[selected], values[selected]
+    order = np.lexsort((values, np.broadcast_to(offsets[:, np.newaxis], \
+    values.shape)), axis=0)
+    sorted_values = np.take_along_axis(values, order, axis=0)
+
+    # Find where each year starts in the sorted songs.
+    songs_per_year = np.bincount(offsets, minlength=len(counts))
+    starts = np.concatenate([[0], np.cumsum(songs_per_year)[:-1]])
+    feature_columns = np.arange(values.shape[1])
+
+    results = []
+    for quantile in quantiles:
+        positions = starts[:, np.newaxis] + quantile * np.maximum(counts - \
+        1, 0)
+        lower = np.floor(positions).astype(np.int64)
+        upper = np.ceil(positions).astype(np.int64)
+        if len(sorted_values) == 0:
+            results.append(np.full(counts.shape, np.nan))
+            continue
+        lower_values = sorted_values[np.minimum(lower, len(sorted_values) - \
+        1), feature_columns]
+        upper_values = sorted_values[np.minimum(upper, len(sorted_values) - \
+        1), feature_columns]
+        result = lower_values + (positions - lower) * (upper_values - \
+        lower_values)
+        results.append(np.where(counts > 0, result, np.nan))
+    return results
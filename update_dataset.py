@@ -0,0 +1,214 @@
+"""
+Bring the song dataset stored in track_features_by_date.csv up to date without
+rebuilding it from scratch. Only the Billboard Hot 100 charts whose dates are
+not in the dataset yet are scraped, searched in Spotify, and given audio
+features, and the new songs are then merged into the dataset file in one
+atomic write. Charts with a song whose search or audio feature request failed
+are left out, so that the next update fetches them again.
+"""
+
+# Import the required libraries.
+import datetime
+import os
+import tempfile
+import pandas as pd
+
+import billboard_scraper
+import get_audio_features
+import spotify_id_query
+import summary_index
+from response_cache import DEFAULT_CACHE
+from track_index import TrackIndex
+from track_store import TrackStore
+
+# The song dataset provided with the repository.
+DATASET_PATH = "track_features_by_date.csv"
+
+
+def latest_chart_year(today=None):
+    """
+    Return the last year whose June 1st chart has already been published.
+
+    Args:
+        today: A date object containing the current date. Defaults to today.
+
+    Returns:
+        An integer containing the year.
+    """
+    today = today or datetime.date.today()
+    return today.year if today >= datetime.date(today.year, 6, 1) else \
+    today.year - 1
+
+
+def missing_chart_dates(song_dataframe, year_start, year_end):
+    """
+    Return the dates of the charts within the specified years that have no
+    songs in the dataset yet.
+
+    Args:
+        song_dataframe: A Pandas dataframe containing the song dataset, with a
+        Date column of date strings or date objects.
+        year_start: An integer containing the first year of the time period.
+        year_end: An integer containing the last year of the time period.
+
+    Returns:
+        A list of the date objects of the missing charts, in order.
+    """
+    existing_dates = set(pd.to_datetime(song_dataframe["Date"]).dt.date)
+    return [chart_date for chart_date in billboard_scraper.chart_dates(\
+    year_start, year_end) if chart_date not in existing_dates]
+
+
+def merge_songs(song_dataframe, new_songs):
+    """
+    Return the song dataset with new songs added, sorted by date.
+
+    The new songs are given the same columns as the dataset, and the stale row
+    numbers left in columns such as 'Unnamed: 0' by earlier saves are
+    renumbered.
+
+    Args:
+        song_dataframe: A Pandas dataframe containing the song dataset.
+        new_songs: A Pandas dataframe containing the new songs and their audio
+        features, as returned by get_audio_features.find_audio_features.
+
+    Returns:
+        A Pandas dataframe containing every song in the dataset and the new
+        songs, with the same columns as the dataset.
+    """
+    new_songs = new_songs.assign(Date=new_songs["Date"].astype(str))
+    merged = pd.concat([song_dataframe, new_songs.reindex(\
+    columns=song_dataframe.columns)], ignore_index=True)
+
+    # Keep the songs on each chart in chart order while sorting the dates.
+    merged = merged.sort_values("Date", kind="stable", ignore_index=True)
+    for column in merged.columns:
+        if column.startswith("Unnamed"):
+            merged[column] = merged.index
+    return merged
+
+
+def incomplete_dates(billboard_data, spotify_id_data, new_songs):
+    """
+    Return the chart dates with a song whose search or audio feature request
+    failed.
+
+    Args:
+        billboard_data: A Pandas dataframe containing the Date, Song, and
+        Artist of every song on the new charts.
+        spotify_id_data: The Pandas dataframe returned by
+        spotify_id_query.query_all_tracks for these songs.
+        new_songs: The Pandas dataframe returned by
+        get_audio_features.find_audio_features for spotify_id_data.
+
+    Returns:
+        A set of the dates, as in the Date columns.
+    """
+    failed_songs = set(spotify_id_data.attrs["failed_songs"])
+    failed_ids = set(new_songs.attrs["failed_ids"])
+    failed_searches = [(title, artist) in failed_songs for title, artist in \
+    zip(billboard_data["Song"], billboard_data["Artist"])]
+    return set(billboard_data["Date"][failed_searches]) | \
+    set(new_songs["Date"][new_songs["Track ID"].isin(failed_ids)])
+
+
+def write_atomically(song_dataframe, csv_path):
+    """
+    Save the song dataset as a CSV file, replacing the old file only once the
+    new one has been completely written.
+
+    Args:
+        song_dataframe: A Pandas dataframe containing the song dataset.
+        csv_path: A string containing the path of the CSV file.
+    """
+    directory = os.path.dirname(os.path.abspath(csv_path))
+    with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".tmp", \
+    delete=False, newline="") as f:
+        temporary_path = f.name
+        song_dataframe.to_csv(f)
+    os.replace(temporary_path, csv_path)
+
+
+def update_dataset(csv_path=DATASET_PATH, year_start=1961, year_end=None, \
+checkpoint_dir=None, chart_data=None, cache=DEFAULT_CACHE):
+    """
+    Return the song dataset after adding the songs of every missing chart to
+    the dataset file.
+
+    Work out which chart dates within the specified years are missing from the
+    dataset, then run the scrape, search, and audio feature steps for those
+    dates only. Songs already in the dataset are given their Track IDs from a
+    TrackIndex of the dataset rather than being searched again, and their
+    audio features from a TrackStore of the dataset rather than being
+    requested again. If no charts are missing, the file is left untouched. A
+    summary index saved next to the dataset (see summary_index) is updated
+    with the new songs.
+
+    The songs of a chart are only added once all of them have been searched
+    and given audio features. A chart with a failed request is left out of
+    the file, so that the next update finds it missing and fetches it again.
+
+    Args:
+        csv_path: A string containing the path of the dataset CSV file.
+
+        year_start: An integer containing the first year of the dataset.
+
+        year_end: An integer containing the last year to bring the dataset up
+        to. Defaults to the latest year whose chart has been published.
+
+        checkpoint_dir: A string containing the path of a folder the
+        downloaded charts are saved in, or None to not save the charts.
+
+        chart_data: The class used to download a chart, called like
+        billboard.ChartData, or None to use billboard_scraper.CHART_DATA.
+
+        cache: A ResponseCache storing earlier Spotify responses, or None to
+        not use a cache.
+
+    Returns:
+        A Pandas dataframe containing the updated song dataset. Its
+        attrs["incomplete_dates"] is a sorted list of the dates of the charts
+        left out because a request failed.
+    """
+    song_dataframe = pd.read_csv(csv_path, index_col=0)
+    if year_end is None:
+        year_end = latest_chart_year()
+
+    # Find the charts that are not in the dataset yet.
+    new_dates = missing_chart_dates(song_dataframe, year_start, year_end)
+    if not new_dates:
+        return song_dataframe
+
+    # Run each step of the pipeline for the new charts only.
+    billboard_data = billboard_scraper.fetch_charts(new_dates, \
+    checkpoint_dir=checkpoint_dir, chart_data=chart_data)
+    spotify_id_data = spotify_id_query.query_all_tracks(billboard_data, \
+    cache=cache, index=TrackIndex.from_frame(song_dataframe))
+    new_songs = get_audio_features.find_audio_features(spotify_id_data, \
+    cache=cache, store=TrackStore.from_frame(song_dataframe))
+
+    # Leave out the charts with a failed request, so that they are still
+    # missing the next time the dataset is updated.
+    left_out = incomplete_dates(billboard_data, spotify_id_data, new_songs)
+    new_songs = new_songs[~new_songs["Date"].isin(left_out)]
+    if new_songs.empty:
+        song_dataframe.attrs["incomplete_dates"] = sorted(map(str, left_out))
+        return song_dataframe
+
+    # Add the new songs to the dataset and save it in one step.
+    song_dataframe = merge_songs(song_dataframe, new_songs)
+    write_atomically(song_dataframe, csv_path)
+
+    # Add the new songs to the summary index saved next to the dataset, if
+    # there is one, after the dataset so that the index is not seen as stale.
+    index_path = summary_index.index_path(str(csv_path))
+    if os.path.exists(index_path):
+        index = summary_index.SummaryIndex.load(index_path)
+        index.update(new_songs)
+        index.save(index_path)
+    song_dataframe.attrs["incomplete_dates"] = sorted(map(str, left_out))
+    return song_dataframe
+
+
+if __name__ == "__main__":
+    update_dataset()